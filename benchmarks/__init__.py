@@ -0,0 +1,13 @@
+"""
+Benchmark suite for indexing, searching and live updates.
+
+    python -m benchmarks [--files N] [--depth D] [--fanout F] [--names STYLE]
+                         [--file-size BYTES] [--duplicates SHARE]
+
+A synthetic tree is generated once in the work directory and reused as
+long as its parameters don't change. Every case runs in a fresh
+interpreter against its own configuration and database, with Qt on the
+offscreen platform, so the suite runs headless and never touches
+`~/.ziton`. Results are compared against `benchmarks/baseline.json`,
+`--save-baseline` records the current run as the new baseline.
+"""
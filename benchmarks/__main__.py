@@ -0,0 +1,261 @@
+"""
+Runs the benchmark cases and compares them against a stored baseline.
+
+Exits with 1 if a metric regressed by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+import toml
+
+from benchmarks import treegen
+from benchmarks.cases import CASES
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+
+# differences below these are noise, whatever the relative change
+NOISE_FLOOR = {"_ms": 1.0, "_s": 0.05, "_mb": 2.0}
+
+
+def direction(metric):
+    """1 if higher values of `metric` are better, -1 if lower ones are,
+    0 if it is informational only."""
+    if metric.endswith("_per_s"):
+        return 1
+    if metric.endswith(tuple(NOISE_FLOOR)):
+        return -1
+    return 0
+
+
+def write_config(workdir, tree, args):
+    """Configuration of the benchmark's own home directory."""
+    home = os.path.join(workdir, "home")
+    os.makedirs(os.path.join(home, ".ziton"), exist_ok=True)
+    config = {
+        "included_directories": [tree],
+        "index_on_startup": False,
+        "live_updates": False,
+        "hidden_files": False,
+        "database_path": os.path.join(home, ".ziton", "database.db"),
+        "excluded_directories": [],
+        "excluded_folders": [],
+        "min_on_launch": False,
+        "scan_workers": args.workers,
+        "scan_processes": args.processes,
+        "batch_size": 50000,
+        "write_buffer_mb": 64,
+        "incremental_updates": True,
+        "search_backend": "sqlite",
+    }
+    with open(os.path.join(home, ".ziton", "config.toml"), "w") as outfile:
+        outfile.write(toml.dumps(config))
+    return home
+
+
+def run_case(case, params, home):
+    """Run `case` in a fresh interpreter, returns its metrics."""
+    env = dict(os.environ, HOME=home)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])
+    )
+    process = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cases", case, json.dumps(params)],
+        env=env,
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        sys.stderr.write(process.stderr)
+        raise RuntimeError(f"Benchmark '{case}' failed")
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def median_metrics(runs):
+    """Median of every numeric metric over repeated runs of a case."""
+    metrics = dict(runs[0])
+    for name, value in metrics.items():
+        values = [run[name] for run in runs if run.get(name) is not None]
+        if isinstance(value, (int, float)) and values:
+            metrics[name] = statistics.median(values)
+    return metrics
+
+
+def regressions(results, baseline, tolerance):
+    """`(case, metric, baseline, current)` of the metrics that got worse
+    by more than `tolerance`, relative to the baseline."""
+    found = []
+    for case, metrics in results.items():
+        for name, value in metrics.items():
+            old = baseline.get(case, {}).get(name)
+            sign = direction(name)
+            if not sign or not isinstance(value, (int, float)):
+                continue
+            if not isinstance(old, (int, float)) or old <= 0:
+                continue
+            change = (value - old) / old * sign
+            floor = next(v for k, v in NOISE_FLOOR.items() if name.endswith(k))
+            if change < -tolerance and (sign > 0 or value - old > floor):
+                found.append((case, name, old, value))
+    return found
+
+
+def report(results, baseline):
+    """Print every metric next to its baseline value."""
+    for case, metrics in results.items():
+        print(f"{case}:")
+        if "skipped" in metrics:
+            print(f"    skipped, {metrics['skipped']}")
+            continue
+        for name, value in metrics.items():
+            if not isinstance(value, (int, float)):
+                continue
+            line = f"    {name:<24}{value:>14,.3f}"
+            old = baseline.get(case, {}).get(name)
+            if isinstance(old, (int, float)) and old:
+                line += f"  ({(value - old) / old:+.1%} vs {old:,.3f})"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark indexing, searching and live updates.",
+    )
+    parser.add_argument("--files", type=int, default=treegen.TreeSpec.files)
+    parser.add_argument("--depth", type=int, default=treegen.TreeSpec.depth)
+    parser.add_argument("--fanout", type=int, default=treegen.TreeSpec.fanout)
+    parser.add_argument(
+        "--names", choices=treegen.NAME_STYLES, default=treegen.TreeSpec.names
+    )
+    parser.add_argument("--seed", type=int, default=treegen.TreeSpec.seed)
+    parser.add_argument(
+        "--file-size",
+        type=int,
+        default=treegen.TreeSpec.file_size,
+        help="median file size in bytes, 0 for empty files",
+    )
+    parser.add_argument(
+        "--duplicates",
+        type=float,
+        default=treegen.TreeSpec.duplicates,
+        help="share of files copying another one",
+    )
+    parser.add_argument("--workers", type=int, default=0, help="scan workers")
+    parser.add_argument(
+        "--processes", action="store_true", help="scan with processes"
+    )
+    parser.add_argument(
+        "--cases",
+        default=",".join(CASES),
+        help="comma separated cases to run, in order",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per case, the median counts"
+    )
+    parser.add_argument(
+        "--queries", type=int, default=20, help="searches per pattern"
+    )
+    parser.add_argument(
+        "--storm", type=int, default=10000, help="files per event storm"
+    )
+    parser.add_argument(
+        "--samples", type=int, default=20, help="single live changes timed"
+    )
+    parser.add_argument(
+        "--workdir",
+        default=os.path.join(tempfile.gettempdir(), "ziton-benchmark"),
+        help="where the tree and the database are kept between runs",
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store this run as baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.15, help="allowed relative slowdown"
+    )
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(",")
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    spec = treegen.TreeSpec(
+        args.files,
+        args.depth,
+        args.fanout,
+        args.names,
+        args.seed,
+        args.file_size,
+        args.duplicates,
+    )
+    tree = os.path.join(args.workdir, "tree")
+    start = time.perf_counter()
+    if treegen.generate(tree, spec):
+        print(f"Generated {spec} in {time.perf_counter() - start:.1f}s")
+    home = write_config(args.workdir, tree, args)
+    params = {
+        "root": tree,
+        "queries": args.queries,
+        "storm": args.storm,
+        "samples": args.samples,
+    }
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r") as infile:
+            stored = json.load(infile)
+        if stored["spec"] == asdict(spec):
+            baseline = stored["results"]
+        else:
+            print(f"Baseline was recorded for {stored['spec']}, not comparing")
+
+    results = {}
+    for case in cases:
+        if case != "rebuild" and "rebuild" not in results:
+            # the other cases need an index of the current tree
+            if not os.path.exists(os.path.join(home, ".ziton", "database.db")):
+                run_case("rebuild", params, home)
+        runs = []
+        for _ in range(args.repeat):
+            runs.append(run_case(case, params, home))
+            if "skipped" in runs[-1]:
+                break
+        results[case] = median_metrics(runs)
+    report(results, baseline)
+
+    run = {
+        "spec": asdict(spec),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(run, outfile, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as outfile:
+            json.dump(run, outfile, indent=2)
+        print(f"Saved baseline -> '{args.baseline}'")
+        return 0
+
+    found = regressions(results, baseline, args.tolerance)
+    for case, name, old, value in found:
+        print(f"REGRESSION {case}.{name}: {old:,.3f} -> {value:,.3f}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Benchmark cases, each one is run in a fresh interpreter by the runner so
+its peak memory is measured on its own.
+
+    python -m benchmarks.cases CASE PARAMS
+
+`PARAMS` is a JSON object, the case's metrics are printed as one JSON
+object on the last line of the output. Metric names end with their unit,
+see `benchmarks.__main__.direction`.
+"""
+import json
+import os
+import resource
+import sqlite3
+import sys
+import time
+
+# query patterns, from huge LIKE scans to no match at all
+PATTERNS = ("a", "re", "data", "report", "final draft", ".py", "2019", "zzqx")
+
+# rows fetched for the first page, like the table view does
+FIRST_PAGE = 256
+
+# seconds between two looks at the index while waiting for the monitor
+WAIT_POLL = 0.002
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples, prefix=""):
+    """p50/p95/p99/max in milliseconds of `samples` in seconds."""
+    ordered = sorted(samples)
+
+    def at(q):
+        return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))] * 1000
+
+    return {
+        f"{prefix}p50_ms": at(0.5),
+        f"{prefix}p95_ms": at(0.95),
+        f"{prefix}p99_ms": at(0.99),
+        f"{prefix}max_ms": ordered[-1] * 1000,
+    }
+
+
+def wait_until(condition, timeout):
+    """Poll `condition`, returns the time it became true or None."""
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return None
+        time.sleep(WAIT_POLL)
+    return time.perf_counter()
+
+
+def rebuild(params):
+    """Full rebuild into an empty database."""
+    from ziton import database as db
+    from ziton.config import CONFIG
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(CONFIG.database_path + suffix):
+            os.remove(CONFIG.database_path + suffix)
+    start = time.perf_counter()
+    db.build_database()
+    seconds = time.perf_counter() - start
+    rows = db.number_of_rows()
+    return {
+        "rows": rows,
+        "rebuild_s": seconds,
+        "rows_per_s": rows / seconds,
+        "database_mb": os.path.getsize(CONFIG.database_path) / 2**20,
+    }
+
+
+def incremental(params):
+    """Update of an index that is already up to date."""
+    from ziton import database as db
+
+    start = time.perf_counter()
+    db.update_database()
+    return {"update_s": time.perf_counter() - start}
+
+
+def search_latency(backend, queries):
+    """Time `queries` searches per pattern on `backend`: the first page
+    alone, the first page plus the number of matches, and the first page
+    of the matches sorted by size, largest first."""
+    first, full, by_size, by_pattern = [], [], [], {}
+    for pattern in PATTERNS:
+        samples = []
+        for _ in range(queries):
+            start = time.perf_counter()
+            result = backend.search(pattern)
+            result.rows(0, FIRST_PAGE)
+            first.append(time.perf_counter() - start)
+            result.count()
+            samples.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            backend.search(pattern, sort=("size", True)).rows(0, FIRST_PAGE)
+            by_size.append(time.perf_counter() - start)
+        full.extend(samples)
+        by_pattern[pattern] = percentiles(samples)["p50_ms"]
+    metrics = percentiles(first, "first_page_")
+    metrics.update(percentiles(full))
+    metrics.update(percentiles(by_size, "by_size_"))
+    metrics["patterns"] = by_pattern
+    return metrics
+
+
+def search_sqlite(params):
+    """Search latency of the SQLite backend."""
+    from ziton import search
+    from ziton.config import CONFIG
+
+    start = time.perf_counter()
+    backend = search.SqliteBackend(CONFIG.database_path)
+    load = time.perf_counter() - start
+    metrics = search_latency(backend, params["queries"])
+    metrics["load_s"] = load
+    return metrics
+
+
+def search_memory(params):
+    """Search latency of the in-memory backend."""
+    from ziton import search
+    from ziton.config import CONFIG
+
+    start = time.perf_counter()
+    backend = search.MemoryBackend(CONFIG.database_path)
+    backend.reload()
+    load = time.perf_counter() - start
+    metrics = search_latency(backend, params["queries"])
+    metrics["load_s"] = load
+    return metrics
+
+
+def duplicates(params):
+    """Duplicate search with an empty hash cache, and again with the
+    hashes of the first run cached."""
+    from ziton import database as db
+    from ziton import duplicates as dup
+
+    conn = db.connect()
+    with conn:
+        conn.execute("DELETE FROM hashes;")
+    conn.close()
+    start = time.perf_counter()
+    result = dup.find_duplicates()
+    metrics = {
+        "groups": len(result.groups),
+        "duplicate_files": result.count(),
+        "uncached_s": time.perf_counter() - start,
+    }
+    start = time.perf_counter()
+    dup.find_duplicates()
+    metrics["cached_s"] = time.perf_counter() - start
+    return metrics
+
+
+def startup(params):
+    """Time from launch until the window is shown and until it displayed
+    its first search results, while the index is checked in the
+    background, and until that check finished."""
+    started = time.perf_counter()
+    try:
+        from PySide2.QtCore import QEventLoop
+        from PySide2.QtWidgets import QApplication
+        from ziton.app import STARTUP_SECONDS, Mainwindow
+    except ImportError as e:
+        return {"skipped": f"{e.name} is not installed"}
+    from ziton import database as db
+
+    db.init_database()
+    app = QApplication(["ziton-benchmark"])
+    window = Mainwindow(started)
+    loop = QEventLoop()
+    window.searchReady.connect(loop.quit)
+    window.show()
+    metrics = {"window_s": time.perf_counter() - started}
+    window.menubar.start_update(db.startup_update)
+    loop.exec_()
+    metrics["first_search_s"] = STARTUP_SECONDS.get(stage="first_search")
+    window.menubar.thread.wait()
+    metrics["checked_s"] = time.perf_counter() - started
+    window.view.stop_search()
+    app.processEvents()
+    return metrics
+
+
+def gui_search(params):
+    """Time from starting a search in the table view until its first page
+    is painted, through the search worker and the model."""
+    try:
+        from PySide2.QtCore import QEventLoop
+        from PySide2.QtWidgets import QApplication
+    except ImportError:
+        return {"skipped": "PySide2 is not installed"}
+    from ziton import search
+    from ziton.config import CONFIG
+    from ziton.widgets.tableview import Tableview
+
+    app = QApplication(["ziton-benchmark"])
+    view = Tableview(search.SqliteBackend(CONFIG.database_path))
+    loop = QEventLoop()
+    view.model().modelReset.connect(loop.quit)
+    # an empty search, like the window starts with
+    view.start_search()
+    loop.exec_()
+    samples = []
+    for pattern in PATTERNS:
+        for _ in range(params["queries"]):
+            start = time.perf_counter()
+            view.pattern = pattern
+            view.start_search()
+            loop.exec_()
+            view.viewport().repaint()
+            samples.append(time.perf_counter() - start)
+    view.stop_search()
+    app.processEvents()
+    return percentiles(samples)
+
+
+def live_updates(params):
+    """Lag between filesystem changes and the index, for a storm of
+    creations and deletions and for single changes."""
+    try:
+        from PySide2.QtCore import QCoreApplication
+        from ziton.monitor import FileMonitor
+    except ImportError as e:
+        return {"skipped": f"{e.name} is not installed"}
+    from ziton.config import CONFIG
+    from ziton.database import DirectoryTree
+
+    root = params["root"]
+    storm = params["storm"]
+    conn = sqlite3.connect(CONFIG.database_path)
+    root_id = DirectoryTree(conn).dir_id(root)
+    indexed_dirs = conn.execute("SELECT COUNT(*) FROM dirs").fetchone()[0]
+
+    def indexed(pattern="storm_*"):
+        query = "SELECT COUNT(*) FROM files WHERE dir_id = ? AND filename GLOB ?"
+        return conn.execute(query, (root_id, pattern)).fetchone()[0]
+
+    app = QCoreApplication.instance() or QCoreApplication(["ziton-benchmark"])
+    monitor = FileMonitor()
+    monitor.worker.start()
+    start = time.perf_counter()
+    ready = wait_until(lambda: len(monitor.watched) >= indexed_dirs, 600)
+    metrics = {"watch_s": ready - start if ready else None}
+    names = [os.path.join(root, f"storm_{number:07d}") for number in range(storm)]
+
+    start = time.perf_counter()
+    for name in names:
+        with open(name, "wb"):
+            pass
+    created = time.perf_counter()
+    done = wait_until(lambda: indexed() == storm, 120)
+    metrics["storm_create_lag_s"] = done - created if done else None
+    metrics["storm_create_per_s"] = storm / (done - start) if done else None
+
+    start = time.perf_counter()
+    for name in names:
+        os.remove(name)
+    removed = time.perf_counter()
+    done = wait_until(lambda: indexed() == 0, 120)
+    metrics["storm_delete_lag_s"] = done - removed if done else None
+    metrics["storm_delete_per_s"] = storm / (done - start) if done else None
+
+    samples = []
+    for number in range(params["samples"]):
+        name = f"single_{number:04d}"
+        path = os.path.join(root, name)
+        with open(path, "wb"):
+            pass
+        start = time.perf_counter()
+        done = wait_until(lambda: indexed(name) == 1, 10)
+        os.remove(path)
+        if done:
+            samples.append(done - start)
+    if samples:
+        metrics.update(percentiles(samples, "single_"))
+    wait_until(lambda: indexed("single_*") == 0, 10)
+
+    monitor.worker.stop()
+    monitor.worker.wait()
+    app.processEvents()
+    conn.close()
+    return metrics
+
+
+CASES = {
+    "rebuild": rebuild,
+    "incremental": incremental,
+    "duplicates": duplicates,
+    "search_sqlite": search_sqlite,
+    "search_memory": search_memory,
+    "startup": startup,
+    "gui_search": gui_search,
+    "live_updates": live_updates,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    case, params = argv[0], json.loads(argv[1])
+    metrics = CASES[case](params)
+    if "skipped" not in metrics:
+        metrics["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(metrics))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Generator for reproducible synthetic directory trees.
+"""
+import json
+import math
+import os
+import random
+import shutil
+import string
+from dataclasses import asdict, dataclass, fields
+
+# written last, a tree without it is regenerated
+SPEC_FILE = ".benchspec"
+
+NAME_STYLES = ("words", "random", "numbered")
+
+VOCABULARY = (
+    "report",
+    "data",
+    "final",
+    "draft",
+    "notes",
+    "invoice",
+    "photo",
+    "backup",
+    "config",
+    "main",
+    "test",
+    "readme",
+    "index",
+    "image",
+    "video",
+    "music",
+    "project",
+    "budget",
+    "summary",
+    "letter",
+    "scan",
+    "old",
+    "new",
+    "copy",
+    "build",
+    "source",
+    "module",
+    "page",
+    "chapter",
+    "meeting",
+)
+
+# ordered by frequency, picked with Zipf weights
+EXTENSIONS = (
+    ".txt",
+    ".jpg",
+    ".py",
+    ".pdf",
+    ".png",
+    ".md",
+    ".json",
+    ".log",
+    ".c",
+    ".h",
+    ".csv",
+    ".html",
+    ".mp3",
+    ".zip",
+    ".docx",
+)
+EXTENSION_WEIGHTS = [1 / rank for rank in range(1, len(EXTENSIONS) + 1)]
+
+# spread of the log-normal file sizes, and the largest size drawn
+SIZE_SIGMA = 1.3
+MAX_FILE_SIZE = 4 * 1024 * 1024
+# contents kept to be copied by later files
+KEPT_CONTENTS = 1000
+
+
+@dataclass(frozen=True)
+class TreeSpec:
+    """Shape of a synthetic tree. `depth` levels of `fanout` directories
+    each, with `files` files spread uniformly over all directories.
+
+    File sizes are log-normal around the median `file_size` (0 for empty
+    files). A share of `duplicates` of the files copies an earlier file,
+    as many again have the size of an earlier file but other content."""
+
+    files: int = 100000
+    depth: int = 4
+    fanout: int = 8
+    names: str = "words"
+    seed: int = 0
+    file_size: int = 1024
+    duplicates: float = 0.05
+
+
+def make_name(rng, style, number, extension=True):
+    """Random file or directory name in the given style."""
+    if style == "numbered":
+        name = f"file{number:07d}"
+    elif style == "random":
+        alphabet = string.ascii_lowercase + string.digits
+        name = "".join(rng.choice(alphabet) for _ in range(rng.randint(4, 24)))
+    else:
+        words = rng.choices(VOCABULARY, k=rng.choices((1, 2, 3), (5, 3, 1))[0])
+        name = rng.choice("_- ").join(words)
+        if rng.random() < 0.2:
+            name += f"_{rng.randint(2000, 2024)}"
+    if extension:
+        name += rng.choices(EXTENSIONS, EXTENSION_WEIGHTS)[0]
+    return name
+
+
+def unique_name(rng, style, number, taken, extension=True):
+    """Name that is not in `taken` yet, marked as taken."""
+    name = make_name(rng, style, number, extension)
+    if name in taken:
+        stem, ext = os.path.splitext(name) if extension else (name, "")
+        name = f"{stem}_{number}{ext}"
+    taken.add(name)
+    return name
+
+
+def file_content(rng, spec, earlier):
+    """Content of the next file. Random content is remembered in
+    `earlier`, for later files to copy it or to take its size."""
+    if not spec.file_size:
+        return b""
+    pick = rng.random()
+    if earlier and pick < 2 * spec.duplicates:
+        data = rng.choice(earlier)
+        if pick >= spec.duplicates and data:
+            # same size and ends, so only a full hash tells them apart
+            middle = len(data) // 2
+            data = data[:middle] + bytes([data[middle] ^ 0xFF]) + data[middle + 1 :]
+        return data
+    size = rng.lognormvariate(math.log(spec.file_size), SIZE_SIGMA)
+    data = rng.randbytes(min(int(size), MAX_FILE_SIZE))
+    if len(earlier) < KEPT_CONTENTS:
+        earlier.append(data)
+    else:
+        earlier[rng.randrange(KEPT_CONTENTS)] = data
+    return data
+
+
+def read_spec(root):
+    """Spec the tree at `root` was generated with, None if incomplete or
+    written before the spec had all of its fields."""
+    try:
+        with open(os.path.join(root, SPEC_FILE), "r") as infile:
+            stored = json.load(infile)
+        if set(stored) != {field.name for field in fields(TreeSpec)}:
+            return None
+        return TreeSpec(**stored)
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def generate(root, spec):
+    """Create the tree described by `spec` at `root`, reusing an existing
+    one with the same spec. Returns True if the tree was (re)generated."""
+    if read_spec(root) == spec:
+        return False
+    if spec.names not in NAME_STYLES:
+        raise ValueError(f"Unknown name style '{spec.names}'")
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    rng = random.Random(spec.seed)
+    directories = [root]
+    taken = {root: set()}
+    level = [root]
+    number = 0
+    for _ in range(spec.depth):
+        next_level = []
+        for parent in level:
+            for _ in range(spec.fanout):
+                number += 1
+                name = unique_name(rng, spec.names, number, taken[parent], False)
+                path = os.path.join(parent, name)
+                os.mkdir(path)
+                taken[path] = set()
+                next_level.append(path)
+        directories.extend(next_level)
+        level = next_level
+    earlier = []
+    for number in range(spec.files):
+        parent = rng.choice(directories)
+        name = unique_name(rng, spec.names, number, taken[parent])
+        with open(os.path.join(parent, name), "wb") as outfile:
+            outfile.write(file_content(rng, spec, earlier))
+    with open(os.path.join(root, SPEC_FILE), "w") as outfile:
+        json.dump(asdict(spec), outfile)
+    return True
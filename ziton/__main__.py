@@ -1,9 +1,24 @@
 """
 __main__ module
+
+    python -m ziton                  start the application
+    python -m ziton serve            answer searches over a Unix socket
+    python -m ziton query PATTERN    search through a running server
 """
 
 
 if __name__ == "__main__":
+    import sys
+    import time
+
+    started = time.perf_counter()
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "query":
+        # just a socket client, no Qt and no configuration needed
+        from ziton.client import main as query
+
+        sys.exit(query(sys.argv[2:]))
+
     # validate disk files
     # import order important to avoid loading from files
     # that haven't been verified yet
@@ -12,10 +27,15 @@ if __name__ == "__main__":
     cfg.validate_config_file()
     import ziton.database as db
 
-    db.validate_database()
-    if cfg.start_updated_enabled():
-        db.build_database()
+    if command == "serve":
+        db.startup_update()
+        from ziton.server import main as serve
+
+        sys.exit(serve(sys.argv[2:]))
 
+    # the window searches the existing index right away, checking and
+    # updating it happens in the background
+    db.init_database()
     from ziton.app import main
 
-    main()
+    main(started)
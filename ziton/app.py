@@ -2,41 +2,54 @@
 Central entry point for the application.
 """
 
+import logging
 import sys
+import time
 from pathlib import Path
 
 from PySide2.QtCore import QCoreApplication, Qt, Signal, Slot
 from PySide2.QtGui import QIcon
-from PySide2.QtSql import QSqlDatabase, QSqlQuery
 from PySide2.QtWidgets import QApplication, QLineEdit, QVBoxLayout, QWidget
 
 import ziton.database as db
 import ziton.icons as icons
+import ziton.metrics as metrics
 import ziton.monitor as monitor
-from ziton.config import database_path, is_indexing_enabled
+import ziton.search as search
+from ziton.config import CONFIG
 from ziton.widgets.entries_trayicon import TrayEntryInfo
 from ziton.widgets.menubar import Menubar
-from ziton.widgets.systemtray import Systemtray
 from ziton.widgets.tableview import Tableview
 
+LOGGER = logging.getLogger(__name__)
+
 STYLESHEET = Path(__name__).resolve().parent.joinpath("ziton/resources/stylesheet.qss")
 
+STARTUP_SECONDS = metrics.gauge(
+    "ziton_startup_seconds",
+    "Seconds from launch until the window was shown and until the first "
+    "search results were displayed",
+    ("stage",),
+)
+
 
 class Mainwindow(QWidget):
     """Central widget and entrypoint for the program."""
 
     selChanged = Signal(str)
+    # the first search after the launch was answered
+    searchReady = Signal()
 
-    def __init__(self):
-        """Initialises main window"""
+    def __init__(self, started=None):
+        """Initialises main window, `started` is the `time.perf_counter()`
+        of the launch."""
         QWidget.__init__(self)
-        # connect to existing DB
-        self.database = QSqlDatabase.addDatabase("QSQLITE")
-        self.database.setDatabaseName(database_path())
-        self.database.open()
+        self.started = time.perf_counter() if started is None else started
+        # search engine over the existing DB
+        self.backend = search.open_backend()
         self.file_monitor = monitor.FileMonitor()
         # start monitoring the filesystem for changes
-        if is_indexing_enabled():
+        if CONFIG.live_updates:
             self.file_monitor.worker.start()
 
         # widgets
@@ -44,7 +57,7 @@ class Mainwindow(QWidget):
         self.searchbar.setClearButtonEnabled(True)
         self.menubar = Menubar(self.file_monitor.worker)
         self.trayinfo = TrayEntryInfo()
-        self.view = Tableview()
+        self.view = Tableview(self.backend)
 
         # set layout
         self.central_layout = QVBoxLayout()
@@ -52,23 +65,36 @@ class Mainwindow(QWidget):
         self.central_layout.addWidget(self.searchbar)
         self.central_layout.addWidget(self.view)
         self.central_layout.addWidget(self.trayinfo)
+        if CONFIG.stats_panel:
+            from ziton.widgets.stats_panel import StatsPanel
+
+            self.central_layout.addWidget(StatsPanel())
         self.setLayout(self.central_layout)
 
         # signals
         self.searchbar.textChanged.connect(self.view.update_filter)
+        self.menubar.caseChanged.connect(self.view.setCase)
+        self.menubar.modeChanged.connect(self.view.setMode)
+        self.menubar.duplicatesFound.connect(self.view.show_result)
         self.view.selectionModel().selectionChanged.connect(self.update_tray)
         self.view.tabPressed.connect(self.focus_searchbar)
+        self.view.search_worker.firstPage.connect(self.first_results)
+        self.view.resultsCounted.connect(self.trayinfo.update_result_count)
         self.selChanged.connect(self.trayinfo.update_selected_text)
         self.menubar.dbUpdated.connect(self.trayinfo.start_loading_animation)
         self.menubar.dbUpdated.connect(self.trayinfo.update_filecount)
         self.menubar.worker_finished.connect(self.trayinfo.stop_loading_animation)
-        if is_indexing_enabled():
-            self.file_monitor.fileAdded.connect(self.file_created)
-            self.file_monitor.fileDeleted.connect(self.file_deleted)
+        self.menubar.worker_finished.connect(self.database_rebuilt)
+        self.file_monitor.indexChanged.connect(self.index_changed)
+        self.file_monitor.watchesAdded.connect(self.trayinfo.update_watch_status)
+        self.file_monitor.rescanRequested.connect(self.menubar.request_update)
+        self.menubar.worker_finished.connect(self.file_monitor.worker.register_watches)
+        # only once its first page is sure to reach `first_results`
+        self.view.start_search()
 
     def closeEvent(self, event):
         """overriding window close to quit threads gracefully"""
-        self.file_monitor.worker.terminate()
+        self.file_monitor.worker.stop()
         self.file_monitor.worker.wait()
         QCoreApplication.quit()
 
@@ -79,32 +105,31 @@ class Mainwindow(QWidget):
         name = self.view.model().data(indexes[0])
         self.selChanged.emit(name)
 
+    @Slot(int, object)
+    def first_results(self, generation, rows):
+        """Report how long it took until the first search was answered."""
+        self.view.search_worker.firstPage.disconnect(self.first_results)
+        seconds = time.perf_counter() - self.started
+        STARTUP_SECONDS.set(seconds, stage="first_search")
+        LOGGER.info(f"Ready to search {seconds:.2f}s after launch")
+        self.searchReady.emit()
+
     @Slot()
     def focus_searchbar(self):
         """puts searchbar into focus."""
         self.searchbar.setFocus()
 
-    @Slot()
-    def file_created(self, filepath):
-        """Consume inotify file creation event."""
-        if Path(filepath).exists():
-            new_db_entry = db.dbrecord_from_path(filepath)
-            query = QSqlQuery()
-            query.prepare("INSERT INTO files VALUES (?, ?, ?, ?)")
-            query.bindValue(0, new_db_entry.filename)
-            query.bindValue(1, new_db_entry.filepath)
-            query.bindValue(2, new_db_entry.size)
-            query.bindValue(3, new_db_entry.modified)
-            query.exec_()
-            self.trayinfo.update_filecount()
+    @Slot(object)
+    def index_changed(self, changes):
+        """Mirror a batch of live updates written by the file monitor."""
+        if self.backend.apply_changes(changes):
+            self.view.refresh()
+        self.trayinfo.update_filecount()
 
     @Slot()
-    def file_deleted(self, filepath):
-        """consume inotify file deletion event."""
-        query = QSqlQuery()
-        query.prepare("DELETE FROM files WHERE filepath=?")
-        query.bindValue(0, filepath)
-        query.exec_()
+    def database_rebuilt(self):
+        """Reload the search backend and show the updated results."""
+        self.view.refresh()
         self.trayinfo.update_filecount()
 
     @Slot(str)
@@ -117,8 +142,12 @@ class Mainwindow(QWidget):
             self.showMinimized()
 
 
-def main():
-    """program entrypoint."""
+def main(started=None):
+    """program entrypoint, `started` is the `time.perf_counter()` of the
+    launch. The database is checked and updated in the background once
+    the window is shown."""
+    if started is None:
+        started = time.perf_counter()
     with open(STYLESHEET, "r") as infile:
         stylesheet = infile.read()
 
@@ -128,13 +157,19 @@ def main():
     app.setStyleSheet(stylesheet)
     app.setWindowIcon(app_icon)
     app.setApplicationDisplayName("Ziton")
+    if CONFIG.metrics_file:
+        metrics.start_dumping(CONFIG.metrics_file)
 
-    mainwindow = Mainwindow()
+    mainwindow = Mainwindow(started)
     mainwindow.resize(1200, 800)
+    mainwindow.show()
+    STARTUP_SECONDS.set(time.perf_counter() - started, stage="window")
+
+    from ziton.widgets.systemtray import Systemtray
+
     systray = Systemtray(app)
     systray.activated.connect(mainwindow.toggle_visual_state)
-
-    mainwindow.show()
     systray.show()
+    mainwindow.menubar.start_update(db.startup_update)
 
     sys.exit(app.exec_())
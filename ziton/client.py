@@ -0,0 +1,134 @@
+"""
+Command line client for the query server (`python -m ziton serve`).
+
+Only the standard library is imported, so a lookup costs little more
+than starting the interpreter. The protocol is line based: the client
+sends one JSON request `{"pattern": ..., "limit": ..., "mode": ...,
+"case_sensitive": ..., "sort": ...}` with mode "text", "glob" or "regex"
+and sort null or `[column, descending]`, column being one of "name",
+"size" or "modified". The server answers with one JSON array
+`[filename, filepath, size, modified, is_dir]` per match and closes the
+connection. An error is sent as a JSON object `{"error": ...}` instead.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+SOCKET_PATH = os.path.join(os.path.expanduser("~"), ".ziton", "ziton.sock")
+
+
+class QueryError(Exception):
+    """Raised when the server could not answer a query."""
+
+
+def query(
+    pattern,
+    limit=None,
+    socket_path=SOCKET_PATH,
+    mode="text",
+    case_sensitive=False,
+    sort=None,
+):
+    """Yield `(filename, filepath, size, modified, is_dir)` tuples of the
+    entries matching `pattern`, as they arrive."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        request = json.dumps(
+            {
+                "pattern": pattern,
+                "limit": limit,
+                "mode": mode,
+                "case_sensitive": case_sensitive,
+                "sort": sort,
+            }
+        )
+        sock.sendall(request.encode() + b"\n")
+        with sock.makefile("rb") as stream:
+            for line in stream:
+                row = json.loads(line)
+                if isinstance(row, dict):
+                    raise QueryError(row.get("error", "unknown error"))
+                yield tuple(row)
+
+
+def main(argv=None):
+    """Entry point of `python -m ziton query`."""
+    parser = argparse.ArgumentParser(
+        prog="python -m ziton query",
+        description="Search the index through a running `python -m ziton serve`.",
+    )
+    parser.add_argument("pattern", nargs="*", help="terms every filename contains")
+    parser.add_argument(
+        "--json", action="store_true", help="print one JSON object per match"
+    )
+    parser.add_argument("--limit", type=int, help="stop after LIMIT matches")
+    parser.add_argument(
+        "-c", "--case-sensitive", action="store_true", help="match case"
+    )
+    parser.add_argument(
+        "--sort",
+        choices=("name", "size", "modified"),
+        help="order of the matches, e.g. `--sort size --reverse` for the largest",
+    )
+    parser.add_argument(
+        "--reverse", action="store_true", help="sort in descending order"
+    )
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument(
+        "--glob",
+        dest="mode",
+        action="store_const",
+        const="glob",
+        default="text",
+        help="match whole filenames against the glob PATTERN",
+    )
+    modes.add_argument(
+        "--regex",
+        dest="mode",
+        action="store_const",
+        const="regex",
+        help="match filenames against the regular expression PATTERN",
+    )
+    parser.add_argument("--socket", default=SOCKET_PATH, help="server socket path")
+    args = parser.parse_args(argv)
+
+    out = sys.stdout.buffer
+    try:
+        for name, path, size, modified, is_dir in query(
+            " ".join(args.pattern),
+            args.limit,
+            args.socket,
+            args.mode,
+            args.case_sensitive,
+            (args.sort, args.reverse) if args.sort else None,
+        ):
+            if args.json:
+                match = {
+                    "name": name,
+                    "path": path,
+                    "size": size,
+                    "modified": modified,
+                    "is_dir": bool(is_dir),
+                }
+                out.write(json.dumps(match).encode() + b"\n")
+            else:
+                # the undecodable bytes of odd filenames survive the round trip
+                out.write(os.fsencode(path) + b"\n")
+        out.flush()
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(
+            f"No query server is listening on '{args.socket}', "
+            "start one with `python -m ziton serve`.",
+            file=sys.stderr,
+        )
+        return 1
+    except QueryError as e:
+        print(f"Query failed: {e}", file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        # output closed early, e.g. piped into `head`
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    return 0
@@ -2,7 +2,10 @@
 Module that provides API to interact with and parse the configuration file.
 """
 import logging
+import os
 import pathlib
+import time
+from dataclasses import MISSING, dataclass, field, fields
 
 import toml
 
@@ -16,21 +19,95 @@ class InvalidConfigurationError(Exception):
     """Raised when configuration file is corrupted."""
 
 
+@dataclass(frozen=True)
+class Settings:
+    """Typed contents of the configuration file. Keys without a default
+    are required, the others were added later and may be missing."""
+
+    included_directories: list
+    index_on_startup: bool
+    live_updates: bool
+    hidden_files: bool
+    database_path: str
+    excluded_directories: list
+    excluded_folders: list
+    min_on_launch: bool
+    # gitignore-style rules relative to "/", see `ziton.exclusions`
+    excluded_patterns: list = field(default_factory=list)
+    scan_workers: int = 0
+    scan_processes: bool = False
+    # concurrent listings per kind of device, 0 uses `scan_workers`
+    ssd_workers: int = 0
+    hdd_workers: int = 2
+    network_workers: int = 4
+    # don't descend into other filesystems below the included directories
+    one_filesystem: bool = False
+    # mlocate database the first index is imported from, if it exists
+    locate_database: str = "/var/lib/mlocate/mlocate.db"
+    batch_size: int = 50000
+    write_buffer_mb: int = 64
+    incremental_updates: bool = True
+    search_backend: str = "sqlite"
+    # metrics dump, JSON if it ends with `.json`, Prometheus text otherwise
+    metrics_file: str = ""
+    stats_panel: bool = False
+
+    @classmethod
+    def from_dict(cls, config):
+        """Build settings from a parsed config, ignoring unknown keys."""
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in config.items() if k in names})
+
+
+def required_keys():
+    """Keys every configuration file has to contain."""
+    return [
+        f.name
+        for f in fields(Settings)
+        if f.default is MISSING and f.default_factory is MISSING
+    ]
+
+
+class Config:
+    """Configuration loaded once and re-parsed only when the file's mtime
+    changes. Settings are read as attributes, e.g. `CONFIG.hidden_files`."""
+
+    # seconds between two checks of the file's mtime
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self._path = path
+        self._settings = None
+        self._mtime = None
+        self._checked = 0.0
+
+    def settings(self):
+        """Current settings, reloading the file if it changed on disk."""
+        now = time.monotonic()
+        if self._settings is None or now - self._checked > self.CHECK_INTERVAL:
+            self._checked = now
+            mtime = os.stat(self._path).st_mtime_ns
+            if mtime != self._mtime:
+                with open(self._path, "r") as infile:
+                    self._settings = Settings.from_dict(toml.load(infile))
+                self._mtime = mtime
+        return self._settings
+
+    def invalidate(self):
+        """Force a check of the file on the next read."""
+        self._checked = 0.0
+        self._mtime = None
+
+    def __getattr__(self, name):
+        return getattr(self.settings(), name)
+
+
 def verify_config_integrity():
     """Verify if the configuratino file is valid and contains necessary keys."""
     LOGGER.info("Verifying integrity of the configuration file...")
     with open(CONFIG_PATH, "r") as infile:
         config = toml.load(infile)
-        valid = (
-            "included_directories" in config
-            and "index_on_startup" in config
-            and "live_updates" in config
-            and "hidden_files" in config
-            and "database_path" in config
-            and "excluded_folders" in config
-            and "excluded_directories" in config
-            and "min_on_launch" in config
-        )
+        valid = all(key in config for key in required_keys())
     if not valid:
         raise InvalidConfigurationError(
             "Errors found in configuration file, delete to restore default configuration."
@@ -59,69 +136,35 @@ def validate_config_file():
             "database_path": str(db_path),
             "excluded_directories": [],
             "excluded_folders": [],
-            "min_on_launch": False
+            "min_on_launch": False,
+            "excluded_patterns": [],
+            "scan_workers": 0,
+            "scan_processes": False,
+            "ssd_workers": 0,
+            "hdd_workers": 2,
+            "network_workers": 4,
+            "one_filesystem": False,
+            "locate_database": "/var/lib/mlocate/mlocate.db",
+            "batch_size": 50000,
+            "write_buffer_mb": 64,
+            "incremental_updates": True,
+            "search_backend": "sqlite",
+            "metrics_file": "",
+            "stats_panel": False,
         }
         with open(CONFIG_PATH, "w") as outfile:
             outfile.writelines(toml.dumps(basic_cfg))
 
 
-def included_directories():
-    "Get list of directories that should be indexed."
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["included_directories"]
-
-
-def excluded_directories():
-    "Get list of directories that should be excluded."
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["excluded_directories"]
-
-
-def start_updated_enabled():
-    "Check if startup database update is enabled."
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["index_on_startup"]
-
-
-def is_indexing_enabled():
-    """Check if live database updates are enabled."""
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["live_updates"]
-
-
-def database_path():
-    """Returns database path."""
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["database_path"]
-
-
 def save_configuration(config_dict):
     """persist current configuration settings to disk."""
-    with open(CONFIG_PATH, "w") as outfile:
-        toml.dump(config_dict, outfile)
-
-
-def hidden_files_enabled():
-    """Determine if hidden files are being indexed or not"""
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["hidden_files"]
-
-
-def excluded_folders():
-    """folders with given filenames will not be included"""
+    # keep settings that are not part of `config_dict` (e.g. scanner tuning)
     with open(CONFIG_PATH, "r") as infile:
         config = toml.load(infile)
-        return config["excluded_folders"]
+    config.update(config_dict)
+    with open(CONFIG_PATH, "w") as outfile:
+        toml.dump(config, outfile)
+    CONFIG.invalidate()
 
 
-def minimize_on_open():
-    """if enabled ziton will minimize to tray when files or folders are opened"""
-    with open(CONFIG_PATH, "r") as infile:
-        config = toml.load(infile)
-        return config["min_on_launch"]
+CONFIG = Config(CONFIG_PATH)
@@ -1,26 +1,130 @@
 """
 Sqlite Database API for the application.
 Provides functionality to rebuild and interact with the database.
+
+Directories are stored once in the `dirs` table as `(id, parent_id,
+name)`, every row of `files` points to the directory it is in. Full
+paths are only put together for the rows that are displayed.
+
+Every directory also stores the recursive totals of its subtree, the
+size and number of the files below it and the newest modification
+time. The `files` row of a directory carries the same size and
+modification time, so sorting and paging by those columns works for
+directories as it does for files.
 """
 
+import json
 import logging
 import os
 import pathlib
 import sqlite3
+import stat
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
-from ziton.config import (
-    database_path,
-    hidden_files_enabled,
-    included_directories,
-    excluded_folders,
-    excluded_directories,
-)
+from ziton import devices, exclusions, locatedb, metrics, scanner
+from ziton.config import CONFIG
+from ziton.scanner import PHASE_SECONDS
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
+REBUILD_SECONDS = metrics.histogram(
+    "ziton_rebuild_seconds", "Duration of full rebuilds"
+)
+LAST_REBUILD = metrics.gauge(
+    "ziton_last_rebuild", "Totals of the last full rebuild", ("total",)
+)
+INCREMENTAL_SECONDS = metrics.histogram(
+    "ziton_incremental_update_seconds", "Duration of incremental updates"
+)
+RELISTED_DIRECTORIES = metrics.counter(
+    "ziton_relisted_directories_total",
+    "Directories re-listed by incremental updates",
+)
+WRITE_BUFFER = metrics.gauge(
+    "ziton_write_buffer_rows", "Rows buffered by the batch writer"
+)
+
+
+CREATE_DIRS = """CREATE TABLE IF NOT EXISTS dirs(id INTEGER PRIMARY KEY,
+    parent_id INT, name TEXT NOT NULL, mtime INT NOT NULL DEFAULT 0,
+    size INT NOT NULL DEFAULT 0, file_count INT NOT NULL DEFAULT 0,
+    modified INT NOT NULL DEFAULT 0);"""
+# recursive totals of a directory, added to `dirs` by schema version 3
+TOTAL_COLUMNS = ("size", "file_count", "modified")
+CREATE_DIRS_INDEX = """CREATE UNIQUE INDEX IF NOT EXISTS dirs_parent_name
+    ON dirs(parent_id, name);"""
+CREATE_FILES = """CREATE TABLE IF NOT EXISTS files(dir_id INT NOT NULL,
+    filename TEXT, size INT, modified INT, dev INT, ino INT);"""
+CREATE_STATE = """CREATE TABLE IF NOT EXISTS state(key TEXT PRIMARY KEY,
+    value TEXT) WITHOUT ROWID;"""
+# content hashes of the duplicate finder, see `ziton.duplicates`
+CREATE_HASHES = """CREATE TABLE IF NOT EXISTS hashes(path TEXT PRIMARY KEY,
+    size INT, modified INT, partial BLOB, full BLOB) WITHOUT ROWID;"""
+INSERT_FILE = """INSERT INTO files(dir_id, filename, size, modified, dev, ino)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+
+# `(id, path)` of a directory and everything below it
+SUBTREE = """WITH RECURSIVE subtree(id, path) AS (
+        SELECT ?, ?
+        UNION ALL
+        SELECT dirs.id, subtree.path || '/' || dirs.name
+        FROM dirs JOIN subtree ON dirs.parent_id = subtree.id
+    ) SELECT id, path FROM subtree;"""
+# `(path, mtime)` of every directory
+ALL_DIRECTORIES = """WITH RECURSIVE tree(id, path, mtime) AS (
+        SELECT id, rtrim(name, '/'), mtime FROM dirs WHERE parent_id IS NULL
+        UNION ALL
+        SELECT dirs.id, tree.path || '/' || dirs.name, dirs.mtime
+        FROM dirs JOIN tree ON dirs.parent_id = tree.id
+    ) SELECT path, mtime FROM tree;"""
+# `(path, size, file_count, modified)` of the directories below one
+# directory, largest first
+LARGEST_DIRECTORIES = """WITH RECURSIVE subtree(id, path) AS (
+        SELECT ?, ?
+        UNION ALL
+        SELECT dirs.id, subtree.path || '/' || dirs.name
+        FROM dirs JOIN subtree ON dirs.parent_id = subtree.id
+    ) SELECT subtree.path, dirs.size, dirs.file_count, dirs.modified
+    FROM subtree JOIN dirs ON dirs.id = subtree.id
+    ORDER BY dirs.size DESC LIMIT ?;"""
+# `(size, modified, file_count)` of a directory from the rows directly
+# below it, subdirectories contribute their own totals
+DIRECTORY_TOTALS = """SELECT COALESCE(SUM(files.size), 0),
+        COALESCE(MAX(files.modified), 0),
+        COALESCE(SUM(IFNULL(dirs.file_count, 1)), 0)
+    FROM files LEFT JOIN dirs
+        ON dirs.parent_id = files.dir_id AND dirs.name = files.filename
+    WHERE files.dir_id = ?;"""
+
+# the sort column first, then columns that make the order unique, then
+# the rest of the displayed columns so no table lookups are needed
+SORT_INDEXES = {
+    "files_name": "filename COLLATE NOCASE, dir_id, filename, size, modified",
+    "files_size": "size, filename, dir_id, modified",
+    "files_modified": "modified, filename, dir_id, size",
+}
+
+# appended to the database path for the database a rebuild writes to
+SHADOW_SUFFIX = "-rebuild"
+# files sqlite keeps next to a database, by suffix
+DATABASE_FILES = ("", "-journal", "-wal", "-shm")
+# seconds a writer waits for the lock, e.g. while a rebuild is swapped in
+BUSY_TIMEOUT = 60.0
+# bytes the WAL is truncated to once it was checkpointed, a swap puts the
+# whole index through it
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# bumped whenever the table layout changes, stored as PRAGMA user_version
+SCHEMA_VERSION = 3
+# rows copied per statement when migrating the flat layout
+MIGRATION_BATCH = 50000
+# imported entries stat-ed per transaction
+STAT_BATCH = 10000
+
 
 @dataclass
 class DatabaseEntry:
@@ -30,74 +134,1084 @@ class DatabaseEntry:
     filepath: str
     size: int
     modified: int
+    dev: int
+    ino: int
+    # listed as a directory by the scanner, not a symlink to one
+    is_dir: bool = False
+
+
+def normalize(path):
+    """`path` without trailing slashes, the way it is stored in `dirs`."""
+    return path.rstrip("/") or "/"
+
+
+class DirectoryTree:
+    """Path based access to the `dirs` and `files` tables.
+
+    The included directories are the roots of the tree, their `name` is
+    the full path. Paths are resolved to directory ids and back with one
+    indexed lookup per level, recently used ones are cached."""
+
+    CACHE_SIZE = 65536
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.roots = {normalize(d) for d in CONFIG.included_directories}
+        self.forget()
+
+    def forget(self):
+        """Drop cached paths, they are stale once directories were moved
+        or deleted."""
+        self.ids = OrderedDict()
+        self.paths = OrderedDict()
+
+    def _remember(self, path, dir_id):
+        self.ids[path] = dir_id
+        self.paths[dir_id] = path
+        for cache in (self.ids, self.paths):
+            if len(cache) > self.CACHE_SIZE:
+                cache.popitem(last=False)
+        return dir_id
+
+    def dir_id(self, path):
+        """Id of the directory `path`, None if it is not part of the index."""
+        path = normalize(path)
+        dir_id = self.ids.get(path)
+        if dir_id is not None:
+            self.ids.move_to_end(path)
+            return dir_id
+        row = self.conn.execute(
+            "SELECT id FROM dirs WHERE parent_id IS NULL AND name = ?;", (path,)
+        ).fetchone()
+        if row is None:
+            parent, name = os.path.split(path)
+            parent_id = None if parent == path else self.dir_id(parent)
+            if parent_id is None:
+                return None
+            row = self.conn.execute(
+                "SELECT id FROM dirs WHERE parent_id = ? AND name = ?;",
+                (parent_id, name),
+            ).fetchone()
+            if row is None:
+                return None
+        return self._remember(path, row[0])
+
+    def dir_path(self, dir_id):
+        """Full path of the directory `dir_id`, None if it was deleted."""
+        path = self.paths.get(dir_id)
+        if path is not None:
+            self.paths.move_to_end(dir_id)
+            return path
+        row = self.conn.execute(
+            "SELECT parent_id, name FROM dirs WHERE id = ?;", (dir_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        parent_id, name = row
+        if parent_id is None:
+            path = name
+        else:
+            parent = self.dir_path(parent_id)
+            if parent is None:
+                return None
+            path = os.path.join(parent, name)
+        self._remember(path, dir_id)
+        return path
+
+    def add_directory(self, path, mtime=0):
+        """Store the directory `path` listed with `mtime`, returns its id.
+        Missing ancestors are added with mtime 0, so the next incremental
+        update lists them."""
+        path = normalize(path)
+        dir_id = self.dir_id(path)
+        if dir_id is not None:
+            self.conn.execute(
+                "UPDATE dirs SET mtime = ? WHERE id = ?;", (mtime, dir_id)
+            )
+            return dir_id
+        parent, name = os.path.split(path)
+        if parent == path or path in self.roots:
+            cursor = self.conn.execute(
+                "INSERT INTO dirs(parent_id, name, mtime) VALUES (NULL, ?, ?);",
+                (path, mtime),
+            )
+        else:
+            parent_id = self.dir_id(parent)
+            if parent_id is None:
+                parent_id = self.add_directory(parent)
+            cursor = self.conn.execute(
+                "INSERT INTO dirs(parent_id, name, mtime) VALUES (?, ?, ?);",
+                (parent_id, name, mtime),
+            )
+        return self._remember(path, cursor.lastrowid)
+
+    def rows(self, records):
+        """`files` rows for scanner records `(filename, filepath, size,
+        modified, dev, ino)`."""
+        rows = []
+        last_parent = last_id = None
+        for name, path, size, modified, dev, ino in records:
+            parent = path[: len(path) - len(name) - 1] or "/"
+            if parent != last_parent:
+                last_id = self.dir_id(parent)
+                if last_id is None:
+                    last_id = self.add_directory(parent)
+                last_parent = parent
+            rows.append((last_id, name, size, modified, dev, ino))
+        return rows
+
+    def _split(self, path):
+        """`(parent id, name)` of `path`, the id is None if the parent is
+        not part of the index."""
+        parent, name = os.path.split(normalize(path))
+        return self.dir_id(parent), name
+
+    def children(self, path):
+        """`(rowid, filename, size, modified, dev, ino)` of every entry
+        directly below `path`."""
+        dir_id = self.dir_id(path)
+        if dir_id is None:
+            return []
+        return self.conn.execute(
+            """SELECT rowid, filename, size, modified, dev, ino FROM files
+                WHERE dir_id = ?;""",
+            (dir_id,),
+        ).fetchall()
+
+    def directory_mtime(self, path):
+        """mtime in ns `path` was listed with, None if it isn't indexed."""
+        dir_id = self.dir_id(path)
+        if dir_id is None:
+            return None
+        row = self.conn.execute("SELECT mtime FROM dirs WHERE id = ?;", (dir_id,))
+        return row.fetchone()[0]
+
+    def directories(self):
+        """`(path, mtime)` of every listed directory."""
+        rows = self.conn.execute(ALL_DIRECTORIES)
+        return [(path or "/", mtime) for path, mtime in rows]
+
+    def subtree(self, path):
+        """`(id, path)` of the directory `path` and all directories below."""
+        dir_id = self.dir_id(path)
+        if dir_id is None:
+            return []
+        rows = self.conn.execute(SUBTREE, (dir_id, normalize(path).rstrip("/")))
+        return [(dir_id, path or "/") for dir_id, path in rows]
+
+    def subtree_directories(self, path):
+        """Listed directories at or below `path`."""
+        return [path for _, path in self.subtree(path)]
+
+    def delete_subtree(self, path):
+        """Remove everything below `path` from the index."""
+        ids = [(dir_id,) for dir_id, _ in self.subtree(path)]
+        if ids:
+            self.conn.executemany("DELETE FROM files WHERE dir_id = ?;", ids)
+            self.conn.executemany("DELETE FROM dirs WHERE id = ?;", ids)
+            self.forget()
+
+    def delete_path(self, path):
+        """Remove `path` and everything below it, returns True if `path`
+        was part of the index."""
+        parent_id, name = self._split(path)
+        deleted = False
+        if parent_id is not None:
+            cursor = self.conn.execute(
+                "DELETE FROM files WHERE dir_id = ? AND filename = ?;",
+                (parent_id, name),
+            )
+            deleted = cursor.rowcount > 0
+        self.delete_subtree(path)
+        return deleted
+
+    def move_directory(self, old_path, new_path):
+        """Attach the directory `old_path` at `new_path`, everything below
+        it moves along without being touched."""
+        dir_id = self.dir_id(old_path)
+        parent_id, name = self._split(new_path)
+        if dir_id is None or parent_id is None:
+            return
+        self.conn.execute(
+            "UPDATE dirs SET parent_id = ?, name = ? WHERE id = ?;",
+            (parent_id, name, dir_id),
+        )
+        self.forget()
+
+    def rename_entry(self, old_path, new_path):
+        """Move the row of `old_path` and everything below it to `new_path`,
+        replacing whatever was indexed there. Returns False if `old_path`
+        or the new parent directory are not part of the index."""
+        self.delete_path(new_path)
+        old_parent, old_name = self._split(old_path)
+        new_parent, new_name = self._split(new_path)
+        if old_parent is None or new_parent is None:
+            return False
+        cursor = self.conn.execute(
+            """UPDATE files SET dir_id = ?, filename = ?
+                WHERE dir_id = ? AND filename = ?;""",
+            (new_parent, new_name, old_parent, old_name),
+        )
+        if not cursor.rowcount:
+            return False
+        self.move_directory(old_path, new_path)
+        return True
+
+    def upsert_entry(self, entry):
+        """Store `entry`, updating the row of its path if there is one.
+        Returns True if a new row was inserted."""
+        ((dir_id, name, *values),) = self.rows(
+            [
+                (
+                    entry.filename,
+                    entry.filepath,
+                    entry.size,
+                    entry.modified,
+                    entry.dev,
+                    entry.ino,
+                )
+            ]
+        )
+        cursor = self.conn.execute(
+            """UPDATE files SET size = ?, modified = ?, dev = ?, ino = ?
+                WHERE dir_id = ? AND filename = ?;""",
+            (*values, dir_id, name),
+        )
+        if cursor.rowcount:
+            return False
+        self.conn.execute(INSERT_FILE, (dir_id, name, *values))
+        return True
+
+    def update_totals(self, dir_ids):
+        """Recompute the totals of the directories `dir_ids` and of all
+        their ancestors. Each one is summed up from the rows directly
+        below it, deepest first so subdirectories are up to date before
+        their parent is. Ids of deleted directories are skipped."""
+        # id -> (parent id, name) of the directories and their ancestors
+        parents = {}
+        pending = [dir_id for dir_id in dir_ids if dir_id is not None]
+        while pending:
+            dir_id = pending.pop()
+            if dir_id in parents:
+                continue
+            row = self.conn.execute(
+                "SELECT parent_id, name FROM dirs WHERE id = ?;", (dir_id,)
+            ).fetchone()
+            if row is None:
+                continue
+            parents[dir_id] = row
+            if row[0] is not None:
+                pending.append(row[0])
+        for dir_id in deepest_first({i: row[0] for i, row in parents.items()}):
+            size, modified, file_count = self.conn.execute(
+                DIRECTORY_TOTALS, (dir_id,)
+            ).fetchone()
+            self.conn.execute(
+                "UPDATE dirs SET size = ?, modified = ?, file_count = ? WHERE id = ?;",
+                (size, modified, file_count, dir_id),
+            )
+            parent_id, name = parents[dir_id]
+            self.conn.execute(
+                """UPDATE files SET size = ?, modified = ?
+                    WHERE dir_id = ? AND filename = ?;""",
+                (size, modified, parent_id, name),
+            )
+
+    def largest(self, path, limit):
+        """`(path, size, file_count, modified)` of the `limit` directories
+        at or below `path` with the largest totals. Only the `dirs` table
+        is read, no matter how many files are below `path`."""
+        dir_id = self.dir_id(path)
+        if dir_id is None:
+            return []
+        rows = self.conn.execute(
+            LARGEST_DIRECTORIES, (dir_id, normalize(path).rstrip("/"), limit)
+        )
+        return [(path or "/", *totals) for path, *totals in rows]
+
+
+class Checkpoint:
+    """Directories a rebuild still has to list.
+
+    Saved in the shadow database with every batch the rebuild commits, so
+    the rows of a listed directory and its removal from the pending set
+    are written together. An interrupted rebuild continues by scanning
+    the pending directories."""
+
+    KEY = "rebuild_checkpoint"
+
+    def __init__(self, settings, pending):
+        self.settings = settings
+        self.pending = set(pending)
+
+    @classmethod
+    def load(cls, conn, settings):
+        """Checkpoint of an interrupted rebuild with the scan settings
+        `settings`, None if there is none."""
+        row = conn.execute(
+            "SELECT value FROM state WHERE key = ?;", (cls.KEY,)
+        ).fetchone()
+        if row is None:
+            return None
+        stored = json.loads(row[0])
+        if stored["settings"] != settings:
+            return None
+        return cls(settings, stored["pending"])
+
+    def update(self, directories, frontier):
+        """The `directories` were listed and `frontier` was found."""
+        self.pending.difference_update(path for path, _ in directories)
+        self.pending.update(frontier)
+
+    def save(self, conn):
+        """Store the pending directories, as part of the open transaction."""
+        value = {"settings": self.settings, "pending": sorted(self.pending)}
+        conn.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?);",
+            (self.KEY, json.dumps(value)),
+        )
+
+
+class BatchWriter:
+    """Buffers records and writes them to the database in fixed size
+    transactions, so memory stays flat no matter how many records
+    are streamed through it.
+
+    Limits are checked after every chunk of the scanner, each commit
+    contains whole chunks and saves the `checkpoint` if there is one."""
+
+    # rough per row overhead of the tuple, str and int objects in bytes
+    ROW_OVERHEAD = 200
+
+    def __init__(self, conn, batch_size, max_buffer_bytes, checkpoint=None):
+        self.conn = conn
+        self.tree = DirectoryTree(conn)
+        self.batch_size = batch_size
+        self.max_buffer_bytes = max_buffer_bytes
+        self.checkpoint = checkpoint
+        self.rows = []
+        self.buffer_bytes = 0
+        self.written = 0
+
+    def add(self, records, directories=(), frontier=()):
+        """Buffer `records`, flushing once a limit is reached. The listed
+        `directories` are stored right away, their ids are needed for the
+        records below them."""
+        for path, mtime in directories:
+            self.tree.add_directory(path, mtime)
+        for row in self.tree.rows(records):
+            self.rows.append(row)
+            self.buffer_bytes += self.ROW_OVERHEAD + len(row[1])
+        if self.checkpoint is not None:
+            self.checkpoint.update(directories, frontier)
+        if (
+            len(self.rows) >= self.batch_size
+            or self.buffer_bytes >= self.max_buffer_bytes
+        ):
+            self.flush()
+        WRITE_BUFFER.set(len(self.rows))
+
+    def flush(self):
+        """Write and commit all buffered records."""
+        if self.rows:
+            with PHASE_SECONDS.time(phase="write"):
+                self.conn.executemany(INSERT_FILE, self.rows)
+            self.written += len(self.rows)
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.conn)
+        with PHASE_SECONDS.time(phase="commit"):
+            self.conn.commit()
+        self.rows = []
+        self.buffer_bytes = 0
+        WRITE_BUFFER.set(0)
+
+
+def write_batches(conn, chunks, checkpoint=None):
+    """Consume an iterable of `(records, directories, frontier)` tuples
+    and write them in batches.
+
+    `chunks` can be any iterable, e.g. a scanner generator or a queue
+    drained with `iter(queue.get, None)`. Returns the number of rows."""
+    max_bytes = CONFIG.write_buffer_mb * 1024 * 1024
+    writer = BatchWriter(conn, CONFIG.batch_size, max_bytes, checkpoint)
+    for records, directories, frontier in chunks:
+        writer.add(records, directories, frontier)
+    writer.flush()
+    return writer.written
+
+
+def deepest_first(parents):
+    """Directory ids of a `{id: parent id}` mapping, every directory
+    before its parent."""
+    depths = {}
+    for dir_id in parents:
+        chain = []
+        while dir_id in parents and dir_id not in depths:
+            chain.append(dir_id)
+            dir_id = parents[dir_id]
+        depth = depths.get(dir_id, -1)
+        for node in reversed(chain):
+            depth += 1
+            depths[node] = depth
+    return sorted(depths, key=depths.__getitem__, reverse=True)
+
+
+def compute_totals(conn):
+    """Set the totals of every directory in one bottom-up pass, e.g. once
+    a rebuild listed everything. Directory rows are told apart from files
+    through `dirs`, the indexes of `files` are not needed."""
+    parents = dict(conn.execute("SELECT id, parent_id FROM dirs;"))
+    # id -> [size, modified, file_count] of the files directly in it
+    totals = {dir_id: [0, 0, 0] for dir_id in parents}
+    rows = conn.execute(
+        """SELECT files.dir_id, SUM(files.size), MAX(files.modified), COUNT(*)
+            FROM files WHERE NOT EXISTS (SELECT 1 FROM dirs
+                WHERE dirs.parent_id = files.dir_id
+                AND dirs.name = files.filename)
+            GROUP BY files.dir_id;"""
+    )
+    for dir_id, *values in rows:
+        if dir_id in totals:
+            totals[dir_id] = values
+    for dir_id in deepest_first(parents):
+        parent = totals.get(parents[dir_id])
+        if parent is not None:
+            size, modified, file_count = totals[dir_id]
+            parent[0] += size
+            parent[1] = max(parent[1], modified)
+            parent[2] += file_count
+    conn.executemany(
+        "UPDATE dirs SET size = ?, modified = ?, file_count = ? WHERE id = ?;",
+        [(*values, dir_id) for dir_id, values in totals.items()],
+    )
+    rowids = conn.execute(
+        """SELECT dirs.id, files.rowid FROM dirs JOIN files
+            ON files.dir_id = dirs.parent_id AND files.filename = dirs.name;"""
+    ).fetchall()
+    conn.executemany(
+        "UPDATE files SET size = ?, modified = ? WHERE rowid = ?;",
+        [(*totals[dir_id][:2], rowid) for dir_id, rowid in rowids],
+    )
+
+
+def create_schema(conn):
+    """Create missing tables and upgrade older layouts in place."""
+    cursor = conn.cursor()
+    version = cursor.execute("PRAGMA user_version;").fetchone()[0]
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(files);")]
+    dir_columns = [row[1] for row in cursor.execute("PRAGMA table_info(dirs);")]
+    if dir_columns:
+        for column in TOTAL_COLUMNS:
+            if column not in dir_columns:
+                cursor.execute(
+                    f"ALTER TABLE dirs ADD COLUMN {column} INT NOT NULL DEFAULT 0;"
+                )
+    cursor.execute(CREATE_DIRS)
+    cursor.execute(CREATE_DIRS_INDEX)
+    if version < 2 and "filepath" in columns:
+        migrate_flat_layout(conn, columns)
+    cursor.execute(CREATE_FILES)
+    cursor.execute(CREATE_STATE)
+    cursor.execute(CREATE_HASHES)
+    create_indexes(conn)
+    create_search_index(conn)
+    if version < 3 and columns:
+        LOGGER.info("Computing directory totals...")
+        compute_totals(conn)
+    # only written after an upgrade, it takes the write lock
+    if version != SCHEMA_VERSION:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION};")
+    conn.commit()
+
+
+def migrate_flat_layout(conn, columns):
+    """Move the rows of a version 0/1 database, which stored the full
+    path of every entry, to the `dirs`/`files` layout. Rowids are kept,
+    the trigram index is rebuilt afterwards."""
+    LOGGER.info("Migrating the database to the normalized layout...")
+    start_time = time.time()
+    drop_indexes(conn)
+    conn.execute("DROP TABLE IF EXISTS files_fts;")
+    conn.execute("ALTER TABLE files RENAME TO files_flat;")
+    conn.execute(CREATE_FILES)
+    tree = DirectoryTree(conn)
+    listed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'directories';"
+    ).fetchone()
+    if listed:
+        rows = conn.execute("SELECT path, mtime FROM directories;").fetchall()
+        # parents before their children
+        for path, mtime in sorted(rows, key=lambda row: row[0].count("/")):
+            tree.add_directory(path, mtime)
+        conn.execute("DROP TABLE directories;")
+    identity = "dev, ino" if "dev" in columns else "NULL, NULL"
+    cursor = conn.execute(
+        f"SELECT rowid, filename, filepath, size, modified, {identity} FROM files_flat;"
+    )
+    migrated = 0
+    while True:
+        rows = cursor.fetchmany(MIGRATION_BATCH)
+        if not rows:
+            break
+        new_rows = tree.rows([row[1:] for row in rows])
+        conn.executemany(
+            """INSERT INTO files(rowid, dir_id, filename, size, modified, dev, ino)
+                VALUES (?, ?, ?, ?, ?, ?, ?);""",
+            [(row[0], *new_row) for row, new_row in zip(rows, new_rows)],
+        )
+        migrated += len(rows)
+    conn.execute("DROP TABLE files_flat;")
+    t_end = time.time() - start_time
+    LOGGER.info(f"Migrated {migrated:,} entries. Time elapsed: {t_end:.2f}s")
+
+
+def create_indexes(conn):
+    """Indexes used for path lookups, subtree queries and rename detection,
+    and the covering indexes sorted searches are paged along."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS files_dir_name ON files(dir_id, filename);"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS files_inode ON files(dev, ino);")
+    for name, columns in SORT_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON files({columns});")
+
+
+def create_search_index(conn):
+    """Trigram full text index over the filenames, kept in sync with
+    `files` by triggers. Skipped if sqlite lacks FTS5 or the trigram
+    tokenizer, searches then fall back to LIKE."""
+    exists = has_search_index(conn)
+    try:
+        conn.execute(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(filename,
+                content='files', content_rowid='rowid', tokenize='trigram');"""
+        )
+    except sqlite3.OperationalError as e:
+        LOGGER.warning(f"No trigram index available ({e}), using LIKE searches.")
+        return
+    if not exists:
+        conn.execute("INSERT INTO files_fts(files_fts) VALUES ('rebuild');")
+    create_search_triggers(conn)
+
+
+def create_search_triggers(conn):
+    """Triggers that mirror every change of a filename into `files_fts`."""
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files
+            BEGIN
+                INSERT INTO files_fts(rowid, filename)
+                VALUES (new.rowid, new.filename);
+            END;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files
+            BEGIN
+                INSERT INTO files_fts(files_fts, rowid, filename)
+                VALUES ('delete', old.rowid, old.filename);
+            END;"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS files_fts_update
+            AFTER UPDATE OF filename ON files
+            BEGIN
+                INSERT INTO files_fts(files_fts, rowid, filename)
+                VALUES ('delete', old.rowid, old.filename);
+                INSERT INTO files_fts(rowid, filename)
+                VALUES (new.rowid, new.filename);
+            END;"""
+    )
+
+
+def has_search_index(conn):
+    """Check if the trigram index exists in this database."""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_fts';")
+    return row.fetchone() is not None
+
+
+def drop_indexes(conn):
+    """Drop indexes before bulk inserts, rebuilding them afterwards is faster."""
+    conn.execute("DROP INDEX IF EXISTS files_filepath;")
+    conn.execute("DROP INDEX IF EXISTS files_dir_name;")
+    conn.execute("DROP INDEX IF EXISTS files_inode;")
+    for name in SORT_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name};")
+    # the trigram index is rebuilt in one go, not row by row
+    conn.execute("DROP TRIGGER IF EXISTS files_fts_insert;")
+    conn.execute("DROP TRIGGER IF EXISTS files_fts_delete;")
+    conn.execute("DROP TRIGGER IF EXISTS files_fts_update;")
+
+
+def connect():
+    """Open a connection to the database with an up to date schema. The
+    database is kept in WAL mode, readers see the last committed state
+    while it is written to."""
+    conn = sqlite3.connect(CONFIG.database_path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute(f"PRAGMA journal_size_limit = {WAL_SIZE_LIMIT};")
+    create_schema(conn)
+    return conn
+
+
+def shadow_path():
+    """Path of the database a rebuild is written to."""
+    return CONFIG.database_path + SHADOW_SUFFIX
+
+
+def connect_shadow():
+    """Open the database a rebuild is written to. It only has the tables,
+    the indexes are created once its rows are swapped in."""
+    conn = sqlite3.connect(shadow_path())
+    for statement in (CREATE_DIRS, CREATE_DIRS_INDEX, CREATE_FILES, CREATE_STATE):
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def remove_shadow():
+    """Delete the database of an unfinished rebuild."""
+    for suffix in DATABASE_FILES:
+        if os.path.exists(shadow_path() + suffix):
+            os.remove(shadow_path() + suffix)
+
+
+def check_shadow():
+    """Delete the database of an unfinished rebuild if it is corrupt, e.g.
+    after a failed write. Returns True if a rebuild can resume from it."""
+    if not os.path.exists(shadow_path()):
+        return False
+    status = quick_check(shadow_path())
+    if status != "ok":
+        LOGGER.error(f"Unfinished rebuild is unreadable ({status}), removing it")
+        remove_shadow()
+        return False
+    return True
+
+
+def swap_in_shadow(conn, settings):
+    """Replace the index by the rows of the shadow database.
+
+    Everything happens in one transaction, searches see the old index
+    until it commits and the new one, complete with its indexes, after."""
+    conn.execute("ATTACH DATABASE ? AS shadow;", (shadow_path(),))
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE;")
+    # the indexes and triggers go along with the tables
+    cursor.execute("DROP TABLE main.files;")
+    cursor.execute("DROP TABLE main.dirs;")
+    cursor.execute(CREATE_DIRS)
+    cursor.execute(CREATE_DIRS_INDEX)
+    cursor.execute(CREATE_FILES)
+    with PHASE_SECONDS.time(phase="write"):
+        cursor.execute(
+            """INSERT INTO main.dirs(id, parent_id, name, mtime, size,
+                file_count, modified) SELECT id, parent_id, name, mtime, size,
+                file_count, modified FROM shadow.dirs;"""
+        )
+        cursor.execute(
+            """INSERT INTO main.files(rowid, dir_id, filename, size, modified,
+                dev, ino) SELECT rowid, dir_id, filename, size, modified, dev,
+                ino FROM shadow.files;"""
+        )
+    with PHASE_SECONDS.time(phase="index"):
+        create_indexes(conn)
+        if has_search_index(conn):
+            cursor.execute("INSERT INTO files_fts(files_fts) VALUES ('rebuild');")
+            create_search_triggers(conn)
+    # mark the index as complete, incremental updates can build on it
+    cursor.execute(
+        "DELETE FROM main.state WHERE key IN ('scan_settings', ?);",
+        (Checkpoint.KEY,),
+    )
+    cursor.execute("INSERT INTO main.state VALUES ('scan_settings', ?);", (settings,))
+    with PHASE_SECONDS.time(phase="commit"):
+        conn.commit()
+    conn.execute("DETACH DATABASE shadow;")
+
+
+def scan_options():
+    """Scanner filter settings from the configuration."""
+    return scanner.ScanOptions(
+        index_hidden=CONFIG.hidden_files,
+        rules=exclusions.configured_rules(
+            CONFIG.excluded_folders,
+            CONFIG.excluded_directories,
+            CONFIG.excluded_patterns,
+        ),
+        roots=tuple(path.rstrip("/") or "/" for path in CONFIG.included_directories),
+        mount_points=frozenset(devices.read_mounts()),
+        one_filesystem=CONFIG.one_filesystem,
+    )
+
+
+def scan_limits():
+    """Concurrent scan tasks per kind of device, 0 uses `scan_workers`."""
+    return {
+        devices.SSD: CONFIG.ssd_workers,
+        devices.HDD: CONFIG.hdd_workers,
+        devices.NETWORK: CONFIG.network_workers,
+    }
+
+
+def scan_fingerprint(options):
+    """Identifies the settings an index was built with, an incremental
+    update is only valid if they did not change since."""
+    return json.dumps(
+        {
+            "roots": CONFIG.included_directories,
+            "hidden": options.index_hidden,
+            "rules": options.rules.patterns,
+            "one_filesystem": options.one_filesystem,
+        }
+    )
 
 
 def remove_database():
-    """Delete DB from disk"""
-    db_path = database_path()
-    os.remove(db_path)
+    """Delete DB from disk, along with its WAL files"""
+    db_path = CONFIG.database_path
+    for suffix in DATABASE_FILES:
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
     LOGGER.info("Deleting database...")
 
 
-def build_database():
-    """Build database in pure python code."""
-    db_path = database_path()
-    check_hidden = hidden_files_enabled()
+def build_database(resume=False, locate=None):
+    """Build database in pure python code.
+
+    The new index is written to a shadow database and swapped in when
+    it is complete, searches use the old index in the meantime. With
+    `resume`, a rebuild that was interrupted with the same scan settings
+    continues from its last checkpoint instead of starting over. With
+    `locate`, a `LocateDatabase`, the entries are imported from it and
+    only directories it is missing are scanned."""
     # establish connection and create table if it doesn'T exist yet
     LOGGER.info("Complete database rebuild...(python backend)")
     start_time = time.time()
 
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        """CREATE TABLE IF NOT EXISTS files(filename TEXT, filepath TEXT,
-            size INT, modified INT);"""
+    options = scan_options()
+    settings = scan_fingerprint(options)
+    shadow = connect_shadow()
+    checkpoint = Checkpoint.load(shadow, settings) if resume else None
+    if checkpoint is None:
+        shadow.close()
+        remove_shadow()
+        shadow = connect_shadow()
+    try:
+        if checkpoint is None:
+            if locate is None:
+                checkpoint = Checkpoint(settings, CONFIG.included_directories)
+                checkpoint.save(shadow)
+                shadow.commit()
+            rows = 0
+        else:
+            rows = shadow.execute("SELECT COUNT(*) FROM files;").fetchone()[0]
+            LOGGER.info(
+                f"Resuming the interrupted rebuild at {rows:,} entries, "
+                f"{len(checkpoint.pending):,} directories left..."
+            )
+        if checkpoint is None:
+            # not checkpointed, an interrupted import starts over with a scan
+            chunks = imported_chunks(locate, options)
+        else:
+            # scan disk in parallel and stream file entries into the table
+            chunks = scanner.scan(
+                sorted(checkpoint.pending),
+                options,
+                workers=CONFIG.scan_workers,
+                use_processes=CONFIG.scan_processes,
+                limits=scan_limits(),
+            )
+        rows += write_batches(shadow, chunks, checkpoint)
+        with PHASE_SECONDS.time(phase="totals"):
+            compute_totals(shadow)
+            shadow.commit()
+    except BaseException:
+        # back to the last checkpoint, a retry resumes from there
+        shadow.rollback()
+        raise
+    finally:
+        shadow.close()
+    conn = connect()
+    try:
+        swap_in_shadow(conn, settings)
+        directories = conn.execute("SELECT COUNT(*) FROM dirs;").fetchone()[0]
+    finally:
+        # an unfinished swap is rolled back, the old index stays
+        conn.close()
+    remove_shadow()
+
+    t_end = time.time() - start_time
+    REBUILD_SECONDS.observe(t_end)
+    LAST_REBUILD.set(t_end, total="seconds")
+    LAST_REBUILD.set(rows, total="entries")
+    LAST_REBUILD.set(directories, total="directories")
+    LAST_REBUILD.set(rows / t_end, total="entries_per_second")
+    LAST_REBUILD.set(directories / t_end, total="directories_per_second")
+    LOGGER.info(
+        f"Full rebuild finished. {rows:,} entries in {directories:,} "
+        f"directories. Time elapsed: {t_end:.2f}s"
     )
-    cursor.execute("""DELETE FROM files;""")
-    # iterate over disk and build file entries
-    directories = included_directories()
-    ex_folders = excluded_folders()
-    ex_dirs = excluded_directories()
-    file_list = []
-    for directory in directories:
-        for root, dirs, files in os.walk(directory, topdown=True):
-            if not check_hidden:
-                files = [f for f in files if not f[0] == "."]
-                dirs[:] = [
-                    d
-                    for d in dirs
-                    if not d[0] == "."
-                    and d not in ex_folders
-                    and os.path.join(root, d) not in ex_dirs
-                ]
-            # iterate over files and directories
-            for fil in files:
-                path = os.path.join(root, fil)
-                if os.path.exists(path):
-                    f_info = os.stat(path)
-                    size = int(f_info.st_size)
-                    modified = int(f_info.st_mtime)
-                    file_list.append((fil, path, size, modified))
-            for d in dirs:
-                path = os.path.join(root, d)
-                if path in ex_dirs:
-                    print(path)
+
+
+def imported_chunks(locate, options):
+    """Chunks of the entries in the `LocateDatabase` `locate`, followed by
+    the ones of scanning the directories it is missing."""
+    LOGGER.info(f"Importing '{locate.path}'...")
+    missing = yield from locate.chunks(CONFIG.included_directories, options)
+    if missing:
+        LOGGER.info(f"Scanning {len(missing):,} directories missing in the import")
+        yield from scanner.scan(
+            missing,
+            options,
+            workers=CONFIG.scan_workers,
+            use_processes=CONFIG.scan_processes,
+            limits=scan_limits(),
+        )
+
+
+def import_locate_database(path):
+    """Build the index from the mlocate database at `path`, then re-list
+    the directories that changed since `updatedb` wrote it. Sizes and
+    modification times are filled in later by `fill_stats`. Returns
+    False if `path` could not be imported."""
+    try:
+        locate = locatedb.LocateDatabase(path)
+    except (OSError, locatedb.LocateDatabaseError) as e:
+        LOGGER.warning(f"Not importing '{path}': {e}")
+        return False
+    try:
+        build_database(locate=locate)
+    except locatedb.LocateDatabaseError as e:
+        LOGGER.warning(f"Import of '{path}' failed: {e}")
+        remove_shadow()
+        return False
+    finally:
+        locate.close()
+    conn = connect()
+    try:
+        incremental_update(conn)
+    finally:
+        conn.close()
+    return True
+
+
+def first_build():
+    """Build a new index, imported from the locate database if there is
+    one that can be read."""
+    path = CONFIG.locate_database
+    if not (path and os.path.exists(path) and import_locate_database(path)):
+        build_database()
+
+
+def _stats(path):
+    """`(size, modified, dev, ino)` of `path` the way the scanner records
+    them, None if it is gone or a broken symlink."""
+    try:
+        entry = dbrecord_from_path(path)
+    except OSError:
+        return None
+    return entry.size, entry.modified, entry.dev, entry.ino
+
+
+def fill_stats(conn):
+    """Stat the entries an import left without size, modification time
+    and identity, in parallel and one batch per transaction. Entries
+    that are gone are removed, the directory totals are computed once
+    all are done. Returns the number of entries stat-ed."""
+    pending = conn.execute("SELECT 1 FROM files WHERE dev IS NULL LIMIT 1;")
+    if pending.fetchone() is None:
+        return 0
+    LOGGER.info("Filling in sizes and modification times of imported entries...")
+    start_time = time.time()
+    tree = DirectoryTree(conn)
+    filled = 0
+    with ThreadPoolExecutor(CONFIG.scan_workers or None) as pool:
+        while True:
+            rows = conn.execute(
+                "SELECT rowid, dir_id, filename FROM files WHERE dev IS NULL LIMIT ?;",
+                (STAT_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            paths = []
+            for _, dir_id, name in rows:
+                directory = tree.dir_path(dir_id)
+                paths.append(directory and os.path.join(directory, name))
+            stats = list(pool.map(lambda path: path and _stats(path), paths))
+            with conn:
+                for (rowid, _, _), path, values in zip(rows, paths, stats):
+                    if values is not None:
+                        conn.execute(
+                            """UPDATE files SET size = ?, modified = ?, dev = ?,
+                                ino = ? WHERE rowid = ?;""",
+                            (*values, rowid),
+                        )
+                    elif path is None or not tree.delete_path(path):
+                        conn.execute("DELETE FROM files WHERE rowid = ?;", (rowid,))
+            filled += len(rows)
+    with conn:
+        compute_totals(conn)
+    t_end = time.time() - start_time
+    LOGGER.info(f"Stat-ed {filled:,} entries. Time elapsed: {t_end:.2f}s")
+    return filled
+
+
+def update_database():
+    """Bring the database up to date.
+
+    Runs an incremental update when enabled and the existing index was
+    completely built with the current scan settings, a full rebuild
+    otherwise. An interrupted rebuild is resumed."""
+    if CONFIG.incremental_updates:
+        conn = connect()
+        stored = conn.execute(
+            "SELECT value FROM state WHERE key = 'scan_settings';"
+        ).fetchone()
+        if stored and stored[0] == scan_fingerprint(scan_options()):
+            try:
+                incremental_update(conn)
+                return
+            finally:
+                conn.close()
+        conn.close()
+    build_database(resume=True)
+
+
+def _stat_mtimes(paths):
+    """Directory mtimes in ns, `None` for directories that are gone."""
+    mtimes = []
+    for path in paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return mtimes
+
+
+def changed_directories(tree, chunk_size=1024):
+    """Directories whose mtime differs from the one stored in the index.
+
+    Only the directories themselves are stat-ed (in parallel), unchanged
+    directories have the same set of children as during the last scan."""
+    rows = tree.directories()
+    chunks = [rows[i : i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    changed = []
+    with ThreadPoolExecutor() as pool:
+        results = pool.map(_stat_mtimes, [[row[0] for row in c] for c in chunks])
+        for chunk, mtimes in zip(chunks, results):
+            for (path, old), new in zip(chunk, mtimes):
+                if new is not None and new != old:
+                    changed.append(path)
+    return changed
+
+
+def directories_by_mtime(conn):
+    """Paths of all listed directories, most recently modified first."""
+    rows = DirectoryTree(conn).directories()
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return [path for path, _ in rows]
+
+
+def incremental_update(conn):
+    """Update the index by re-listing only directories whose mtime changed.
+
+    Entries that disappeared from one directory and showed up in another
+    with the same `(st_dev, st_ino)` are treated as renames and updated in
+    place. Content changes of files in otherwise unchanged directories do
+    not touch the directory mtime and are left to the live monitor."""
+    LOGGER.info("Incremental database update...")
+    start_time = time.time()
+    options = scan_options()
+    tree = DirectoryTree(conn)
+    pending = changed_directories(tree)
+    listed = 0
+    while pending:
+        listed += len(pending)
+        added, removed, updates, directories, subdirs = [], {}, [], [], set()
+        for directory in pending:
+            records, listing, frontier = scanner.scan_subtree(directory, options, 1)
+            directories.extend(listing)
+            subdirs.update(frontier)
+            stored = {row[1]: row for row in tree.children(directory)}
+            for record in records:
+                row = stored.pop(record[0], None)
+                if row is None:
+                    added.append(record)
                     continue
-                if os.path.exists(path):
-                    file_list.append((d, path, 0, 0))
-    # # write file entries to database
-    cursor.executemany("INSERT INTO files VALUES (?, ?, ?, ?)", file_list)
-    conn.commit()
-    conn.close()
+                if record[1] in subdirs:
+                    # directories keep their totals
+                    record = (*record[:2], *row[2:4], *record[4:])
+                if tuple(row[2:]) != record[2:]:
+                    updates.append(record[2:] + (row[0],))
+            for name, row in stored.items():
+                # imported rows have no identity to match renames with
+                key = row[0] if row[4] is None else (row[4], row[5])
+                removed[key] = (row[0], os.path.join(directory, name))
+        # match new entries against vanished ones by inode identity
+        renamed, inserts = [], []
+        for record in added:
+            old = removed.pop((record[4], record[5]), None)
+            if old is None:
+                inserts.append(record)
+            else:
+                renamed.append((record, old))
+        conn.executemany(
+            "UPDATE files SET size=?, modified=?, dev=?, ino=? WHERE rowid=?;",
+            updates,
+        )
+        for record, (rowid, old_path) in renamed:
+            (row,) = tree.rows([record])
+            conn.execute(
+                """UPDATE files SET dir_id=?, filename=?, size=?, modified=?
+                    WHERE rowid=?;""",
+                row[:4] + (rowid,),
+            )
+            tree.move_directory(old_path, record[1])
+        for rowid, old_path in removed.values():
+            conn.execute("DELETE FROM files WHERE rowid=?;", (rowid,))
+            tree.delete_subtree(old_path)
+        for path, mtime in directories:
+            tree.add_directory(path, mtime)
+        conn.executemany(INSERT_FILE, tree.rows(inserts))
+        conn.commit()
+        # new directories are scanned completely
+        new_dirs = [r[1] for r in inserts if r[1] in subdirs]
+        if new_dirs:
+            write_batches(
+                conn,
+                scanner.scan(
+                    new_dirs,
+                    options,
+                    workers=CONFIG.scan_workers,
+                    use_processes=CONFIG.scan_processes,
+                    limits=scan_limits(),
+                ),
+            )
+        # renamed directories may have changed contents as well
+        moved = [r[1] for r, _ in renamed if r[1] in subdirs]
+        # the renamed rows of directories were written without totals
+        changed = [tree.dir_id(path) for path in pending + moved]
+        for path in new_dirs:
+            changed.extend(dir_id for dir_id, _ in tree.subtree(path))
+        tree.update_totals(changed)
+        conn.commit()
+        pending = []
+        for path, mtime in zip(moved, _stat_mtimes(moved)):
+            if mtime is not None and tree.directory_mtime(path) != mtime:
+                pending.append(path)
 
     t_end = time.time() - start_time
-    LOGGER.info(f"Full rebuild finished. Time elapsed: {t_end:.2f}s")
+    INCREMENTAL_SECONDS.observe(t_end)
+    RELISTED_DIRECTORIES.inc(listed)
+    LOGGER.info(
+        f"Incremental update finished. {listed:,} directories re-listed. "
+        f"Time elapsed: {t_end:.2f}s"
+    )
 
 
 def number_of_rows():
     "Number of entries in the table."
 
-    conn = sqlite3.connect(database_path())
+    conn = sqlite3.connect(CONFIG.database_path)
     cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM files")
     data = cursor.fetchall()
@@ -105,33 +1219,104 @@ def number_of_rows():
     return data[0][0]
 
 
-def validate_database():
-    "Check if database exists, if not build it."
-    LOGGER.info(f"Validating Database ... -> '{database_path()}' ")
-    path = pathlib.Path(database_path())
+def init_database():
+    """Make sure the database exists with an up to date schema, so the
+    window can search it while it is checked and updated in the
+    background."""
+    pathlib.Path(CONFIG.database_path).parent.mkdir(parents=True, exist_ok=True)
+    try:
+        connect().close()
+    except sqlite3.DatabaseError as e:
+        LOGGER.error(f"Database is unreadable ({e}), it will be rebuilt.")
+        remove_database()
+        connect().close()
+
+
+def quick_check(path):
+    """Result of checking the database at `path`, "ok" if it is healthy.
+    Reads every page but doesn't compare the indexes with their tables
+    like integrity_check."""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA quick_check(1);").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        return str(e)
+    finally:
+        conn.close()
+
+
+def validate_database(resume=True):
+    """Check if database exists, if not build it. Returns True if the
+    index was (re)built. An interrupted rebuild is resumed, unless
+    `resume` is off, it is then left for the next check."""
+    LOGGER.info(f"Validating Database ... -> '{CONFIG.database_path}' ")
+    path = pathlib.Path(CONFIG.database_path)
     if not path.parent.exists():
-        pathlib.Path(database_path()).parent.mkdir()
+        pathlib.Path(CONFIG.database_path).parent.mkdir()
     if not path.exists():
-        build_database()
-        return
-    # verify database health
-    conn = sqlite3.connect(path)
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA integrity_check;")
-    status = cursor.fetchall()[0][0]
-    conn.commit()
-    conn.close()
+        first_build()
+        return True
+    status = quick_check(path)
     # if db is in a bad state remove and rebuild
     if status != "ok":
-        os.remove(path)
+        LOGGER.error(f"Database check failed: {status}")
+        remove_database()
         build_database()
+        return True
+    # upgrade tables created by older versions
+    conn = connect()
+    empty = conn.execute("SELECT 1 FROM files LIMIT 1;").fetchone() is None
+    conn.close()
+    # the application was closed during a rebuild
+    if resume and os.path.exists(shadow_path()):
+        build_database(resume=True)
+        return True
+    if empty:
+        first_build()
+        return True
+    return False
+
+
+def startup_update():
+    """Check the database and bring it up to date if configured, in the
+    background while the window already searches the existing index.
+    Entries imported from a locate database are stat-ed afterwards."""
+    if not validate_database() and CONFIG.index_on_startup:
+        update_database()
+    conn = connect()
+    try:
+        fill_stats(conn)
+    finally:
+        conn.close()
+
+
+def delete_entry(filepath):
+    """Remove the entry for `filepath` (and its contents) from the index."""
+    conn = sqlite3.connect(CONFIG.database_path)
+    with conn:
+        DirectoryTree(conn).delete_path(filepath)
+    conn.close()
 
 
 def dbrecord_from_path(filepath):
     "Builds up a dataclass that represents a db record for the `files` table."
     fileinfo = os.stat(filepath)
+    # identity of the entry itself, not of a symlink's target
+    link_info = os.lstat(filepath)
     filename = str(pathlib.Path(filepath).name)
-    filesize = fileinfo.st_size
-    modified = fileinfo.st_mtime
-    db_record = DatabaseEntry(filename, filepath, filesize, modified)
+    if stat.S_ISDIR(fileinfo.st_mode):
+        # same as the scanner, the totals of directories are filled in by
+        # `DirectoryTree.update_totals`
+        filesize, modified = 0, 0
+    else:
+        filesize, modified = fileinfo.st_size, int(fileinfo.st_mtime)
+    db_record = DatabaseEntry(
+        filename,
+        filepath,
+        filesize,
+        modified,
+        link_info.st_dev,
+        link_info.st_ino,
+        stat.S_ISDIR(link_info.st_mode),
+    )
     return db_record
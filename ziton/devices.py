@@ -0,0 +1,119 @@
+"""
+Mount points and the kind of storage behind them.
+
+The scanner lists every device with a pool of its own, sized by the
+kind of the device: many concurrent listings for SSDs, few for
+rotational disks whose heads would otherwise seek back and forth, and
+a limited number for network filesystems. Mounts are read from
+/proc/self/mounts and the kind of a block device from /sys/class/block,
+where these don't exist every directory is on one device of unknown
+kind.
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass
+
+LOGGER = logging.getLogger(__name__)
+
+MOUNTS_PATH = "/proc/self/mounts"
+BLOCK_DEVICES = "/sys/class/block"
+
+# kinds of devices
+SSD = "ssd"
+HDD = "hdd"
+NETWORK = "network"
+UNKNOWN = "unknown"
+
+NETWORK_FILESYSTEMS = frozenset(
+    (
+        "9p",
+        "afs",
+        "ceph",
+        "cifs",
+        "davfs",
+        "fuse.rclone",
+        "fuse.sshfs",
+        "glusterfs",
+        "ncpfs",
+        "nfs",
+        "nfs4",
+        "smb3",
+        "smbfs",
+    )
+)
+
+# "\040" and friends in mount points with spaces, tabs or newlines
+_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+@dataclass(frozen=True)
+class Mount:
+    """One line of the mount table."""
+
+    path: str
+    source: str
+    fstype: str
+
+
+def _unescape(field):
+    return _ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def read_mounts(path=MOUNTS_PATH):
+    """`Mount`s by mount point, empty if the mount table can't be read. A
+    later mount over the same point hides the earlier one."""
+    mounts = {}
+    try:
+        with open(path) as infile:
+            for line in infile:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                source, mount_point, fstype = map(_unescape, fields[:3])
+                mounts[mount_point] = Mount(mount_point, source, fstype)
+    except OSError as e:
+        LOGGER.debug(f"No mount table: {e}")
+    return mounts
+
+
+def mount_of(path, mounts):
+    """The `Mount` `path` is on, None if `mounts` has none above it."""
+    while True:
+        mount = mounts.get(path)
+        if mount is not None:
+            return mount
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _rotational(name):
+    """True for a rotational block device, None if that is unknown.
+    Partitions have no queue of their own, their disk is asked."""
+    device = os.path.realpath(os.path.join(BLOCK_DEVICES, name))
+    for directory in (device, os.path.dirname(device)):
+        try:
+            with open(os.path.join(directory, "queue", "rotational")) as infile:
+                return infile.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def kind(mount):
+    """Kind of the device behind `mount`, one of `SSD`, `HDD`, `NETWORK`
+    and `UNKNOWN`."""
+    if mount is None:
+        return UNKNOWN
+    if mount.fstype in NETWORK_FILESYSTEMS:
+        return NETWORK
+    if not mount.source.startswith("/dev/"):
+        return UNKNOWN
+    # e.g. /dev/mapper/root -> /dev/dm-0
+    rotational = _rotational(os.path.basename(os.path.realpath(mount.source)))
+    if rotational is None:
+        return UNKNOWN
+    return HDD if rotational else SSD
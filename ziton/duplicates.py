@@ -0,0 +1,287 @@
+"""
+Finds files with identical content in stages, every stage only looks at
+the candidates the one before left:
+
+1. files of the same size, straight from the index
+2. a hash of the first and last `PARTIAL_SIZE` bytes
+3. a hash of the whole content, read in large blocks by a thread pool
+
+The candidates are stat-ed before they are hashed, files that changed
+since they were indexed are skipped. Hashes are cached in the `hashes`
+table together with the size and the modification time (in ns) of the
+file, repeated runs only read files that changed since.
+"""
+
+import hashlib
+import logging
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ziton.database as db
+from ziton import metrics
+from ziton.config import CONFIG
+
+LOGGER = logging.getLogger(__name__)
+
+# bytes hashed at both ends of a file by the second stage, files up to
+# twice this size are hashed completely right away
+PARTIAL_SIZE = 4096
+# bytes read at a time by the full hash
+BLOCK_SIZE = 1024 * 1024
+# smaller files are ignored, all empty files have the same content
+MIN_SIZE = 1
+# hashes written to the cache per transaction
+CACHE_BATCH = 1000
+
+# stages that hash, their index in a cache entry's hashes
+PARTIAL = 0
+FULL = 1
+
+STAGE_SECONDS = metrics.histogram(
+    "ziton_duplicate_stage_seconds",
+    "Time spent per stage of a duplicate search",
+    ("stage",),
+)
+HASHED_BYTES = metrics.counter(
+    "ziton_hashed_bytes_total", "Bytes read to hash files for duplicate searches"
+)
+
+
+def partial_hash(path, size):
+    """Hash of the first and last `PARTIAL_SIZE` bytes of the file."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as infile:
+        if size <= 2 * PARTIAL_SIZE:
+            data = infile.read()
+            HASHED_BYTES.inc(len(data))
+            digest.update(data)
+        else:
+            digest.update(infile.read(PARTIAL_SIZE))
+            infile.seek(-PARTIAL_SIZE, os.SEEK_END)
+            digest.update(infile.read(PARTIAL_SIZE))
+            HASHED_BYTES.inc(2 * PARTIAL_SIZE)
+    return digest.digest()
+
+
+def full_hash(path, size):
+    """Hash of the whole file, read in blocks into one reused buffer."""
+    digest = hashlib.blake2b(digest_size=16)
+    buffer = bytearray(BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as infile:
+        while True:
+            read = infile.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+            HASHED_BYTES.inc(read)
+    return digest.digest()
+
+
+def _hash(stage, entry):
+    """Hash of `entry` for `stage`, None if it can't be read."""
+    path, size, _ = entry
+    try:
+        if stage == PARTIAL:
+            return partial_hash(path, size)
+        return full_hash(path, size)
+    except OSError as e:
+        LOGGER.debug(f"Not hashing '{path}': {e}")
+        return None
+
+
+def _current(entry):
+    """`entry` with the modification time in ns the file has now, None if
+    it is no regular file of the indexed size anymore."""
+    path, size, _ = entry
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return None
+    # symlinks are indexed with the size of their target
+    if not stat.S_ISREG(info.st_mode) or info.st_size != size:
+        return None
+    return path, size, info.st_mtime_ns
+
+
+class HashCache:
+    """Hashes of earlier runs, valid as long as the size and modification
+    time in the index are the ones they were computed for."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.entries = {
+            path: (size, modified, [partial, full])
+            for path, size, modified, partial, full in conn.execute(
+                "SELECT path, size, modified, partial, full FROM hashes;"
+            )
+        }
+        self.seen = set()
+        self.dirty = set()
+
+    def get(self, entry):
+        """`[partial, full]` hashes of `entry`, None where unknown."""
+        path, size, modified = entry
+        self.seen.add(path)
+        cached = self.entries.get(path)
+        if cached is None or cached[:2] != (size, modified):
+            return [None, None]
+        return cached[2]
+
+    def put(self, entry, stage, digest):
+        """Remember the hash of `entry` for `stage`."""
+        path, size, modified = entry
+        cached = self.entries.get(path)
+        if cached is None or cached[:2] != (size, modified):
+            cached = self.entries[path] = (size, modified, [None, None])
+        cached[2][stage] = digest
+        self.dirty.add(path)
+        if len(self.dirty) >= CACHE_BATCH:
+            self.flush()
+
+    def flush(self, prune=False):
+        """Write new hashes, with `prune` also forget files that were no
+        candidates in this run."""
+        rows = []
+        for path in self.dirty:
+            size, modified, hashes = self.entries[path]
+            rows.append((path, size, modified, *hashes))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?);", rows
+            )
+            if prune:
+                stale = [(path,) for path in self.entries if path not in self.seen]
+                self.conn.executemany("DELETE FROM hashes WHERE path = ?;", stale)
+        self.dirty = set()
+
+
+def same_size(conn, min_size=MIN_SIZE):
+    """Groups of `(path, size, modified)` of files that have the same size
+    as another file in the index, `modified` is the indexed one in seconds.
+    Hard links of one file only count once, directories with their totals
+    are skipped."""
+    tree = db.DirectoryTree(conn)
+    rows = conn.execute(
+        """SELECT dir_id, filename, size, modified, dev, ino FROM files
+            WHERE size IN (SELECT size FROM files WHERE size >= ?
+                GROUP BY size HAVING COUNT(*) > 1)
+            AND NOT EXISTS (SELECT 1 FROM dirs
+                WHERE dirs.parent_id = files.dir_id
+                AND dirs.name = files.filename)
+            ORDER BY size;""",
+        (min_size,),
+    )
+    groups, group, inodes, last_size = [], [], set(), None
+    for dir_id, name, size, modified, dev, ino in rows:
+        if size != last_size:
+            groups.append(group)
+            group, inodes, last_size = [], set(), size
+        if dev is not None and (dev, ino) in inodes:
+            continue
+        inodes.add((dev, ino))
+        directory = tree.dir_path(dir_id)
+        if directory is not None:
+            group.append((os.path.join(directory, name), size, modified))
+    groups.append(group)
+    return [group for group in groups if len(group) > 1]
+
+
+def current_groups(groups, pool):
+    """`groups` with the current modification times, files that changed
+    and groups of one are dropped."""
+    entries = [entry for group in groups for entry in group]
+    current = dict(zip(entries, pool.map(_current, entries)))
+    groups = [[current[e] for e in group if current[e]] for group in groups]
+    return [group for group in groups if len(group) > 1]
+
+
+def split_groups(groups, stage, cache, pool):
+    """Split every group by the `stage` hash of its files, files that
+    can't be hashed and groups of one are dropped."""
+    digests, missing = {}, []
+    for group in groups:
+        for entry in group:
+            digest = cache.get(entry)[stage]
+            if digest is None:
+                missing.append(entry)
+            else:
+                digests[entry] = digest
+    hashed = pool.map(lambda entry: _hash(stage, entry), missing)
+    for entry, digest in zip(missing, hashed):
+        if digest is not None:
+            digests[entry] = digest
+            cache.put(entry, stage, digest)
+    result = []
+    for group in groups:
+        by_digest = {}
+        for entry in group:
+            if entry in digests:
+                by_digest.setdefault(digests[entry], []).append(entry)
+        result.extend(split for split in by_digest.values() if len(split) > 1)
+    return result
+
+
+def find_duplicates(min_size=MIN_SIZE):
+    """Groups of indexed files with identical content, see the module
+    docstring. Largest waste of space first."""
+    LOGGER.info("Searching duplicate files...")
+    start_time = time.time()
+    conn = db.connect()
+    try:
+        cache = HashCache(conn)
+        with STAGE_SECONDS.time(stage="size"):
+            groups = same_size(conn, min_size)
+        LOGGER.info(f"{sum(map(len, groups)):,} files share their size with others")
+        with ThreadPoolExecutor(CONFIG.scan_workers or None) as pool:
+            with STAGE_SECONDS.time(stage="stat"):
+                groups = current_groups(groups, pool)
+            with STAGE_SECONDS.time(stage="partial"):
+                groups = split_groups(groups, PARTIAL, cache, pool)
+            # small files were hashed completely by the partial hash
+            small = [g for g in groups if g[0][1] <= 2 * PARTIAL_SIZE]
+            large = [g for g in groups if g[0][1] > 2 * PARTIAL_SIZE]
+            LOGGER.info(f"{sum(map(len, large)):,} files need a full hash")
+            with STAGE_SECONDS.time(stage="full"):
+                groups = small + split_groups(large, FULL, cache, pool)
+        cache.flush(prune=True)
+    finally:
+        conn.close()
+    result = DuplicateResult(groups)
+    t_end = time.time() - start_time
+    LOGGER.info(
+        f"Found {len(groups):,} groups of duplicates, {result.wasted():,} bytes "
+        f"could be freed. Time elapsed: {t_end:.2f}s"
+    )
+    return result
+
+
+class DuplicateResult:
+    """Groups of identical files in the shape of a search result, so the
+    table view can page through them. Every group is listed in one
+    block, the group wasting the most space first."""
+
+    def __init__(self, groups):
+        self.groups = sorted(
+            (sorted(group) for group in groups),
+            key=lambda group: group[0][1] * (len(group) - 1),
+            reverse=True,
+        )
+        self.entries = [entry for group in self.groups for entry in group]
+
+    def wasted(self):
+        """Bytes taken by all but one file of every group."""
+        return sum(group[0][1] * (len(group) - 1) for group in self.groups)
+
+    def count(self):
+        """Total number of files in all groups."""
+        return len(self.entries)
+
+    def rows(self, start, limit):
+        """`(filename, filepath, size, modified, is_dir)` tuples of a slice."""
+        return [
+            (os.path.basename(path), path, size, modified // 10**9, False)
+            for path, size, modified in self.entries[start : start + limit]
+        ]
@@ -0,0 +1,319 @@
+"""
+Rules deciding which entries are left out of the index.
+
+Rules are written like lines of a `.gitignore`:
+
+    node_modules/       a directory of that name at any depth
+    *.pyc               files and directories matching the glob anywhere
+    /mnt/*/snapshots    a path relative to the rules' base directory
+    **/build/cache      `**` matches any number of directories
+    !keep.pyc           a negation, includes what an earlier rule left out
+
+The rules of the configuration are relative to `/`, the ones of a
+`.zitonignore` file to the directory it is in and to everything below.
+Only ignore files in the included directories and below them are read.
+Deeper files take precedence over the ones above them, all of them over
+the configuration, within one source the last matching rule wins.
+
+Every source is compiled once: rules without wildcards become dict
+lookups by name or relative path, all others one combined regex per
+kind of entry, tried from the last rule to the first so a single match
+finds the rule that decides.
+"""
+
+import logging
+import os
+import re
+
+LOGGER = logging.getLogger(__name__)
+
+IGNORE_FILE = ".zitonignore"
+
+# characters that make a rule a glob, escaped with "\" to match them
+GLOB_CHARACTERS = "*?[\\"
+
+
+def escape(text):
+    """Rule matching `text` literally."""
+    escaped = re.sub(r"([*?\[\\])", r"\\\1", text)
+    return "\\" + escaped if escaped[:1] in ("!", "#") else escaped
+
+
+def _translate(pattern):
+    """Regex source for a glob of `*`, `?`, `[...]` and `**`."""
+    parts, position, end = [], 0, len(pattern)
+    while position < end:
+        char = pattern[position]
+        if pattern.startswith("**", position) and (
+            position == 0 or pattern[position - 1] == "/"
+        ):
+            if pattern.startswith("**/", position):
+                # zero or more directories
+                parts.append("(?:.*/)?")
+                position += 3
+                continue
+            if position + 2 == end:
+                # everything below
+                parts.append(".*")
+                break
+        if char == "*":
+            parts.append("[^/]*")
+            while pattern.startswith("*", position + 1):
+                position += 1
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            close = position + 1
+            if pattern[close : close + 1] in ("!", "^"):
+                close += 1
+            if pattern[close : close + 1] == "]":
+                close += 1
+            close = pattern.find("]", close)
+            if close == -1:
+                parts.append(re.escape(char))
+            else:
+                members = pattern[position + 1 : close].replace("\\", "\\\\")
+                if members[:1] in ("!", "^"):
+                    members = "^" + members[1:]
+                parts.append(f"[{members}]")
+                position = close
+        elif char == "\\" and position + 1 < end:
+            position += 1
+            parts.append(re.escape(pattern[position]))
+        else:
+            parts.append(re.escape(char))
+        position += 1
+    return "".join(parts)
+
+
+def _unescape(pattern):
+    return re.sub(r"\\(.)", r"\1", pattern)
+
+
+def _is_glob(pattern):
+    return any(char in pattern for char in GLOB_CHARACTERS)
+
+
+class _Table:
+    """Rules for one kind of entry, files or directories."""
+
+    def __init__(self, rules):
+        # name or relative path -> index of the last literal rule for it
+        self.names, self.paths = {}, {}
+        globs = {False: [], True: []}
+        for index, anchored, pattern in rules:
+            if _is_glob(pattern):
+                globs[anchored].append((index, _translate(pattern)))
+            elif anchored:
+                self.paths[_unescape(pattern)] = index
+            else:
+                self.names[_unescape(pattern)] = index
+        self.name_regex, self.name_groups = self._combine(globs[False])
+        self.path_regex, self.path_groups = self._combine(globs[True])
+
+    @staticmethod
+    def _combine(globs):
+        """One regex with a group per glob, the last rule first, and the
+        rule index of every group."""
+        if not globs:
+            return None, ()
+        globs.sort(reverse=True)
+        alternatives = "|".join(f"({source})" for _, source in globs)
+        regex = re.compile(alternatives, re.DOTALL)
+        return regex, (None, *(index for index, _ in globs))
+
+    def last(self, relative, name):
+        """Index of the last rule matching, -1 if none does."""
+        index = max(self.names.get(name, -1), self.paths.get(relative, -1))
+        if self.name_regex is not None:
+            match = self.name_regex.fullmatch(name)
+            if match:
+                index = max(index, self.name_groups[match.lastindex])
+        if self.path_regex is not None:
+            match = self.path_regex.fullmatch(relative)
+            if match:
+                index = max(index, self.path_groups[match.lastindex])
+        return index
+
+
+class RuleSet:
+    """Compiled rules of one source, relative to the directory `base`."""
+
+    def __init__(self, patterns, base="/"):
+        self.patterns = list(patterns)
+        self.base = base.rstrip("/")
+        self.negated = []
+        rules = {False: [], True: []}
+        for line in self.patterns:
+            line = line.rstrip()
+            if not line or line[0] == "#":
+                continue
+            negated = line[0] == "!"
+            if negated:
+                line = line[1:]
+            elif line[0] == "\\" and line[1:2] in ("!", "#"):
+                line = line[1:]
+            directories_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # "**/name" is the same as "name"
+            while line.startswith("**/") and "/" not in line[3:]:
+                line = line[3:]
+            anchored = "/" in line
+            rule = (len(self.negated), anchored, line.lstrip("/"))
+            self.negated.append(negated)
+            rules[True].append(rule)
+            if not directories_only:
+                rules[False].append(rule)
+        # is_dir -> table
+        self.tables = {is_dir: _Table(rules[is_dir]) for is_dir in (False, True)}
+
+    @classmethod
+    def from_file(cls, directory):
+        """Rules of the ignore file in `directory`, None if it has none."""
+        path = os.path.join(directory, IGNORE_FILE)
+        try:
+            with open(path, encoding="utf-8", errors="surrogateescape") as infile:
+                lines = infile.read().splitlines()
+        except OSError:
+            return None
+        LOGGER.debug(f"Read {len(lines)} lines of '{path}'")
+        return cls(lines, directory)
+
+    def match(self, path, name, is_dir):
+        """True if the entry `path` named `name` is excluded, False if a
+        negation includes it, None if no rule is about it."""
+        index = self.tables[is_dir].last(path[len(self.base) + 1 :], name)
+        return None if index < 0 else not self.negated[index]
+
+
+def is_utf8(name):
+    """False for a name with bytes that aren't UTF-8, decoded by Python
+    as surrogates."""
+    try:
+        name.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def configured_rules(folders, directories, patterns):
+    """`RuleSet` of the configuration: excluded folder names, excluded
+    directory paths and the rules of `excluded_patterns`, in that order."""
+    return RuleSet(
+        [escape(name) + "/" for name in folders]
+        + ["/" + escape(path.strip("/")) + "/" for path in directories]
+        + list(patterns)
+    )
+
+
+class Exclusions:
+    """Decides which entries are left out with `ScanOptions`: hidden
+    names, the configured rules and the `.zitonignore` files of the
+    directories above an entry, up to the included directory. Ignore
+    files are read once per directory and cached until `forget` is
+    called."""
+
+    def __init__(self, options):
+        self.options = options
+        # tree of dicts by path component, the `RuleSet`s of the ignore
+        # files at and above a directory are stored under the key None
+        self.cache = {}
+
+    def _root(self, directory):
+        """The outermost included directory `directory` is in, None if it
+        is in none."""
+        roots = [
+            root
+            for root in self.options.roots
+            if directory == root or directory.startswith(os.path.join(root, ""))
+        ]
+        return min(roots, key=len, default=None)
+
+    def seed(self, directory, chain):
+        """Use `chain`, e.g. returned by `chain` elsewhere, for `directory`
+        instead of reading its ignore files."""
+        node = self.cache
+        for name in directory.split("/"):
+            if name:
+                node = node.setdefault(name, {})
+        node[None] = chain
+
+    def chain(self, directory, has_file=None):
+        """`RuleSet`s of the ignore files at and above `directory`, the
+        deepest last. `has_file` tells if `directory` contains one, it is
+        looked for if None."""
+        names = [name for name in directory.split("/") if name]
+        # the deepest directory on the way whose chain is known
+        node, nodes = self.cache, [self.cache]
+        for name in names:
+            node = node.get(name)
+            if node is None:
+                break
+            nodes.append(node)
+        known = next((d for d in reversed(range(len(nodes))) if None in nodes[d]), -1)
+        if known == len(names):
+            return nodes[known][None]
+        root = self._root(directory)
+        if root is None:
+            return ()
+        start, chain = len([name for name in root.split("/") if name]), ()
+        if known >= start:
+            start, chain = known + 1, nodes[known][None]
+        node = self.cache
+        for depth in range(len(names) + 1):
+            if depth:
+                node = node.setdefault(names[depth - 1], {})
+            if depth < start:
+                continue
+            if depth < len(names) or has_file is not False:
+                rules = RuleSet.from_file("/" + "/".join(names[:depth]))
+                if rules is not None:
+                    chain += (rules,)
+            node[None] = chain
+        return chain
+
+    def forget(self, directory):
+        """Drop the cached rules at and below `directory`, e.g. once its
+        ignore file changed or it was replaced."""
+        *parents, name = [""] + [name for name in directory.split("/") if name]
+        node = self.cache
+        for parent in parents[1:]:
+            node = node.get(parent)
+            if node is None:
+                return
+        if name:
+            node.pop(name, None)
+        else:
+            node.clear()
+
+    def excluded(self, directory, name, is_dir):
+        """True if the entry `name` in `directory` is left out. Names that
+        aren't UTF-8 always are, sqlite can't store them."""
+        if not self.options.index_hidden and name[0] == ".":
+            return True
+        if not name.isascii() and not is_utf8(name):
+            return True
+        path = os.path.join(directory, name)
+        for rules in reversed(self.chain(directory)):
+            verdict = rules.match(path, name, is_dir)
+            if verdict is not None:
+                return verdict
+        return bool(self.options.rules.match(path, name, is_dir))
+
+    def excluded_path(self, path, root):
+        """True if the directory `path` below `root` is not listed by the
+        scanner, because it or a directory above it is left out or it is
+        on another filesystem with `one_filesystem`."""
+        directory = root.rstrip("/") or "/"
+        for name in path[len(root) :].split("/"):
+            if not name:
+                continue
+            if self.excluded(directory, name, True):
+                return True
+            directory = os.path.join(directory, name)
+            options = self.options
+            if options.one_filesystem and directory in options.mount_points:
+                return True
+        return False
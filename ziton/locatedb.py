@@ -0,0 +1,143 @@
+"""
+Reader for the database of mlocate's `updatedb`, so a first index can be
+built without walking the whole filesystem.
+
+An mlocate database lists every directory once, with the time it was
+last changed and the names of its entries, marked as directory or not.
+Sizes, modification times and inodes are not part of it, imported
+entries have none until they are stat-ed (see `ziton.database`).
+
+The format, as described in mlocate.db(5), all numbers big endian:
+
+    header      "\\0mlocate", u32 size of the configuration block,
+                u8 version, u8 visibility check, 2 bytes padding, the
+                NUL terminated root path, the configuration block
+    directory   u64 seconds, u32 nanoseconds, 4 bytes padding, the NUL
+                terminated path, then its entries
+    entry       u8 type (0 file, 1 directory, 2 end of the directory),
+                the NUL terminated name unless it is the end
+
+plocate databases only keep compressed paths without telling files and
+directories apart, they are rejected.
+"""
+
+import logging
+import mmap
+import os
+import struct
+
+from ziton import exclusions
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"\0mlocate"
+PLOCATE_MAGIC = b"\0plocate"
+VERSION = 0
+
+HEADER = struct.Struct(">8sIBB2x")
+DIRECTORY_HEADER = struct.Struct(">QI4x")
+
+# entry types
+FILE = 0
+DIRECTORY = 1
+END = 2
+
+
+class LocateDatabaseError(Exception):
+    """Raised for a file that is no readable mlocate database."""
+
+
+class LocateDatabase:
+    """An mlocate database file, mapped into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as infile:
+            try:
+                self.data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                # empty file
+                raise LocateDatabaseError(f"'{path}' is empty") from e
+        if self.data[: len(PLOCATE_MAGIC)] == PLOCATE_MAGIC:
+            self.close()
+            raise LocateDatabaseError(f"'{path}' is a plocate database")
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise LocateDatabaseError(f"'{path}' is too short")
+        magic, conf_size, version, _ = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise LocateDatabaseError(f"'{path}' is no mlocate database")
+        root_end = self._end(HEADER.size)
+        self.root = os.fsdecode(self.data[HEADER.size : root_end])
+        self.start = root_end + 1 + conf_size
+
+    def close(self):
+        """Unmap the file."""
+        self.data.close()
+
+    def _end(self, position):
+        """Position of the NUL terminating the string at `position`."""
+        end = self.data.find(b"\0", position)
+        if end == -1:
+            raise LocateDatabaseError(f"'{self.path}' is truncated")
+        return end
+
+    def directories(self):
+        """Yields `(path, mtime_ns, entries)` of every directory, entries
+        are `(name, is_dir)` pairs. The time is the later one of the
+        directory's mtime and ctime when `updatedb` listed it."""
+        data, position = self.data, self.start
+        while position < len(data):
+            if position + DIRECTORY_HEADER.size > len(data):
+                raise LocateDatabaseError(f"'{self.path}' is truncated")
+            seconds, nanoseconds = DIRECTORY_HEADER.unpack_from(data, position)
+            position += DIRECTORY_HEADER.size
+            end = self._end(position)
+            path = os.fsdecode(data[position:end])
+            position = end + 1
+            entries = []
+            while True:
+                if position >= len(data):
+                    raise LocateDatabaseError(f"'{self.path}' is truncated")
+                kind = data[position]
+                position += 1
+                if kind == END:
+                    break
+                end = self._end(position)
+                entries.append((os.fsdecode(data[position:end]), kind == DIRECTORY))
+                position = end + 1
+            yield path, seconds * 10**9 + nanoseconds, entries
+
+    def chunks(self, roots, options):
+        """`(records, directories, frontier)` chunks of the directories at
+        or below `roots`, filtered by `options` like `scanner.scan` does.
+        Records have a size and modification time of 0 and no identity.
+
+        Returns the directories that are part of the index but missing
+        in the database, e.g. pruned by `updatedb`, they have to be
+        scanned."""
+        roots = [os.path.join(root, "") for root in roots]
+        expected = {root.rstrip("/") or "/" for root in roots}
+        listed = set()
+        rules = exclusions.Exclusions(options)
+        for path, mtime, entries in self.directories():
+            prefix = os.path.join(path, "")
+            root = next((r for r in roots if prefix.startswith(r)), None)
+            if root is None or rules.excluded_path(path, root):
+                continue
+            listed.add(path)
+            has_file = any(name == exclusions.IGNORE_FILE for name, _ in entries)
+            rules.chain(path, has_file)
+            records = []
+            for name, is_dir in entries:
+                if rules.excluded(path, name, is_dir):
+                    continue
+                child = prefix + name
+                if is_dir and not (
+                    options.one_filesystem and child in options.mount_points
+                ):
+                    expected.add(child)
+                records.append((name, child, 0, 0, None, None))
+            yield records, [(path, mtime)], []
+        return sorted(expected - listed)
@@ -0,0 +1,280 @@
+"""
+Counters, gauges and histograms describing what the indexer is doing.
+
+Metrics are declared at module level next to the code they measure and
+can be updated from any thread. `snapshot` returns all of them as plain
+data, `dump` writes them as JSON or in the Prometheus text format.
+"""
+
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+# upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+)
+
+# seconds between two dumps of the metrics file
+DUMP_INTERVAL = 10.0
+
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+
+class Metric:
+    """A named value per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels) or set(labels) != set(self.labels):
+            raise ValueError(f"Metric '{self.name}' takes labels {self.labels}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def get(self, **labels):
+        """Current value for the given labels."""
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        """`(labels, value)` pairs of everything recorded so far."""
+        with self.lock:
+            return [
+                (dict(zip(self.labels, key)), self._export(value))
+                for key, value in sorted(self.values.items())
+            ]
+
+    def _export(self, value):
+        return value
+
+
+class Counter(Metric):
+    """Monotonically increasing total."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down, e.g. a queue depth."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observations in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for number, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[number] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels):
+        """Number of observations for the given labels."""
+        with self.lock:
+            state = self.values.get(self._key(labels))
+            return state[1] if state else 0
+
+    def quantile(self, q, **labels):
+        """Upper bound of the bucket holding the `q` quantile, None if
+        nothing was observed."""
+        with self.lock:
+            state = self.values.get(self._key(labels))
+            if not state or not state[1]:
+                return None
+            rank = q * state[1]
+            total = 0
+            for bound, count in zip(self.buckets, state[0]):
+                total += count
+                if total >= rank:
+                    return bound
+            return math.inf
+
+    def _export(self, value):
+        counts, count, total = value
+        cumulative, buckets = 0, {}
+        for bound, number in zip(self.buckets, counts):
+            cumulative += number
+            buckets[_format_bound(bound)] = cumulative
+        return {"count": count, "sum": total, "buckets": buckets}
+
+
+def _register(cls, name, description, labels, **kwargs):
+    with _registry_lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, description, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+            raise ValueError(f"Metric '{name}' is already registered differently")
+        return metric
+
+
+def counter(name, description, labels=()):
+    """Declare a counter, or return the existing one named `name`."""
+    return _register(Counter, name, description, labels)
+
+
+def gauge(name, description, labels=()):
+    """Declare a gauge, or return the existing one named `name`."""
+    return _register(Gauge, name, description, labels)
+
+
+def histogram(name, description, labels=(), buckets=LATENCY_BUCKETS):
+    """Declare a histogram, or return the existing one named `name`."""
+    return _register(Histogram, name, description, labels, buckets=buckets)
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def snapshot():
+    """All metrics as JSON serializable data."""
+    with _registry_lock:
+        metrics = list(REGISTRY.values())
+    return {
+        metric.name: {
+            "type": metric.kind,
+            "description": metric.description,
+            "samples": [
+                {"labels": labels, "value": value}
+                for labels, value in metric.samples()
+            ],
+        }
+        for metric in metrics
+    }
+
+
+def prometheus():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in snapshot().items():
+        lines.append(f"# HELP {name} {metric['description']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for sample in metric["samples"]:
+            labels, value = sample["labels"], sample["value"]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            for bound, count in value["buckets"].items():
+                bucket_labels = _format_labels({**labels, "le": bound})
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(path):
+    """Write all metrics to `path`, as JSON if it ends with `.json` and in
+    the Prometheus text format otherwise. The file is replaced atomically
+    so collectors never read half of it."""
+    if path.endswith(".json"):
+        text = json.dumps({"time": time.time(), "metrics": snapshot()}, indent=1)
+    else:
+        text = prometheus()
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as outfile:
+        outfile.write(text)
+    os.replace(tmp_path, path)
+
+
+def start_dumping(path, interval=DUMP_INTERVAL):
+    """Dump the metrics to `path` every `interval` seconds and at exit.
+    Returns an event that stops the periodic dumps when set."""
+
+    def dump_logged():
+        try:
+            dump(path)
+        except OSError as e:
+            LOGGER.error(f"Could not write metrics to '{path}': {e}")
+
+    def run():
+        while not stopped.wait(interval):
+            dump_logged()
+
+    stopped = threading.Event()
+    threading.Thread(target=run, name="metrics", daemon=True).start()
+    atexit.register(dump_logged)
+    LOGGER.info(f"Writing metrics to '{path}' every {interval:.0f}s")
+    return stopped
@@ -1,77 +1,612 @@
 """
 Monitors filesystem status in realtime.
+
+inotify events are read on a worker thread and collected into batches
+that are written to the index in a single transaction, so bursts of
+events (checkouts, extracting archives, build output) neither flood
+the GUI thread nor cost one commit per event. When events may have
+been lost (a queue overflow, an unmount, a read error) the monitor asks
+for an update of the database instead.
 """
 
 import logging
 import os
+import sqlite3
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import chain
 
 import inotify.adapters
-from PySide2.QtCore import QObject, QThread, Signal, Slot
+import inotify.calls
+from PySide2.QtCore import QObject, QThread, Signal
 
-from ziton.config import hidden_files_enabled, included_directories
+import ziton.database as db
+from ziton import exclusions, metrics, scanner
+from ziton.config import CONFIG
 
 LOGGER = logging.getLogger(__name__)
 
+# seconds the event reader blocks before checking for pending work, a
+# batch is written once no event arrived for that long
+POLL_INTERVAL = 0.2
+# a batch is written at the latest this many seconds after its first event
+MAX_LATENCY = 1.0
+# or as soon as it covers this many changes
+MAX_BATCH = 10000
+# seconds until a batch that failed to apply is tried again
+RETRY_INTERVAL = 5.0
+# watches registered between two reads of events
+WATCH_SLICE = 1000
+
+# structural operations, applied in event order
+DELETE = "delete"
+MOVE = "move"
+SCAN = "scan"
+
+MAX_USER_WATCHES = "/proc/sys/fs/inotify/max_user_watches"
+
+# events that change the size or mtime of an existing entry
+MODIFY_EVENTS = ("IN_MODIFY", "IN_CLOSE_WRITE", "IN_ATTRIB")
+
+EVENTS_RECEIVED = metrics.counter(
+    "ziton_inotify_events_received_total", "inotify events read"
+)
+EVENTS_IGNORED = metrics.counter(
+    "ziton_inotify_events_ignored_total", "Events about hidden or excluded entries"
+)
+EVENTS_APPLIED = metrics.counter(
+    "ziton_inotify_events_applied_total", "Events written to the index"
+)
+EVENTS_DROPPED = metrics.counter(
+    "ziton_inotify_events_dropped_total",
+    "Events of batches that still failed to apply when the monitor stopped",
+)
+RESCANS = metrics.counter(
+    "ziton_monitor_rescans_total",
+    "Database updates requested because events may have been lost",
+    ("reason",),
+)
+PENDING_CHANGES = metrics.gauge(
+    "ziton_monitor_pending_changes", "Changes collected but not written yet"
+)
+APPLY_SECONDS = metrics.histogram(
+    "ziton_monitor_apply_seconds", "Time to write one batch of changes"
+)
+LAG_SECONDS = metrics.histogram(
+    "ziton_monitor_lag_seconds",
+    "Time from the first event of a batch until it was written",
+)
+WATCHES = metrics.gauge(
+    "ziton_watched_directories", "Directories with an inotify watch", ("state",)
+)
+
+
+class Inotify(inotify.adapters.Inotify):
+    """inotify adapter that remembers queue overflows. It drops them with
+    the events of unknown watches, as they belong to none."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.overflowed = False
+
+    def _get_event_names(self, event_type):
+        names = super()._get_event_names(event_type)
+        if "IN_Q_OVERFLOW" in names:
+            self.overflowed = True
+        return names
+
+
+def max_user_watches():
+    """The per user inotify watch limit, None if it can't be read."""
+    try:
+        with open(MAX_USER_WATCHES) as infile:
+            return int(infile.read())
+    except (OSError, ValueError):
+        return None
+
+
+def watched_directories(conn, options):
+    """Directories to watch, most recently modified first.
+
+    Taken from the index instead of walking the tree again, and checked
+    against the current exclusions in case they changed since the last
+    rebuild. The included directories are always part of it."""
+    roots = [os.path.join(d, "") for d in CONFIG.included_directories]
+    directories = list(CONFIG.included_directories)
+    rules = exclusions.Exclusions(options)
+    for path in db.directories_by_mtime(conn):
+        for root in roots:
+            if path.startswith(root):
+                if not rules.excluded_path(path, root):
+                    directories.append(path)
+                break
+    return directories
+
+
+@dataclass
+class IndexChanges:
+    """What a batch changed in the index, for mirroring it elsewhere."""
+
+    # `DatabaseEntry` of every inserted or updated row
+    added: list = field(default_factory=list)
+    # paths whose rows were deleted or replaced
+    removed: list = field(default_factory=list)
+    # whole subtrees were added, moved or removed
+    restructured: bool = False
+
+
+class ChangeBatch:
+    """Changes collected from inotify events.
+
+    Creations and modifications only mark a path as dirty, every dirty
+    path is stat-ed once when the batch is applied. A file written to
+    many times, or created and deleted again, costs at most one row
+    update. Deletions, renames and new directories are applied in
+    event order before that."""
+
+    def __init__(self, options, rules):
+        self.options = options
+        # `exclusions.Exclusions` shared by the batches of a worker
+        self.rules = rules
+        # (operation, path, source of a move, is_dir)
+        self.operations = []
+        self.dirty = set()
+        # inotify cookie -> position of an IN_MOVED_FROM in `operations`
+        self.moves = {}
+        self.started = None
+        self.last_event = None
+        # earliest time to try again after applying failed
+        self.retry_at = None
+        # inotify events that led to the changes
+        self.events = 0
+
+    def __len__(self):
+        return len(self.operations) + len(self.dirty)
+
+    def due(self):
+        """True if events paused or the batch got too old or too big."""
+        if not self:
+            return False
+        now = time.monotonic()
+        if self.retry_at is not None and now < self.retry_at:
+            return False
+        return (
+            now - self.last_event >= POLL_INTERVAL
+            or now - self.started >= MAX_LATENCY
+            or len(self) >= MAX_BATCH
+        )
 
-def get_subdirs():
-    """get all subdirectories"""
-    check_hidden = hidden_files_enabled()
-    directories = included_directories()
-    dir_list = []
-    for directory in directories:
-        for root, dirs, _ in os.walk(directory, topdown=True):
-            if not check_hidden:
-                dirs[:] = [d for d in dirs if not d[0] == "."]
-            dir_list.extend([os.path.join(root, d) for d in dirs])
-    return dir_list
+    def _touch(self):
+        self.last_event = time.monotonic()
+        if self.started is None:
+            self.started = self.last_event
+
+    def ignored(self, filename, path, is_dir):
+        """Same filters as the scanner."""
+        return self.rules.excluded(os.path.dirname(path), filename, is_dir)
+
+    def rules_changed(self, directory):
+        """The ignore file of `directory` changed, its subtree is listed
+        again with the new rules."""
+        self.rules.forget(directory)
+        if (SCAN, directory, None, True) not in self.operations:
+            self._operation(SCAN, directory, is_dir=True)
+
+    def _operation(self, operation, path, source=None, is_dir=False):
+        self._touch()
+        self.operations.append((operation, path, source, is_dir))
+
+    def created(self, path, is_dir):
+        """`path` was created or moved in from outside the watched area."""
+        if is_dir:
+            self._operation(SCAN, path, is_dir=True)
+        self.modified(path)
+
+    def modified(self, path):
+        """Contents or attributes of `path` changed."""
+        self._touch()
+        self.dirty.add(path)
+
+    def deleted(self, path, is_dir):
+        """`path` was deleted."""
+        self.dirty.discard(path)
+        if is_dir:
+            prefix = os.path.join(path, "")
+            self.dirty = {p for p in self.dirty if not p.startswith(prefix)}
+        self._operation(DELETE, path, is_dir=is_dir)
+
+    def moved_from(self, path, cookie, is_dir):
+        """First half of a rename, a delete unless `moved_to` pairs it."""
+        self.moves[cookie] = len(self.operations)
+        self._operation(DELETE, path, is_dir=is_dir)
+
+    def moved_to(self, path, cookie, is_dir):
+        """Second half of a rename, returns the source path. Returns None
+        if there was no matching `moved_from`, the entry is then treated
+        as created."""
+        position = self.moves.pop(cookie, None)
+        if position is None:
+            self.created(path, is_dir)
+            return None
+        self._touch()
+        source = self.operations[position][1]
+        self.operations[position] = (MOVE, path, source, is_dir)
+        # pending changes below the source happened to the moved entries
+        prefix = os.path.join(source, "")
+        for old in [p for p in self.dirty if p == source or p.startswith(prefix)]:
+            self.dirty.discard(old)
+            self.dirty.add(path + old[len(source) :])
+        return source
+
+    def apply(self, conn, monitor):
+        """Write the batch to the index in one transaction, watching new
+        and unwatching removed directories. Returns the `IndexChanges`.
+
+        The totals of the directories that had entries added or removed
+        and of their ancestors are updated in the same transaction."""
+        changes = IndexChanges()
+        tree = db.DirectoryTree(conn)
+        # ids of directories whose totals changed
+        changed = set()
+        with conn:
+            for operation, path, source, is_dir in self.operations:
+                changes.restructured |= is_dir
+                changed.add(tree.dir_id(os.path.dirname(path)))
+                if operation == DELETE:
+                    for directory in tree.subtree_directories(path):
+                        monitor.unwatch(directory)
+                    if tree.delete_path(path):
+                        changes.removed.append(path)
+                elif operation == MOVE and tree.rename_entry(source, path):
+                    changes.removed.append(source)
+                    changed.add(tree.dir_id(os.path.dirname(source)))
+                    self.dirty.add(path)
+                elif is_dir:
+                    # new directory, or the source of a move wasn't indexed
+                    self._scan(tree, monitor, path, changes)
+                    changed.update(dir_id for dir_id, _ in tree.subtree(path))
+                else:
+                    self.dirty.add(path)
+            for path in self.dirty:
+                self._refresh(tree, path, changes)
+                # the refreshed row of a directory has no totals
+                changed.add(tree.dir_id(os.path.dirname(path)))
+                changed.add(tree.dir_id(path))
+            tree.update_totals(changed)
+        return changes
+
+    def _scan(self, tree, monitor, path, changes):
+        """Index everything below a new directory."""
+        tree.delete_subtree(path)
+        records, listed, frontier = scanner.scan_subtree(
+            path, self.options, rules=self.rules
+        )
+        chunks = [(records, listed, frontier)]
+        if frontier:
+            # big subtree (moved in or extracted), continue in parallel
+            chunks = chain(
+                chunks,
+                scanner.scan(
+                    frontier,
+                    self.options,
+                    workers=CONFIG.scan_workers,
+                    use_processes=CONFIG.scan_processes,
+                    limits=db.scan_limits(),
+                ),
+            )
+        added, directories = [], set()
+        for records, listed, _ in chunks:
+            for directory, mtime in listed:
+                tree.add_directory(directory, mtime)
+                directories.add(directory)
+                monitor.watch(directory)
+            tree.conn.executemany(db.INSERT_FILE, tree.rows(records))
+            added.extend(records)
+        # a directory is listed by the same or a later chunk than its record
+        changes.added.extend(
+            db.DatabaseEntry(*record, record[1] in directories) for record in added
+        )
+        self.dirty.add(path)
+
+    def _refresh(self, tree, path, changes):
+        """Store the current state of a dirty path."""
+        try:
+            entry = db.dbrecord_from_path(path)
+        except OSError:
+            # gone again, or a broken symlink which the scanner skips too
+            if tree.delete_path(path):
+                changes.removed.append(path)
+            return
+        if not tree.upsert_entry(entry):
+            changes.removed.append(path)
+        changes.added.append(entry)
 
 
 class Worker(QThread):
-    """
-    Worker thread
-    """
+    """Reads inotify events and applies them to the index in batches."""
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.stopped = False
+        self.register_requested = True
+        # reason to update the database, events may have been lost
+        self.rescan_reason = None
+
+    def stop(self):
+        """Finish after writing the pending batch."""
+        self.stopped = True
+
+    def register_watches(self):
+        """Watch directories added to the index, e.g. by a rebuild."""
+        self.register_requested = True
+
+    def events_lost(self, reason):
+        """Have the database updated once events pause, the index may have
+        missed changes."""
+        if self.rescan_reason is None:
+            self.rescan_reason = reason
 
-    @Slot()
     def run(self):
         """start worker."""
-        for event in self.parent().ino.event_gen(yield_nones=False):
-            (_, type_names, path, filename) = event
+        monitor = self.parent()
+        options = db.scan_options()
+        rules = exclusions.Exclusions(options)
+        conn = db.connect()
+        batch = ChangeBatch(options, rules)
+        while not self.stopped:
+            try:
+                # unmounts are handled like other events, instead of ending
+                # the generator with the events read after them
+                for event in monitor.ino.event_gen(
+                    yield_nones=True, terminal_events=()
+                ):
+                    if self.register_requested:
+                        self.register_requested = False
+                        monitor.add_watchers(conn, options)
+                    if event is not None:
+                        self.handle(event, batch)
+                        PENDING_CHANGES.set(len(batch))
+                    elif monitor.to_watch:
+                        # the events read so far are handled
+                        monitor.watch_slice()
+                    if monitor.ino.overflowed:
+                        monitor.ino.overflowed = False
+                        LOGGER.warning("inotify queue overflowed, events were lost")
+                        self.events_lost("overflow")
+                    if batch.due() or self.stopped and batch:
+                        if self.apply(conn, batch):
+                            batch = ChangeBatch(options, rules)
+                        elif self.stopped:
+                            LOGGER.error(f"Dropping {len(batch)} filesystem changes")
+                            EVENTS_DROPPED.inc(batch.events)
+                    if event is None and self.rescan_reason is not None:
+                        RESCANS.inc(reason=self.rescan_reason)
+                        self.rescan_reason = None
+                        monitor.rescanRequested.emit()
+                    if self.stopped:
+                        break
+            except (inotify.calls.InotifyError, OSError, UnicodeError) as e:
+                # e.g. an event about a name that isn't UTF-8, the adapter
+                # already skipped it and continues with the next one
+                LOGGER.warning(f"Reading filesystem events failed: {e}")
+                self.events_lost("error")
+                time.sleep(POLL_INTERVAL)
+        conn.close()
 
-            if "IN_CREATE" in type_names:
-                p = os.path.join(path, filename)
-                self.parent().file_created(p)
-            if "IN_DELETE" in type_names:
-                p = os.path.join(path, filename)
-                self.parent().file_deleted(p)
+    def handle(self, event, batch):
+        """Add a single inotify event to `batch`."""
+        header, type_names, directory, filename = event
+        EVENTS_RECEIVED.inc()
+        # the adapter reports the path a renamed directory had when added
+        directory = self.parent().paths.get(header.wd, directory)
+        if "IN_UNMOUNT" in type_names:
+            # the kernel dropped the watches on the filesystem, the index
+            # still lists its entries
+            LOGGER.info(f"'{directory}' was unmounted")
+            self.parent().unwatch_subtree(directory)
+            self.events_lost("unmount")
+            return
+        if not filename:
+            # event about a watched directory itself, seen from its parent
+            return
+        path = os.path.join(directory, filename)
+        is_dir = "IN_ISDIR" in type_names
+        if is_dir and not any(name in type_names for name in MODIFY_EVENTS):
+            # created, deleted or moved, rules cached below it are stale
+            batch.rules.forget(path)
+        elif filename == exclusions.IGNORE_FILE:
+            batch.rules_changed(directory)
+        if batch.ignored(filename, path, is_dir):
+            EVENTS_IGNORED.inc()
+            return
+        batch.events += 1
+        if "IN_CREATE" in type_names:
+            batch.created(path, is_dir)
+            if is_dir:
+                # watch right away, the directory is listed only later
+                self.parent().watch(path)
+        elif "IN_MOVED_TO" in type_names:
+            source = batch.moved_to(path, header.cookie, is_dir)
+            if is_dir and source is None:
+                self.parent().watch(path)
+            elif is_dir:
+                # before reading on, later events must carry the new paths
+                self.parent().move_watches(source, path)
+        elif "IN_MOVED_FROM" in type_names:
+            batch.moved_from(path, header.cookie, is_dir)
+        elif "IN_DELETE" in type_names:
+            batch.deleted(path, is_dir)
+        elif any(name in type_names for name in MODIFY_EVENTS):
+            batch.modified(path)
+
+    def apply(self, conn, batch):
+        """Write `batch` and announce the changes. Returns False if it
+        failed, the batch is then kept and tried again later."""
+        start_time = time.time()
+        try:
+            changes = batch.apply(conn, self.parent())
+        except sqlite3.Error as e:
+            # e.g. still locked after waiting for a swap, nothing else
+            # would pick the changes up. The transaction was rolled back
+            # and every operation reads the disk again, so applying the
+            # batch once more is safe, events keep being added to it.
+            LOGGER.error(
+                f"Failed to apply {len(batch)} filesystem changes, retrying "
+                f"in {RETRY_INTERVAL:.0f}s: {e}"
+            )
+            batch.retry_at = time.monotonic() + RETRY_INTERVAL
+            return False
+        PENDING_CHANGES.set(0)
+        t_end = time.time() - start_time
+        APPLY_SECONDS.observe(t_end)
+        LAG_SECONDS.observe(time.monotonic() - batch.started)
+        EVENTS_APPLIED.inc(batch.events)
+        LOGGER.debug(f"Applied {len(batch)} filesystem changes in {t_end:.3f}s")
+        self.parent().indexChanged.emit(changes)
+        return True
 
 
 class FileMonitor(QObject):
+    """Keeps the index in sync with the filesystem."""
 
-    fileAdded = Signal(str)
-    fileDeleted = Signal(str)
+    indexChanged = Signal(object)
+    watchesAdded = Signal(int, int)
+    # events were lost, the database has to be updated by a scan
+    rescanRequested = Signal()
 
     def __init__(self):
         """Initialises the file monitor"""
         QObject.__init__(self)
-        self.directories = get_subdirs()
-        self.ino = inotify.adapters.Inotify()
-        self.add_watchers()
+        # directories left to watch, registered by the worker in slices
+        # between reads of events
+        self.to_watch = deque()
+        self.registration_started = None
+        self.failed = 0
+        self.ino = Inotify(block_duration_s=self.block_duration)
+        # current path -> watch descriptor, and back
+        self.watched = {}
+        self.paths = {}
+        # the adapter reports and removes a watch by the path it was added
+        # with, also after the directory was renamed
+        self.added_as = {}
+        self.added = {}
+        # watches are registered by the worker once it runs
         self.worker = Worker(self)
 
-    def file_created(self, filepath):
-        """Forward file creation signal"""
-        self.fileAdded.emit(filepath)
+    def block_duration(self):
+        """Seconds to wait for events, none while watches are registered."""
+        return 0 if self.to_watch else POLL_INTERVAL
+
+    def watch(self, path):
+        """Watch `path`, returns False if inotify refused or it isn't
+        UTF-8."""
+        if path in self.watched:
+            return True
+        if not exclusions.is_utf8(path):
+            # the adapter encodes paths as UTF-8
+            LOGGER.debug(f"Can't watch {path!r}: not UTF-8")
+            return False
+        if path in self.added:
+            # a renamed directory was added with this path
+            self._add_again(self.added[path])
+        try:
+            wd = self.ino.add_watch(path)
+        except inotify.calls.InotifyError as e:
+            LOGGER.debug(f"Can't watch '{path}': {e}")
+            return False
+        self._track(wd, path)
+        return True
+
+    def _track(self, wd, path):
+        self.watched[path] = wd
+        self.paths[wd] = path
+        self.added_as[wd] = path
+        self.added[path] = wd
+
+    def _untrack(self, wd):
+        """Forget the watch `wd`, returns the path it was added with."""
+        path = self.paths.pop(wd)
+        if self.watched.get(path) == wd:
+            del self.watched[path]
+        added = self.added_as.pop(wd)
+        del self.added[added]
+        return added
+
+    def _add_again(self, wd):
+        """Add the watch of a renamed directory again with its current
+        path, so its old one can be watched. Events of the directory in
+        between are lost, this only happens when a name is reused."""
+        path = self.paths[wd]
+        try:
+            self.ino.remove_watch(self._untrack(wd))
+            self._track(self.ino.add_watch(path), path)
+        except (inotify.calls.InotifyError, UnicodeEncodeError) as e:
+            LOGGER.debug(f"Can't watch '{path}' again: {e}")
+
+    def move_watches(self, old_path, new_path):
+        """Follow a renamed directory, the watches themselves stay. The
+        adapter keeps reporting their old paths, `Worker.handle` looks up
+        the current ones by watch descriptor."""
+        prefix = os.path.join(old_path, "")
+        moved = [p for p in self.watched if p == old_path or p.startswith(prefix)]
+        for old in moved:
+            wd = self.watched.pop(old)
+            new = new_path + old[len(old_path) :]
+            self.watched[new] = wd
+            self.paths[wd] = new
+
+    def unwatch(self, path):
+        """Stop watching `path`."""
+        wd = self.watched.get(path)
+        if wd is None:
+            return
+        try:
+            self.ino.remove_watch(self._untrack(wd))
+        except inotify.calls.InotifyError:
+            # the kernel already dropped the watch of a deleted directory
+            pass
+
+    def unwatch_subtree(self, path):
+        """Stop watching `path` and the directories below it."""
+        prefix = os.path.join(path, "")
+        for watched in [p for p in self.watched if p == path or p.startswith(prefix)]:
+            self.unwatch(watched)
 
-    def file_deleted(self, filepath):
-        """Forward file deletion signal"""
-        self.fileDeleted.emit(filepath)
+    def add_watchers(self, conn, options):
+        """Queue every indexed directory to be watched, most recently
+        modified first so the directories most likely to change are
+        covered soonest. The worker registers them with `watch_slice`."""
+        self.to_watch = deque(watched_directories(conn, options))
+        self.registration_started = time.time()
+        self.failed = 0
+        limit = max_user_watches()
+        if limit is not None and len(self.to_watch) > limit:
+            LOGGER.warning(
+                f"{len(self.to_watch):,} directories to watch, but "
+                f"fs.inotify.max_user_watches is {limit:,}. The least recently "
+                "modified directories won't receive live updates."
+            )
 
-    def add_watchers(self):
-        """Add directories to inotify watch instance"""
-        for d in self.directories:
-            self.ino.add_watch(d)
-        l = len(self.directories)
-        LOGGER.info(f"Starting to monitor {l} directories...")
+    def watch_slice(self):
+        """Watch the next `WATCH_SLICE` queued directories, announces the
+        result once all of them are registered."""
+        for _ in range(min(WATCH_SLICE, len(self.to_watch))):
+            path = self.to_watch.popleft()
+            if not self.watch(path):
+                self.failed += 1
+                if exclusions.is_utf8(path) and os.access(path, os.R_OK):
+                    # readable directories only fail once the limit is
+                    # reached, the remaining ones would fail as well
+                    self.failed += len(self.to_watch)
+                    self.to_watch.clear()
+        WATCHES.set(len(self.watched), state="watched")
+        if self.to_watch:
+            return
+        t_end = time.time() - self.registration_started
+        LOGGER.info(
+            f"Monitoring {len(self.watched):,} directories, {self.failed:,} could "
+            f"not be watched. Time elapsed: {t_end:.2f}s"
+        )
+        WATCHES.set(self.failed, state="failed")
+        self.watchesAdded.emit(len(self.watched), self.failed)
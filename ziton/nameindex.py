@@ -0,0 +1,295 @@
+"""
+Compact in-memory name index, an alternative to searching sqlite.
+
+All filenames live in one NUL separated byte buffer, everything else in
+flat `array` columns indexed by entry number, so there are no per entry
+Python objects. Searches are bulk `bytes.find` scans over an ASCII case
+folded copy of the buffer, which matches the case insensitivity of LIKE,
+or over the buffer itself for case sensitive searches.
+"""
+
+import logging
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+
+from ziton import patterns
+from ziton.database import DirectoryTree
+
+LOGGER = logging.getLogger(__name__)
+
+SEPARATOR = b"\0"
+# hits processed between two checks for cancellation
+CANCEL_CHECK_INTERVAL = 4096
+
+
+class SearchCancelled(Exception):
+    """Raised when a search was cancelled before it finished."""
+
+
+class NameIndex:
+    """Array backed index over all entries of the `files` table."""
+
+    def __init__(self):
+        # leading separator so every name is enclosed by separators
+        self.names = bytearray(SEPARATOR)
+        self.folded = bytearray(SEPARATOR)
+        # offsets[i] is the start of name i, offsets[-1] the end of the buffer
+        self.offsets = array("q", [1])
+        # parent entry number, or -1 - k for a path prefix in `roots`
+        self.parents = array("q")
+        self.sizes = array("q")
+        self.mtimes = array("q")
+        self.alive = bytearray()
+        self.is_dir = bytearray()
+        self.roots = []
+        self.root_ids = {}
+        # entry numbers ordered by parent and the parent of each, built by
+        # the first lookup by path
+        self.by_parent = None
+        self.sorted_parents = None
+        # path -> entry number of the entries added after that
+        self.live = {}
+
+    def __len__(self):
+        return len(self.parents)
+
+    @classmethod
+    def from_database(cls, conn):
+        """Load every entry of the `files` table."""
+        start_time = time.time()
+        index = cls()
+        # (parent id, name) of every directory -> its id in `dirs`
+        dir_keys = {}
+        roots = {}
+        for dir_id, parent_id, name in conn.execute(
+            "SELECT id, parent_id, name FROM dirs;"
+        ):
+            if parent_id is None:
+                roots[dir_id] = name.rstrip("/")
+            else:
+                dir_keys[(parent_id, name)] = dir_id
+        # directory id -> entry number, filled in while loading
+        dir_entries = {}
+        unresolved = []
+        cursor = conn.execute("SELECT dir_id, filename, size, modified FROM files;")
+        for dir_id, filename, size, modified in cursor:
+            own_id = dir_keys.get((dir_id, filename))
+            number = index._append(filename, -1, size, modified, own_id is not None)
+            if own_id is not None:
+                dir_entries[own_id] = number
+            parent = dir_entries.get(dir_id)
+            if parent is None:
+                # parent not loaded yet or a root of the index
+                unresolved.append((number, dir_id))
+            else:
+                index.parents[number] = parent
+        for number, dir_id in unresolved:
+            parent = dir_entries.get(dir_id)
+            if parent is None:
+                # a root, or a directory without an entry of its own
+                root = roots.get(dir_id)
+                if root is None:
+                    root = DirectoryTree(conn).dir_path(dir_id)
+                parent = index._root_id(root)
+            index.parents[number] = parent
+        t_end = time.time() - start_time
+        LOGGER.info(f"Name index loaded in {t_end:.2f}s. {index.memory_report()}")
+        return index
+
+    def _root_id(self, path):
+        """Parent code for entries directly below `path`."""
+        if path not in self.root_ids:
+            self.roots.append(path)
+            self.root_ids[path] = -len(self.roots)
+        return self.root_ids[path]
+
+    def _append(self, filename, parent, size, modified, is_dir=False):
+        name = filename.encode("utf-8", "surrogateescape")
+        self.names += name + SEPARATOR
+        self.folded += name.lower() + SEPARATOR
+        self.offsets.append(len(self.names))
+        self.parents.append(parent)
+        self.sizes.append(int(size))
+        self.mtimes.append(int(modified))
+        self.alive.append(1)
+        self.is_dir.append(1 if is_dir else 0)
+        return len(self.parents) - 1
+
+    def name(self, number):
+        """Filename of entry `number`."""
+        start, end = self.offsets[number], self.offsets[number + 1] - 1
+        return self.names[start:end].decode("utf-8", "surrogateescape")
+
+    def path(self, number):
+        """Full path of entry `number`, rebuilt from its ancestors."""
+        parts = []
+        while number >= 0:
+            parts.append(self.name(number))
+            number = self.parents[number]
+        parts.append(self.roots[-number - 1])
+        return "/".join(reversed(parts))
+
+    def entry(self, number):
+        """`(filename, filepath, size, modified, is_dir)` of entry `number`."""
+        return (
+            self.name(number),
+            self.path(number),
+            self.sizes[number],
+            self.mtimes[number],
+            self.is_dir[number],
+        )
+
+    def sort_key(self, column):
+        """Key function ordering entry numbers by a result column, one of
+        `ziton.search.SORT_COLUMNS`. Names are compared ASCII case folded."""
+        if column == "size":
+            return self.sizes.__getitem__
+        if column == "modified":
+            return self.mtimes.__getitem__
+        folded, offsets = self.folded, self.offsets
+        return lambda number: folded[offsets[number] : offsets[number + 1] - 1]
+
+    def _find(self, needle, cancelled=None, buffer=None):
+        """Entry numbers whose folded name, or name in `buffer`, contains
+        `needle`."""
+        hits = array("q")
+        folded = self.folded if buffer is None else buffer
+        offsets = self.offsets
+        pos = folded.find(needle)
+        while pos != -1:
+            number = bisect_right(offsets, pos) - 1
+            hits.append(number)
+            if cancelled and len(hits) % CANCEL_CHECK_INTERVAL == 0 and cancelled():
+                raise SearchCancelled()
+            # continue with the next name, one hit per entry is enough
+            pos = folded.find(needle, offsets[number + 1])
+        return hits
+
+    def search(
+        self, pattern, cancelled=None, mode=patterns.TEXT, case_sensitive=False
+    ):
+        """Entry numbers whose name contains every term of `pattern`, or
+        matches it as a glob or regex.
+
+        `cancelled` is polled while scanning, if it returns True the
+        search is aborted with `SearchCancelled`."""
+        regex = None
+        if mode == patterns.TEXT:
+            terms = pattern.split()
+        else:
+            regex = patterns.compile_pattern(pattern, mode, case_sensitive)
+            terms, ignore_case = patterns.required_literals(pattern, mode)
+            case_sensitive = case_sensitive and not ignore_case
+            if not case_sensitive:
+                # the folded buffer is ASCII only, unlike `re.IGNORECASE`
+                terms = [t for t in terms if t.isascii()]
+        buffer = self.names if case_sensitive else self.folded
+        terms = [t.encode("utf-8", "surrogateescape") for t in terms]
+        if not case_sensitive:
+            terms = [t.lower() for t in terms]
+        offsets, alive = self.offsets, self.alive
+        if terms:
+            # scan for the longest term, the others are checked per hit
+            terms.sort(key=len, reverse=True)
+            first, rest = terms[0], terms[1:]
+            candidates = (
+                number
+                for number in self._find(first, cancelled, buffer)
+                if alive[number]
+                and all(
+                    term in buffer[offsets[number] : offsets[number + 1] - 1]
+                    for term in rest
+                )
+            )
+        else:
+            candidates = compress(range(len(self)), alive)
+        if regex is None:
+            return array("q", candidates)
+        hits = array("q")
+        for checked, number in enumerate(candidates, 1):
+            if regex.search(self.name(number)):
+                hits.append(number)
+            if cancelled and checked % CANCEL_CHECK_INTERVAL == 0 and cancelled():
+                raise SearchCancelled()
+        return hits
+
+    def add(self, entry):
+        """Append a `DatabaseEntry` created after the index was loaded."""
+        filename, filepath = entry.filename, entry.filepath
+        parent = self._root_id(filepath[: len(filepath) - len(filename) - 1])
+        number = self._append(
+            filename, parent, entry.size, entry.modified, entry.is_dir
+        )
+        if self.by_parent is not None:
+            self.live[filepath] = number
+
+    def _child(self, parent, name):
+        """Number of the entry `name` below the parent code `parent`, one
+        that wasn't removed if there are several, None if there is none."""
+        if self.by_parent is None:
+            parents = self.parents
+            order = sorted(range(len(self)), key=parents.__getitem__)
+            self.by_parent = array("q", order)
+            self.sorted_parents = array("q", (parents[n] for n in order))
+        name = name.encode("utf-8", "surrogateescape")
+        names, offsets, alive = self.names, self.offsets, self.alive
+        start = bisect_left(self.sorted_parents, parent)
+        end = bisect_right(self.sorted_parents, parent, start)
+        found = None
+        for number in self.by_parent[start:end]:
+            if names[offsets[number] : offsets[number + 1] - 1] == name:
+                if alive[number]:
+                    return number
+                found = number
+        return found
+
+    def lookup(self, filepath):
+        """Number of the live entry for `filepath`, None if there is none.
+
+        Walks down from the root the path is below, looking up each name
+        among the children of the entry before it."""
+        number = self.live.get(filepath)
+        if number is not None:
+            return number if self.alive[number] else None
+        for root, code in sorted(self.root_ids.items(), key=lambda r: -len(r[0])):
+            if not filepath.startswith(root + "/"):
+                continue
+            number = code
+            for name in filepath[len(root) + 1 :].split("/"):
+                number = self._child(number, name)
+                if number is None:
+                    break
+            else:
+                return number if self.alive[number] else None
+        return None
+
+    def remove(self, filepath):
+        """Mark the entry for `filepath` as deleted."""
+        number = self.lookup(filepath)
+        if number is not None:
+            self.alive[number] = 0
+            self.live.pop(filepath, None)
+
+    def memory_usage(self):
+        """Bytes used by the buffers and arrays."""
+        arrays = [self.offsets, self.parents, self.sizes, self.mtimes]
+        if self.by_parent is not None:
+            arrays += [self.by_parent, self.sorted_parents]
+        return (
+            len(self.names)
+            + len(self.folded)
+            + len(self.alive)
+            + len(self.is_dir)
+            + sum(a.itemsize * len(a) for a in arrays)
+        )
+
+    def memory_report(self):
+        """Human readable memory usage, absolute and per million entries."""
+        total = self.memory_usage() / 1024 ** 2
+        per_million = total / max(len(self), 1) * 1_000_000
+        return (
+            f"{len(self):,} entries, {total:.1f} MB "
+            f"({per_million:.1f} MB per million entries)"
+        )
@@ -0,0 +1,148 @@
+"""
+Glob and regular expression search patterns.
+
+Both are matched with Python's `re` against filenames. To keep that off
+most rows, `required_literals` pulls out the substrings every match has
+to contain, the backends narrow the candidates with those first.
+"""
+
+import fnmatch
+import re
+from functools import lru_cache
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:
+    # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# search modes, plain text matches every whitespace separated term
+TEXT = "text"
+GLOB = "glob"
+REGEX = "regex"
+MODES = (TEXT, GLOB, REGEX)
+
+# distinct patterns kept compiled
+CACHE_SIZE = 128
+
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_constants, name)
+)
+
+
+class InvalidPattern(ValueError):
+    """Raised for a pattern that doesn't compile."""
+
+
+def flags_for(case_sensitive):
+    """`re` flags of a search."""
+    return 0 if case_sensitive else re.IGNORECASE
+
+
+def regex_source(pattern, mode):
+    """Regular expression for `pattern`, globs match whole filenames."""
+    if mode == GLOB:
+        return r"\A" + fnmatch.translate(pattern)
+    return pattern
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compiled(source, flags):
+    """Cached `re.compile`, also used for every row sqlite checks."""
+    return re.compile(source, flags)
+
+
+def compile_pattern(pattern, mode, case_sensitive):
+    """Compiled regular expression for a glob or regex search."""
+    try:
+        return compiled(regex_source(pattern, mode), flags_for(case_sensitive))
+    except re.error as e:
+        raise InvalidPattern(f"Invalid {mode} '{pattern}': {e}") from e
+
+
+def regexp(source, flags, value):
+    """SQLite function `regexp(source, flags, filename)`."""
+    return value is not None and compiled(source, flags).search(value) is not None
+
+
+def _glob_literals(pattern):
+    literals, current = [], []
+    position, end = 0, len(pattern)
+    while position < end:
+        char = pattern[position]
+        if char in "*?":
+            literals.append("".join(current))
+            current = []
+        elif char == "[":
+            # same rules as fnmatch, a "[" without a "]" is literal
+            close = position + 1
+            if pattern[close : close + 1] == "!":
+                close += 1
+            if pattern[close : close + 1] == "]":
+                close += 1
+            close = pattern.find("]", close)
+            if close == -1:
+                current.append(char)
+            else:
+                literals.append("".join(current))
+                current = []
+                position = close
+        else:
+            current.append(char)
+        position += 1
+    literals.append("".join(current))
+    return literals
+
+
+def _regex_literals(parsed):
+    literals, current = [], []
+
+    def cut():
+        literals.append("".join(current))
+        current.clear()
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_constants.LITERAL:
+                current.append(chr(av))
+            elif op is sre_constants.AT:
+                # anchors and boundaries are zero width
+                continue
+            elif op is sre_constants.SUBPATTERN:
+                _, add_flags, del_flags, items = av
+                if add_flags or del_flags:
+                    cut()
+                else:
+                    walk(items)
+            elif op in _REPEATS:
+                low, _, items = av
+                cut()
+                if low:
+                    # at least one repetition is in every match
+                    walk(items)
+                    cut()
+            else:
+                cut()
+
+    walk(parsed)
+    cut()
+    return literals
+
+
+def required_literals(pattern, mode):
+    """Substrings every filename matched by `pattern` contains.
+
+    Returns `(literals, ignore_case)`, `ignore_case` is True if a regex
+    turns on case insensitive matching itself, e.g. with `(?i)`."""
+    if mode == GLOB:
+        return [t for t in _glob_literals(pattern) if t], False
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as e:
+        raise InvalidPattern(f"Invalid regex '{pattern}': {e}") from e
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+    return [t for t in _regex_literals(parsed) if t], ignore_case
@@ -0,0 +1,273 @@
+"""
+Parallel filesystem scanner that feeds the database rebuild.
+
+The included directories are split into subtrees which are listed
+concurrently by a thread or process pool. Every task lists a bounded
+number of directories and hands the remaining frontier back to the
+scheduler, so a single huge subtree still gets spread across workers.
+
+Tasks stop at mount points. The scheduler keeps a frontier and a pool
+per device, sized by the kind of the device (see `ziton.devices`), so
+all devices are listed at the same time and none gets more concurrent
+listings than it handles well.
+
+Entries are filtered with the rules of `ziton.exclusions` while they are
+listed, excluded directories are never descended into.
+"""
+
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass
+
+from ziton import devices, exclusions, metrics
+
+LOGGER = logging.getLogger(__name__)
+
+# directories a single task lists before returning its frontier
+DIRS_PER_TASK = 64
+
+# listing a single directory slower than this is logged, e.g. slow mounts
+SLOW_DIRECTORY = 1.0
+
+PHASE_SECONDS = metrics.histogram(
+    "ziton_index_phase_seconds",
+    "Time spent per indexing phase, per scan task or written batch",
+    ("phase",),
+)
+SCANNED_DIRECTORIES = metrics.counter(
+    "ziton_scanned_directories_total", "Directories listed by the scanner"
+)
+SCANNED_ENTRIES = metrics.counter(
+    "ziton_scanned_entries_total", "Files and directories found by the scanner"
+)
+SCAN_FRONTIER = metrics.gauge(
+    "ziton_scan_frontier", "Directories found but not handed to a scan task yet"
+)
+SCAN_TASKS = metrics.gauge("ziton_scan_tasks", "Scan tasks submitted or running")
+
+
+@dataclass(frozen=True)
+class ScanOptions:
+    """Filter settings shared by all scan tasks (must stay picklable)."""
+
+    index_hidden: bool
+    # compiled rules of the configuration, see `ziton.exclusions`
+    rules: exclusions.RuleSet
+    # included directories, ignore files above them don't apply
+    roots: tuple = ()
+    # directories below which another filesystem starts, they are left
+    # to a task of their own, or not listed at all with `one_filesystem`
+    mount_points: frozenset = frozenset()
+    one_filesystem: bool = False
+
+
+def scan_subtree(root, options, max_dirs=DIRS_PER_TASK, timings=None, rules=None):
+    """List up to `max_dirs` directories below `root`, depth first.
+
+    Returns a tuple `(records, directories, frontier)`. Records are
+    `(filename, filepath, size, modified, dev, ino)` rows, directories
+    are `(path, mtime_ns)` pairs of every listed directory and frontier
+    contains the directories that were found but not listed yet. The
+    seconds spent are added to the "scan" and "stat" keys of `timings`
+    if given. `rules` are the `exclusions.Exclusions` to filter with, new
+    ones for `options` if None."""
+    records = []
+    directories = []
+    stack = [root]
+    if rules is None:
+        rules = exclusions.Exclusions(options)
+    # mount points found, listed by other tasks
+    crossed = []
+    listed = 0
+    clock = time.perf_counter
+    while stack and listed < max_dirs:
+        current = stack.pop()
+        listed += 1
+        started = clock()
+        stat_time = 0.0
+        try:
+            # stat before listing so changes made during the scan are
+            # picked up by the next incremental update
+            dir_info = os.stat(current)
+            entries = os.scandir(current)
+        except OSError as e:
+            LOGGER.debug(f"Skipping '{current}': {e}")
+            continue
+        directories.append((current, dir_info.st_mtime_ns))
+        dev = dir_info.st_dev
+        with entries:
+            entries = list(entries)
+            # an ignore file applies to the entries next to it already
+            has_file = any(e.name == exclusions.IGNORE_FILE for e in entries)
+            rules.chain(current, has_file)
+            for entry in entries:
+                name = entry.name
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if rules.excluded(current, name, is_dir):
+                    continue
+                if is_dir:
+                    path = entry.path
+                    records.append((name, path, 0, 0, dev, entry.inode()))
+                    # same as os.walk: list symlinked directories, don't follow
+                    if entry.is_symlink():
+                        continue
+                    if path not in options.mount_points:
+                        stack.append(path)
+                    elif not options.one_filesystem:
+                        crossed.append(path)
+                    continue
+                try:
+                    # DirEntry caches the result, one stat call per file
+                    if timings is None:
+                        f_info = entry.stat()
+                    else:
+                        stat_start = clock()
+                        f_info = entry.stat()
+                        stat_time += clock() - stat_start
+                except OSError:
+                    # broken symlink or file vanished while scanning
+                    continue
+                records.append(
+                    (
+                        name,
+                        entry.path,
+                        int(f_info.st_size),
+                        int(f_info.st_mtime),
+                        dev,
+                        entry.inode(),
+                    )
+                )
+        elapsed = clock() - started
+        if elapsed > SLOW_DIRECTORY:
+            LOGGER.warning(f"Listing '{current}' took {elapsed:.2f}s")
+        if timings is not None:
+            timings["scan"] += elapsed - stat_time
+            timings["stat"] += stat_time
+    return records, directories, stack + crossed
+
+
+def timed_scan_subtree(root, options, chain=None):
+    """`scan_subtree` task that also returns its timings, and the ignore
+    files above every directory of the frontier (see
+    `exclusions.Exclusions.chain`). `chain` are the ones above `root`,
+    they are read if None."""
+    timings = {"scan": 0.0, "stat": 0.0}
+    rules = exclusions.Exclusions(options)
+    if chain is not None:
+        rules.seed(os.path.dirname(root), chain)
+    result = scan_subtree(root, options, timings=timings, rules=rules)
+    chains = {path: rules.chain(os.path.dirname(path)) for path in result[2]}
+    return result, timings, chains
+
+
+class DeviceQueue:
+    """Directories left to list on one device, and the pool listing them."""
+
+    def __init__(self, mount, kind, workers, pool_cls):
+        self.mount = mount
+        self.kind = kind
+        self.workers = workers
+        self.pool = pool_cls(max_workers=workers)
+        self.frontier = deque()
+        self.running = 0
+
+    def submit(self, options, chains):
+        """Start a task for the most recently found directory, LIFO keeps
+        the frontier small (depth first across tasks). `chains` are the
+        ignore files above the directories found by earlier tasks."""
+        self.running += 1
+        directory = self.frontier.pop()
+        return self.pool.submit(
+            timed_scan_subtree, directory, options, chains.pop(directory, None)
+        )
+
+    def busy(self):
+        """True if enough tasks are in flight to keep the pool busy."""
+        return self.running >= self.workers * 2
+
+
+def scan(directories, options, workers=0, use_processes=False, limits=None):
+    """Scan `directories` in parallel.
+
+    Yields the `(records, directories, frontier)` of every task (see
+    `scan_subtree`) as soon as it finishes, the frontier is scanned by
+    later tasks. Every device (`st_dev`) is listed by a pool of its own
+    with `limits[kind]` workers, at most `workers`. The number of tasks
+    in flight is bounded so a slow consumer throttles the scan instead
+    of piling up results in memory."""
+    if not workers:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    limits = limits or {}
+    pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    mounts = devices.read_mounts()
+    # st_dev -> queue, and mount point -> queue of its device
+    queues, by_mount = {}, {}
+
+    def queue_of(path):
+        mount = devices.mount_of(path, mounts)
+        mount_point = path if mount is None else mount.path
+        queue = by_mount.get(mount_point)
+        if queue is None:
+            try:
+                device = os.stat(mount_point).st_dev
+            except OSError:
+                device = mount_point
+            queue = queues.get(device)
+            if queue is None:
+                kind = devices.kind(mount)
+                count = min(workers, limits.get(kind) or workers)
+                queue = queues[device] = DeviceQueue(
+                    mount_point, kind, count, pool_cls
+                )
+                LOGGER.info(
+                    f"Scanning '{mount_point}' ({kind}) with {count} "
+                    f"{'processes' if use_processes else 'threads'}..."
+                )
+            by_mount[mount_point] = queue
+        return queue
+
+    for directory in directories:
+        queue_of(directory).frontier.append(directory)
+    LOGGER.info(f"Scanning {len(directories)} directories on {len(queues)} devices")
+    # future -> queue of its device
+    running = {}
+    # frontier directory -> ignore files above it, read by the task that
+    # found it, so no task reads the files above its directory again
+    chains = {}
+    try:
+        while running or any(queue.frontier for queue in queues.values()):
+            for queue in queues.values():
+                while queue.frontier and not queue.busy():
+                    running[queue.submit(options, chains)] = queue
+            SCAN_FRONTIER.set(sum(len(queue.frontier) for queue in queues.values()))
+            SCAN_TASKS.set(len(running))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                queue = running.pop(future)
+                queue.running -= 1
+                (records, listed, remaining), timings, found = future.result()
+                chains.update(found)
+                for phase, seconds in timings.items():
+                    PHASE_SECONDS.observe(seconds, phase=phase)
+                SCANNED_DIRECTORIES.inc(len(listed))
+                SCANNED_ENTRIES.inc(len(records))
+                for path in remaining:
+                    target = queue_of(path) if path in mounts else queue
+                    target.frontier.append(path)
+                yield records, listed, remaining
+    finally:
+        for queue in queues.values():
+            queue.pool.shutdown()
+        SCAN_FRONTIER.set(0)
+        SCAN_TASKS.set(0)
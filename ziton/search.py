@@ -0,0 +1,397 @@
+"""
+Search backends and the translation of search patterns into SQL filters
+for the `files` table.
+"""
+
+import heapq
+import logging
+import os
+import sqlite3
+from array import array
+from dataclasses import dataclass
+
+from ziton import metrics, patterns
+from ziton.config import CONFIG
+from ziton.database import DirectoryTree
+from ziton.nameindex import NameIndex, SearchCancelled
+
+LOGGER = logging.getLogger(__name__)
+
+# the trigram tokenizer can't match terms shorter than this
+MIN_TRIGRAM_LENGTH = 3
+# cheap query to check if the trigram index is usable on a connection
+FTS_PROBE = "SELECT rowid FROM files_fts WHERE files_fts MATCH 'zit' LIMIT 1"
+# number of trigram matches, up to a limit
+FTS_MATCHES = """SELECT COUNT(*) FROM
+    (SELECT 1 FROM files_fts WHERE files_fts MATCH ? LIMIT ?);"""
+# searches slower than this (in seconds) are logged
+SLOW_SEARCH = 1.0
+# sorted searches with more trigram matches than this walk the sort index
+SORTED_FTS_LIMIT = 10000
+
+# sortable columns -> the columns the rows are ordered by, unique together
+# and matching an index. Paths can't be sorted, the normalized schema has
+# no path column and directory ids follow the order of the scan.
+SORT_KEYS = {
+    "name": ("files.filename COLLATE NOCASE", "files.dir_id", "files.filename"),
+    "size": ("files.size", "files.filename", "files.dir_id"),
+    "modified": ("files.modified", "files.filename", "files.dir_id"),
+}
+SORT_COLUMNS = tuple(SORT_KEYS)
+
+SEARCH_SECONDS = metrics.histogram(
+    "ziton_search_seconds",
+    "Search latency until the first page and until the total count",
+    ("stage",),
+)
+
+
+def observe_search(pattern, stage, seconds):
+    """Record the latency of a search, logging slow ones."""
+    SEARCH_SECONDS.observe(seconds, stage=stage)
+    if seconds > SLOW_SEARCH:
+        LOGGER.warning(f"Slow search '{pattern}' ({stage}): {seconds:.2f}s")
+
+
+@dataclass
+class SqlFilter:
+    """Parts of a query selecting the files that match a pattern."""
+
+    source: str
+    conditions: list
+    params: list
+    # columns the results are ordered and paged by, unique together
+    key: tuple = ("files.rowid",)
+    descending: bool = False
+
+
+def like_escape(text):
+    """Escape LIKE wildcards so `text` is matched literally."""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def fts_phrase(term):
+    """Quote `term` as an FTS5 string, matched as a plain substring."""
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def execute(conn, query, params=()):
+    """Run a search query, raises `SearchCancelled` if it was interrupted."""
+    try:
+        return conn.execute(query, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted":
+            raise SearchCancelled() from e
+        raise
+
+
+def build_filter(
+    pattern, use_fts=True, mode=patterns.TEXT, case_sensitive=False, sort=None
+):
+    """Filter matching filenames that contain every whitespace separated
+    term of `pattern`, in any order, or that match a glob or regex.
+    `sort` is a `(column, descending)` pair, see `SORT_KEYS`.
+
+    Terms with at least three characters are looked up in the trigram
+    index, shorter terms (or all of them if `use_fts` is off) fall back
+    to a LIKE scan. Both ignore case, case sensitive searches check the
+    terms with `instr` as well. Globs and regexes are matched by the
+    `regexp` function, after the same lookup of the literal substrings
+    every match contains."""
+    regex = None
+    if mode == patterns.TEXT:
+        terms = pattern.split()
+    else:
+        regex = patterns.compile_pattern(pattern, mode, case_sensitive)
+        flags = patterns.flags_for(case_sensitive)
+        terms, ignore_case = patterns.required_literals(pattern, mode)
+        case_sensitive = case_sensitive and not ignore_case
+        if not case_sensitive:
+            # LIKE folds ASCII only, unlike `re.IGNORECASE`
+            terms = [t for t in terms if t.isascii()]
+    indexed = [t for t in terms if use_fts and len(t) >= MIN_TRIGRAM_LENGTH]
+    sql_filter = SqlFilter("files", [], [])
+    if indexed:
+        # drive the query from the trigram index, it pages by its rowid
+        sql_filter.source = "files_fts JOIN files ON files.rowid = files_fts.rowid"
+        sql_filter.key = ("files_fts.rowid",)
+        sql_filter.conditions.append("files_fts MATCH ?")
+        sql_filter.params.append(" AND ".join(fts_phrase(t) for t in indexed))
+    for term in terms:
+        if case_sensitive:
+            sql_filter.conditions.append("instr(files.filename, ?) > 0")
+            sql_filter.params.append(term)
+        elif term not in indexed:
+            sql_filter.conditions.append("files.filename LIKE ? ESCAPE '\\'")
+            sql_filter.params.append("%" + like_escape(term) + "%")
+    if regex is not None:
+        sql_filter.conditions.append("regexp(?, ?, files.filename)")
+        sql_filter.params.extend([regex.pattern, flags])
+    if sort is not None:
+        column, sql_filter.descending = sort
+        sql_filter.key = SORT_KEYS[column]
+    return sql_filter
+
+
+class SqliteResult:
+    """Rows of the `files` table matching one search.
+
+    Slices are fetched with keyset (seek) queries: the key of the last row
+    of every fetched slice is remembered, so the next slice starts with an
+    index seek instead of skipping all rows before it with OFFSET. Sorted
+    results are paged the same way along the index of the sort column.
+    Full paths are only put together for the rows of fetched slices."""
+
+    def __init__(self, conn, sql_filter, tree):
+        self.conn = conn
+        self.filter = sql_filter
+        self.tree = tree
+        self.total = None
+        # row position -> key of the row at that position
+        self.anchors = {}
+
+    def _execute(self, query, params=()):
+        return execute(self.conn, query, params)
+
+    def _order(self, reverse=False):
+        direction = "DESC" if self.filter.descending != reverse else "ASC"
+        return ", ".join(f"{column} {direction}" for column in self.filter.key)
+
+    def _collated(self):
+        # sqlite can't seek along a row value with a collation
+        return "COLLATE" in self.filter.key[0]
+
+    def _after(self):
+        # rows behind a remembered key in the order of the result
+        columns = ", ".join(self.filter.key)
+        marks = ", ".join("?" for _ in self.filter.key)
+        after = "<" if self.filter.descending else ">"
+        condition = f"({columns}) {after} ({marks})"
+        if self._collated():
+            # a bound on the first column alone can be used to seek
+            condition = f"{self.filter.key[0]} {after}= ? AND {condition}"
+        return condition
+
+    def _anchor_params(self, anchor):
+        key = list(self.anchors[anchor])
+        return key[:1] + key if self._collated() else key
+
+    def _where(self, extra=None):
+        conditions = list(self.filter.conditions)
+        if extra:
+            conditions.append(extra)
+        return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    def count(self):
+        """Total number of matches."""
+        query = f"SELECT COUNT(*) FROM {self.filter.source} {self._where()};"
+        self.total = self._execute(query, self.filter.params)[0][0]
+        return self.total
+
+    def rows(self, start, limit):
+        """`(filename, filepath, size, modified, is_dir)` tuples of a slice."""
+        if self.total is not None and start >= self.total:
+            return []
+        columns = f"""files.filename, files.dir_id, files.size, files.modified,
+            EXISTS (SELECT 1 FROM dirs
+                WHERE parent_id = files.dir_id AND name = files.filename),
+            {", ".join(self.filter.key)}"""
+        # nearest remembered position in front of the slice
+        before = [p for p in self.anchors if p < start]
+        anchor = max(before) if before else -1
+        if self.total is not None and self.total - start < start - anchor:
+            # closer to the end, seek backwards from the last row
+            skip = max(self.total - start - limit, 0)
+            limit = min(limit, self.total - start)
+            query = f"""SELECT {columns} FROM {self.filter.source} {self._where()}
+                ORDER BY {self._order(reverse=True)} LIMIT ? OFFSET ?;"""
+            rows = self._execute(query, self.filter.params + [limit, skip])
+            rows.reverse()
+        elif anchor >= 0:
+            query = f"""SELECT {columns} FROM {self.filter.source}
+                {self._where(self._after())} ORDER BY {self._order()}
+                LIMIT ? OFFSET ?;"""
+            params = self.filter.params + self._anchor_params(anchor) + [limit]
+            rows = self._execute(query, params + [start - anchor - 1])
+        else:
+            query = f"""SELECT {columns} FROM {self.filter.source} {self._where()}
+                ORDER BY {self._order()} LIMIT ? OFFSET ?;"""
+            rows = self._execute(query, self.filter.params + [limit, start])
+        if rows:
+            self.anchors[start + len(rows) - 1] = rows[-1][5:]
+        return [
+            (name, os.path.join(self.tree.dir_path(dir_id) or "", name), *rest)
+            for name, dir_id, *rest in (row[:5] for row in rows)
+        ]
+
+
+def file_identity(path):
+    """`(st_dev, st_ino)` of `path`, None if it doesn't exist."""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return info.st_dev, info.st_ino
+
+
+class SqliteBackend:
+    """Searches the `files` table, using the trigram index if possible."""
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        self.identity = file_identity(self.path)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.create_function("regexp", 3, patterns.regexp, deterministic=True)
+        self.tree = DirectoryTree(self.conn)
+        self.use_fts = self._fts_usable()
+
+    def _fts_usable(self):
+        try:
+            self.conn.execute(FTS_PROBE)
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def search(
+        self,
+        pattern,
+        cancelled=None,
+        mode=patterns.TEXT,
+        case_sensitive=False,
+        sort=None,
+    ):
+        """Start a search, returns a result object for paging. Queries run
+        lazily and are cancelled through `interrupt`.
+
+        Sorted searches driven by the trigram index have to sort all of
+        its matches. If there are many, walking the index of the sort
+        column and checking the filenames finds the first rows sooner."""
+        sql_filter = build_filter(pattern, self.use_fts, mode, case_sensitive, sort)
+        if sort is not None and "files_fts" in sql_filter.source:
+            params = [sql_filter.params[0], SORTED_FTS_LIMIT]
+            if execute(self.conn, FTS_MATCHES, params)[0][0] >= SORTED_FTS_LIMIT:
+                sql_filter = build_filter(pattern, False, mode, case_sensitive, sort)
+        return SqliteResult(self.conn, sql_filter, self.tree)
+
+    def interrupt(self):
+        """Abort the query currently running, safe to call from any thread."""
+        self.conn.interrupt()
+
+    def reload(self):
+        """Pick up a rebuilt index and a trigram index created since the
+        backend was opened. Reconnects if the database file was replaced,
+        e.g. after it was found corrupt."""
+        if file_identity(self.path) != self.identity:
+            self._open()
+            return
+        self.tree.forget()
+        self.use_fts = self._fts_usable()
+
+    def add(self, entry):
+        """Live updates are written to sqlite, nothing to do here."""
+
+    def remove(self, filepath):
+        """Live updates are written to sqlite, nothing to do here."""
+
+    def apply_changes(self, changes):
+        """Live updates are written to sqlite, nothing to reload. Cached
+        directory paths are dropped if directories moved."""
+        if changes.restructured:
+            self.tree.forget()
+        return False
+
+
+class MemoryResult:
+    """Entries of the in-memory index matching one search.
+
+    Sorted results are only sorted completely once a slice behind the
+    first one is requested, the first one just selects its rows."""
+
+    def __init__(self, index, numbers, sort=None):
+        self.index = index
+        self.numbers = numbers
+        self.sort = sort
+        self.ordered = sort is None
+
+    def count(self):
+        """Total number of matches."""
+        return len(self.numbers)
+
+    def rows(self, start, limit):
+        """`(filename, filepath, size, modified, is_dir)` tuples of a slice."""
+        numbers = self.numbers
+        if not self.ordered:
+            column, descending = self.sort
+            key = self.index.sort_key(column)
+            if start == 0 and limit < len(numbers):
+                select = heapq.nlargest if descending else heapq.nsmallest
+                numbers = select(limit, numbers, key)
+            else:
+                numbers = sorted(numbers, key=key, reverse=descending)
+                self.numbers, self.ordered = array("q", numbers), True
+        return [self.index.entry(n) for n in numbers[start : start + limit]]
+
+
+class MemoryBackend:
+    """Searches a `NameIndex` loaded from the database.
+
+    The index is loaded by the first `reload`, which the search worker
+    runs on its thread before the first search, so opening the backend
+    doesn't block the window from showing."""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+
+    def search(
+        self,
+        pattern,
+        cancelled=None,
+        mode=patterns.TEXT,
+        case_sensitive=False,
+        sort=None,
+    ):
+        """Start a search, returns a result object for paging. The scan
+        polls `cancelled` and raises `SearchCancelled` when it is set."""
+        numbers = self.index.search(pattern, cancelled, mode, case_sensitive)
+        return MemoryResult(self.index, numbers, sort)
+
+    def interrupt(self):
+        """Scans are cancelled through the `cancelled` callback."""
+
+    def reload(self):
+        """Load the index again, e.g. after the database was rebuilt."""
+        conn = sqlite3.connect(self.path)
+        self.index = NameIndex.from_database(conn)
+        conn.close()
+
+    def add(self, entry):
+        """Mirror a live file creation."""
+        self.index.add(entry)
+
+    def remove(self, filepath):
+        """Mirror a live file deletion."""
+        if self.index is not None:
+            self.index.remove(filepath)
+
+    def apply_changes(self, changes):
+        """Mirror a batch of live updates, returns True if it moved whole
+        subtrees and the index has to be reloaded instead. Also True while
+        the index isn't loaded yet, the load may have missed the batch."""
+        if changes.restructured or self.index is None:
+            return True
+        for filepath in changes.removed:
+            self.index.remove(filepath)
+        for entry in changes.added:
+            self.index.add(entry)
+        return False
+
+
+def open_backend():
+    """Create the search backend selected in the configuration."""
+    if CONFIG.search_backend == "memory":
+        return MemoryBackend(CONFIG.database_path)
+    return SqliteBackend(CONFIG.database_path)
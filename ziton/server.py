@@ -0,0 +1,175 @@
+"""
+Query server, keeps the search backend loaded and answers searches over
+a Unix domain socket. See `ziton.client` for the protocol.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from ziton import metrics, patterns, search
+from ziton.client import SOCKET_PATH
+from ziton.config import CONFIG
+
+LOGGER = logging.getLogger(__name__)
+
+# rows fetched from the backend at a time while streaming a result
+PAGE_SIZE = 1000
+
+
+def database_mtime():
+    """Last modification of the database, including its journal."""
+    mtimes = []
+    for path in (CONFIG.database_path, CONFIG.database_path + "-wal"):
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def is_running(socket_path):
+    """Check if a server is already listening on `socket_path`."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """Answers the search request of one connection."""
+
+    def send(self, rows):
+        lines = "".join(json.dumps(row) + "\n" for row in rows)
+        self.wfile.write(lines.encode())
+
+    def handle(self):
+        try:
+            self.answer(self.rfile.readline())
+        except ConnectionError:
+            # the client stopped reading
+            pass
+
+    def answer(self, line):
+        if not line:
+            # connection probe, see `is_running`
+            return
+        try:
+            request = json.loads(line)
+            pattern = str(request.get("pattern") or "")
+            limit = request.get("limit")
+            mode = request.get("mode") or patterns.TEXT
+            case_sensitive = bool(request.get("case_sensitive"))
+            sort = request.get("sort")
+            if mode not in patterns.MODES:
+                raise ValueError(f"unknown mode '{mode}'")
+            if sort is not None:
+                column, descending = sort
+                if column not in search.SORT_COLUMNS:
+                    raise ValueError(f"unknown sort column '{column}'")
+                sort = (column, bool(descending))
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send([{"error": f"Invalid request: {e}"}])
+            return
+        try:
+            for rows in self.server.search(
+                pattern, limit, mode, case_sensitive, sort
+            ):
+                self.send(rows)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Query '{pattern}' failed: {e}")
+            self.send([{"error": str(e)}])
+
+
+class QueryServer(socketserver.ThreadingUnixStreamServer):
+    """Serves searches from one shared backend.
+
+    The backend is only locked while a page of results is fetched, so a
+    slow client doesn't block the others."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, backend):
+        super().__init__(socket_path, QueryHandler)
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.database_mtime = database_mtime()
+
+    def reload_if_changed(self):
+        """Pick up rebuilds and live updates written by the application."""
+        mtime = database_mtime()
+        if mtime != self.database_mtime:
+            self.database_mtime = mtime
+            self.backend.reload()
+
+    def search(
+        self, pattern, limit=None, mode=patterns.TEXT, case_sensitive=False, sort=None
+    ):
+        """Yield the matches of `pattern` page by page."""
+        with self.lock:
+            self.reload_if_changed()
+            started = time.perf_counter()
+            result = self.backend.search(pattern, None, mode, case_sensitive, sort)
+        start = 0
+        while limit is None or start < limit:
+            size = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - start)
+            with self.lock:
+                rows = result.rows(start, size)
+            if not start:
+                search.observe_search(
+                    pattern, "first_page", time.perf_counter() - started
+                )
+            if not rows:
+                return
+            yield rows
+            start += len(rows)
+
+
+def main(argv=None):
+    """Entry point of `python -m ziton serve`."""
+    parser = argparse.ArgumentParser(
+        prog="python -m ziton serve",
+        description="Answer searches over a Unix domain socket.",
+    )
+    parser.add_argument("--socket", default=SOCKET_PATH, help="socket path")
+    args = parser.parse_args(argv)
+
+    if is_running(args.socket):
+        LOGGER.error(f"A query server is already listening on '{args.socket}'")
+        return 1
+    if os.path.exists(args.socket):
+        # left behind by a server that was killed
+        os.remove(args.socket)
+    backend = search.open_backend()
+    # load the index up front, not on the first query
+    backend.reload()
+    if CONFIG.metrics_file:
+        metrics.start_dumping(CONFIG.metrics_file)
+    # the index lists all of the user's files, keep the socket private
+    umask = os.umask(0o177)
+    try:
+        server = QueryServer(args.socket, backend)
+    finally:
+        os.umask(umask)
+    LOGGER.info(f"Serving queries on '{args.socket}'...")
+    # clean up the socket when terminated, too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+    return 0
@@ -9,8 +9,8 @@ from pathlib import PurePath
 
 import ziton.database as db
 import ziton.icons as icons
+from PySide2.QtCore import Signal
 from PySide2.QtGui import QIcon
-from PySide2.QtSql import QSqlQuery
 from PySide2.QtWidgets import QAction, QMenu
 
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +20,8 @@ LOGGER = logging.getLogger(__name__)
 class RightClickMenu(QMenu):
     """Represents the tableview's context menu."""
 
+    fileDeleted = Signal(str)
+
     def __init__(self, filepath, position):
         QMenu.__init__(self)
         self.filepath = filepath
@@ -44,13 +46,11 @@ class RightClickMenu(QMenu):
     def remove_record(self):
         "remove record from the table."
         LOGGER.info("deleting row from table...")
-        query = QSqlQuery()
-        query.prepare("DELETE FROM files WHERE filepath=?")
-        query.bindValue(0, self.filepath)
-        query.exec_()
+        db.delete_entry(self.filepath)
 
     def delete_file(self):
         """Deletes a file from disk."""
         os.remove(self.filepath)
         self.remove_record()
+        self.fileDeleted.emit(self.filepath)
         LOGGER.info(f"deleting {self.filepath}...")
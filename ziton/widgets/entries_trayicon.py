@@ -26,6 +26,8 @@ class TrayEntryInfo(QWidget):
         # label for file count
         self.filecount = QLabel()
         self.update_filecount()
+        # number of matches of the current search
+        self.result_count = QLabel()
         self.spacer_item = QSpacerItem(
             40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum
         )
@@ -35,6 +37,7 @@ class TrayEntryInfo(QWidget):
         # set layout
         self.layout.addWidget(self.selected)
         self.layout.addItem(self.spacer_item)
+        self.layout.addWidget(self.result_count)
         self.layout.addWidget(self.db_icon_label)
         self.layout.addWidget(self.filecount)
         self.setLayout(self.layout)
@@ -62,3 +65,16 @@ class TrayEntryInfo(QWidget):
         "Updates filecount label in the main view."
         rows = number_of_rows()
         self.filecount.setText(f"{rows:,} Items")
+
+    @Slot(int)
+    def update_result_count(self, count):
+        "Shows how many entries match the current search."
+        self.result_count.setText(f"{count:,} Matches")
+
+    @Slot(int, int)
+    def update_watch_status(self, watched, failed):
+        "Shows how many directories receive live updates."
+        text = f"Live updates for {watched:,} directories"
+        if failed:
+            text += f", {failed:,} could not be watched"
+        self.filecount.setToolTip(text)
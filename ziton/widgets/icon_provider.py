@@ -1,13 +1,150 @@
 """
 Module to provide QT icon related functionality
 """
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+from PySide2.QtCore import QMimeDatabase, QObject, Signal
+from PySide2.QtGui import QIcon
 from PySide2.QtWidgets import QFileIconProvider
 
+import ziton.icons as icons
 
-class IconProvider(QFileIconProvider):
-    "Qt Iconprovider subclass for the filename in the tableview."
+LOGGER = logging.getLogger(__name__)
 
-    def icon(self, fileinfo):
-        "returns the files icon."
-        return QFileIconProvider.icon(self, fileinfo)
+# extension -> bundled icon
+BUNDLED_ICONS = {
+    "7z": icons.ARCHIVE,
+    "appimage": icons.APPLICATION,
+    "avi": icons.VIDEO_PLAYER,
+    "bash": icons.GNU_BASH,
+    "bmp": icons.PICTURE,
+    "bz2": icons.TAR,
+    "c": icons.C,
+    "cc": icons.CPP,
+    "cpp": icons.CPP,
+    "css": icons.CSS,
+    "csv": icons.CSV,
+    "cxx": icons.CPP,
+    "db": icons.DATABASE,
+    "exe": icons.APPLICATION,
+    "flac": icons.AUDIO,
+    "gif": icons.GIF,
+    "gz": icons.TAR,
+    "h": icons.C,
+    "hpp": icons.CPP,
+    "hs": icons.HASKELL,
+    "htm": icons.HTML,
+    "html": icons.HTML,
+    "java": icons.JAVA,
+    "jpeg": icons.JPG,
+    "jpg": icons.JPG,
+    "json": icons.JSON_FILE,
+    "log": icons.TEXT_LINES,
+    "md": icons.TEXT_LINES,
+    "mkv": icons.VIDEO_PLAYER,
+    "mov": icons.VIDEO_PLAYER,
+    "mp3": icons.AUDIO,
+    "mp4": icons.VIDEO_PLAYER,
+    "ogg": icons.AUDIO,
+    "otf": icons.FONT,
+    "pdf": icons.PDF,
+    "png": icons.PNG,
+    "py": icons.PYTHON,
+    "rar": icons.RAR,
+    "rb": icons.RUBY,
+    "sh": icons.GNU_BASH,
+    "sqlite": icons.DATABASE,
+    "svg": icons.PICTURE,
+    "tar": icons.TAR,
+    "tex": icons.TEX_FILE_FORMAT,
+    "tgz": icons.TAR,
+    "ttf": icons.FONT,
+    "txt": icons.TEXT_LINES,
+    "wav": icons.AUDIO,
+    "webm": icons.VIDEO_PLAYER,
+    "webp": icons.PICTURE,
+    "woff": icons.FONT,
+    "xml": icons.XML,
+    "xz": icons.TAR,
+    "zip": icons.ZIP,
+}
+
+
+def mime_icon_names(extension):
+    """Theme icon names for `extension`, looked up by name only."""
+    mime = QMimeDatabase().mimeTypeForFile(
+        f"file.{extension}", QMimeDatabase.MatchExtension
+    )
+    return mime.iconName(), mime.genericIconName()
+
+
+class IconProvider(QObject):
+    """Icons for the filename column, cached by directory/extension.
+
+    Resolving an icon never touches the filesystem: directories and
+    known extensions map to the bundled icons, other extensions are
+    looked up in the MIME database by name on a background thread and
+    show the generic file icon until `iconResolved` is emitted."""
+
+    CACHE_SIZE = 512
+    DIRECTORY = "/"
+
+    iconResolved = Signal()
+    mimeResolved = Signal(str, object)
+
+    def __init__(self, parent=None):
+        QObject.__init__(self, parent)
+        self.cache = OrderedDict()
+        self.pending = set()
+        self.file_icon = QFileIconProvider().icon(QFileIconProvider.File)
+        self.lookup = ThreadPoolExecutor(max_workers=1)
+        # delivered on the GUI thread, QIcon must be created there
+        self.mimeResolved.connect(self.store_mime_icon)
+
+    def _remember(self, key, icon):
+        self.cache[key] = icon
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return icon
+
+    def icon(self, filename, is_dir=False):
+        "returns the icon for a file or directory name."
+        if is_dir:
+            key = self.DIRECTORY
+        else:
+            _, dot, extension = filename.rpartition(".")
+            key = extension.lower() if dot else ""
+        icon = self.cache.get(key)
+        if icon is not None:
+            self.cache.move_to_end(key)
+            return icon
+        if key == self.DIRECTORY:
+            return self._remember(key, QIcon(str(icons.FOLDER)))
+        if key in BUNDLED_ICONS:
+            return self._remember(key, QIcon(str(BUNDLED_ICONS[key])))
+        if key and key not in self.pending:
+            self.pending.add(key)
+            future = self.lookup.submit(mime_icon_names, key)
+            future.add_done_callback(lambda f, key=key: self.mime_looked_up(key, f))
+        return self.file_icon
+
+    def mime_looked_up(self, key, future):
+        """Pass on the icon names found for an extension, no names if the
+        lookup failed so the generic file icon is cached for it."""
+        try:
+            names = future.result()
+        except Exception as e:
+            LOGGER.debug(f"MIME lookup of '.{key}' failed: {e}")
+            names = ("", "")
+        self.mimeResolved.emit(key, names)
+
+    def store_mime_icon(self, key, names):
+        """Cache the theme icon found for an extension."""
+        self.pending.discard(key)
+        icon_name, generic_name = names
+        icon = QIcon.fromTheme(icon_name, QIcon.fromTheme(generic_name))
+        self._remember(key, self.file_icon if icon.isNull() else icon)
+        self.iconResolved.emit()
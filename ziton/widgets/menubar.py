@@ -2,54 +2,77 @@
 Widget that represents the menubar.
 """
 import logging
-import pathlib
 
 import ziton.database as db
 import ziton.icons as icons
 from PySide2.QtCore import QCoreApplication, QThread, Signal
 from PySide2.QtGui import QIcon
-from PySide2.QtWidgets import QMenu, QSizePolicy, QToolBar, QWidget
-from ziton.config import database_path
-from ziton.widgets.icon_provider import IconProvider
-from ziton.widgets.preferences import PreferenceDialog
+from PySide2.QtWidgets import QComboBox, QMenu, QSizePolicy, QToolBar, QWidget
+from ziton.patterns import GLOB, REGEX, TEXT
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
 
 class Worker(QThread):
-    """Qt Worker Thread, responsible for handling one inotify thread."""
+    """Qt Worker Thread, runs a database update in the background."""
 
     finished = Signal()
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, task=db.update_database):
         super().__init__(parent)
+        self.task = task
 
     def run(self):
         try:
-            path = pathlib.PosixPath(database_path())
-            db.build_database()
+            self.task()
             self.parent().update_finished()
             LOGGER.info("db update finished!")
             self.finished.emit()
         except Exception as e:
-            LOGGER.error(f"Error: {e}, trying again...")
-            db.remove_database()
-            db.build_database()
+            # e.g. locked or a full disk, the existing index stays in use
+            LOGGER.error(f"Database update failed: {e}")
+            try:
+                # an unfinished rebuild resumes from its checkpoint at the
+                # next start, unless the failure left it corrupt
+                db.check_shadow()
+                # removes and rebuilds the index only if it is corrupt
+                if db.validate_database(resume=False):
+                    self.parent().update_finished()
+            except Exception as e:
+                LOGGER.error(f"Database check failed: {e}")
             self.finished.emit()
 
 
+class DuplicateWorker(QThread):
+    """Qt Worker Thread, searches duplicate files in the background."""
+
+    found = Signal(object)
+
+    def run(self):
+        import ziton.duplicates as duplicates
+
+        try:
+            self.found.emit(duplicates.find_duplicates())
+        except Exception as e:
+            LOGGER.error(f"Duplicate search failed: {e}")
+            self.found.emit(None)
+
+
 class Menubar(QToolBar):
     """Menubar widget."""
 
     dbUpdated = Signal(str)
     worker_finished = Signal()
+    caseChanged = Signal(bool)
+    modeChanged = Signal(str)
+    duplicatesFound = Signal(object)
 
     def __init__(self, worker):
         """Initialises the menu bar."""
         self.file_worker = worker
-        # data
-        self.icon_provider = IconProvider()
+        # run another update once the current one finished
+        self.update_requested = False
         # widgets
         self.spacer = QWidget()
         self.spacer.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
@@ -66,6 +89,23 @@ class Menubar(QToolBar):
         self.pref_action.setToolTip("Settings")
         self.addSeparator()
 
+        self.case_action = self.addAction("Match Case", self.case_action_clicked)
+        self.case_action.setCheckable(True)
+        self.case_action.setToolTip("Case sensitive search")
+        self.mode_box = QComboBox()
+        for text, mode in (("Text", TEXT), ("Glob", GLOB), ("Regex", REGEX)):
+            self.mode_box.addItem(text, mode)
+        self.mode_box.setToolTip("Match terms, a glob or a regular expression")
+        self.mode_box.currentIndexChanged.connect(self.mode_selected)
+        self.addWidget(self.mode_box)
+        self.addSeparator()
+
+        self.duplicates_action = self.addAction(
+            "Duplicates", self.duplicates_action_clicked
+        )
+        self.duplicates_action.setToolTip("Show files with identical content")
+        self.addSeparator()
+
         self.addWidget(self.spacer)
         self.quit_action = self.addAction("Quit", self.quit_app)
         self.quit_action.setIcon(QIcon(str(icons.LOGOUT)))
@@ -73,13 +113,25 @@ class Menubar(QToolBar):
 
     def quit_app(self):
         """quit the application gracefully"""
-        self.file_worker.terminate()
+        self.file_worker.stop()
         self.file_worker.wait()
         QCoreApplication.quit()
 
     def work_done(self):
         """propagate worker signal"""
+        self.update_action.setEnabled(True)
         self.worker_finished.emit()
+        if self.update_requested:
+            self.update_requested = False
+            self.start_update(db.update_database)
+
+    def request_update(self):
+        """Update the database, e.g. after live updates were lost. Waits
+        for the update in progress, if there is one."""
+        if self.update_action.isEnabled():
+            self.start_update(db.update_database)
+        else:
+            self.update_requested = True
 
     def update_finished(self):
         """Update finished signal."""
@@ -87,16 +139,40 @@ class Menubar(QToolBar):
 
     def rebuild_btn_clicked(self):
         """Update the entire database."""
+        self.start_update(db.update_database)
+
+    def start_update(self, task):
+        """Run the database update `task` in a worker thread."""
+        self.update_action.setEnabled(False)
         self.dbUpdated.emit("Updating DB ...")
-        self.thread = Worker(self)
+        self.thread = Worker(self, task)
         self.thread.finished.connect(self.work_done)
         self.thread.start()
 
     def preferences_action_clicked(self):
         """Preference dialog button click event."""
+        # QtUiTools is only loaded once the dialog is opened
+        from ziton.widgets.preferences import PreferenceDialog
+
         self.preferences = PreferenceDialog()
 
+    def duplicates_action_clicked(self):
+        """Search duplicate files in a worker thread."""
+        self.duplicates_action.setEnabled(False)
+        self.duplicate_worker = DuplicateWorker(self)
+        self.duplicate_worker.found.connect(self.duplicates_searched)
+        self.duplicate_worker.start()
+
+    def duplicates_searched(self, result):
+        """Pass on the duplicates once the search is done."""
+        self.duplicates_action.setEnabled(True)
+        if result is not None:
+            self.duplicatesFound.emit(result)
+
     def case_action_clicked(self):
         """Turn case sensitivity on or off"""
-        b = self.case_action.isChecked()
-        self.case_action.setChecked(b)
+        self.caseChanged.emit(self.case_action.isChecked())
+
+    def mode_selected(self, index):
+        """Switch the search mode."""
+        self.modeChanged.emit(self.mode_box.itemData(index))
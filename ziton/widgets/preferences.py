@@ -52,11 +52,11 @@ class PreferenceDialog:
         self.save_btn.clicked.connect(self.save_configuration)
         self.close_btn.clicked.connect(self.window.accept)
         # load existing config
-        for directory in cfg.included_directories():
+        for directory in cfg.CONFIG.included_directories:
             self.insert_row(directory)
-        self.update_startup_box.setChecked(cfg.start_updated_enabled())
-        self.live_indexing_box.setChecked(cfg.is_indexing_enabled())
-        self.hidden_indexing_box.setChecked(cfg.hidden_files_enabled())
+        self.update_startup_box.setChecked(cfg.CONFIG.index_on_startup)
+        self.live_indexing_box.setChecked(cfg.CONFIG.live_updates)
+        self.hidden_indexing_box.setChecked(cfg.CONFIG.hidden_files)
 
         self.window.exec_()
 
@@ -95,9 +95,9 @@ class PreferenceDialog:
             "index_on_startup": self.update_startup_box.isChecked(),
             "live_updates": self.live_indexing_box.isChecked(),
             "hidden_files": self.hidden_indexing_box.isChecked(),
-            "database_path": cfg.database_path(),
-            "excluded_folders": cfg.excluded_folders(),
-            "excluded_directories": cfg.excluded_directories(),
+            "database_path": cfg.CONFIG.database_path,
+            "excluded_folders": cfg.CONFIG.excluded_folders,
+            "excluded_directories": cfg.CONFIG.excluded_directories,
             "min_on_launch": self.min_on_launch_btn.isChecked()
         }
         cfg.save_configuration(current_config)
@@ -0,0 +1,155 @@
+"""
+Background thread that runs searches off the GUI thread.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from PySide2.QtCore import QThread, Signal
+
+from ziton.patterns import TEXT, InvalidPattern
+from ziton.search import SearchCancelled, observe_search
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SearchWorker(QThread):
+    """Owns the search backend and runs all queries against it.
+
+    Every search gets a new generation number. A newer search cancels the
+    one in flight, results of older generations are never emitted."""
+
+    firstPage = Signal(int, object)
+    windowReady = Signal(int, int, object)
+    countReady = Signal(int, int)
+
+    def __init__(self, backend, window_size, parent=None):
+        super().__init__(parent)
+        self.backend = backend
+        self.window_size = window_size
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.pending = None
+        self.windows = deque()
+        # backends load their index here, not on the thread creating them
+        self.reload_requested = True
+        self.stopped = False
+        # only touched by the worker thread
+        self.result = None
+        self.result_generation = -1
+
+    def search(self, pattern, mode=TEXT, case_sensitive=False, sort=None):
+        """Queue a search for `pattern`, returns its generation."""
+        with self.condition:
+            self.generation += 1
+            self.pending = partial(
+                self.run_search, self.generation, pattern, mode, case_sensitive, sort
+            )
+            self.windows.clear()
+            self.backend.interrupt()
+            self.condition.notify()
+            return self.generation
+
+    def show(self, result):
+        """Queue showing a result computed elsewhere, e.g. the groups of
+        duplicate files, returns its generation."""
+        with self.condition:
+            self.generation += 1
+            self.pending = partial(self.run_show, self.generation, result)
+            self.windows.clear()
+            self.backend.interrupt()
+            self.condition.notify()
+            return self.generation
+
+    def fetch_window(self, generation, window):
+        """Queue loading rows `window * window_size` and following."""
+        with self.condition:
+            self.windows.append((generation, window))
+            self.condition.notify()
+
+    def reload(self):
+        """Reload the backend before the next search."""
+        with self.condition:
+            self.reload_requested = True
+            self.condition.notify()
+
+    def stop(self):
+        """Finish the thread, cancelling what is running."""
+        with self.condition:
+            self.stopped = True
+            self.backend.interrupt()
+            self.condition.notify()
+
+    def cancelled(self, generation):
+        """Callback for backends that poll for cancellation."""
+        return self.stopped or generation != self.generation
+
+    def run(self):
+        """Process queued work until stopped."""
+        while True:
+            with self.condition:
+                while not (
+                    self.stopped
+                    or self.pending
+                    or self.windows
+                    or self.reload_requested
+                ):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                reload, self.reload_requested = self.reload_requested, False
+                search, self.pending = self.pending, None
+                # newest request first, it is closest to the viewport
+                window = self.windows.pop() if not search and self.windows else None
+            try:
+                if reload:
+                    self.backend.reload()
+                if search:
+                    search()
+                elif window:
+                    self.run_window(*window)
+            except SearchCancelled:
+                continue
+            except Exception as e:
+                LOGGER.error(f"Search failed: {e}")
+
+    def run_search(self, generation, pattern, mode, case_sensitive, sort):
+        """Emit the first page as soon as possible, then the total count."""
+        start = time.perf_counter()
+        try:
+            result = self.backend.search(
+                pattern,
+                lambda: self.cancelled(generation),
+                mode,
+                case_sensitive,
+                sort,
+            )
+        except InvalidPattern as e:
+            # e.g. a regex that is still being typed, show no matches
+            LOGGER.debug(e)
+            self.firstPage.emit(generation, [])
+            self.countReady.emit(generation, 0)
+            return
+        rows = result.rows(0, self.window_size)
+        observe_search(pattern, "first_page", time.perf_counter() - start)
+        self.result, self.result_generation = result, generation
+        self.firstPage.emit(generation, rows)
+        count = result.count()
+        observe_search(pattern, "count", time.perf_counter() - start)
+        self.countReady.emit(generation, count)
+
+    def run_show(self, generation, result):
+        """Emit the first page and the count of a finished result."""
+        rows = result.rows(0, self.window_size)
+        self.result, self.result_generation = result, generation
+        self.firstPage.emit(generation, rows)
+        self.countReady.emit(generation, result.count())
+
+    def run_window(self, generation, window):
+        """Load one window of the current result."""
+        if generation != self.result_generation:
+            return
+        rows = self.result.rows(window * self.window_size, self.window_size)
+        self.windowReady.emit(generation, window, rows)
@@ -0,0 +1,66 @@
+"""
+Widget that shows the most important metrics below the info tray.
+"""
+
+from PySide2.QtCore import QTimer, Slot
+from PySide2.QtWidgets import QHBoxLayout, QLabel, QWidget
+
+import ziton.database as db
+import ziton.monitor as monitor
+import ziton.scanner as scanner
+import ziton.search as search
+
+
+def format_ms(seconds):
+    """Display string for a histogram bucket bound."""
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return "slow"
+    return f"{seconds * 1000:,.0f}ms"
+
+
+class StatsPanel(QWidget):
+    """Rebuild, search and live update statistics, refreshed every second."""
+
+    REFRESH_INTERVAL = 1000
+
+    def __init__(self):
+        QWidget.__init__(self)
+        self.layout = QHBoxLayout()
+        self.rebuild = QLabel()
+        self.searches = QLabel()
+        self.live_updates = QLabel()
+        self.queues = QLabel()
+        for label in (self.rebuild, self.searches, self.live_updates, self.queues):
+            self.layout.addWidget(label)
+        self.setLayout(self.layout)
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.update_stats)
+        self.timer.start()
+        self.update_stats()
+
+    @Slot()
+    def update_stats(self):
+        "Show the current values of the metrics."
+        seconds = db.LAST_REBUILD.get(total="seconds")
+        if seconds:
+            rate = db.LAST_REBUILD.get(total="entries_per_second")
+            self.rebuild.setText(f"Rebuild: {seconds:.1f}s, {rate:,.0f} entries/s")
+        else:
+            self.rebuild.setText("Rebuild: -")
+        latency = search.SEARCH_SECONDS
+        self.searches.setText(
+            f"Search p50 {format_ms(latency.quantile(0.5, stage='first_page'))}, "
+            f"p95 {format_ms(latency.quantile(0.95, stage='first_page'))}"
+        )
+        self.live_updates.setText(
+            f"Events: {monitor.EVENTS_RECEIVED.get():,} received, "
+            f"{monitor.EVENTS_APPLIED.get():,} applied, "
+            f"{monitor.EVENTS_DROPPED.get():,} dropped"
+        )
+        self.queues.setText(
+            f"Pending: {monitor.PENDING_CHANGES.get():,} changes, "
+            f"{scanner.SCAN_FRONTIER.get():,} directories"
+        )
@@ -7,70 +7,206 @@ import shutil
 import subprocess
 from datetime import datetime
 
-from PySide2.QtCore import QItemSelectionModel, Qt, Signal, Slot
-from PySide2.QtSql import QSqlQuery, QSqlTableModel
+from PySide2.QtCore import (
+    QAbstractTableModel,
+    QCoreApplication,
+    QItemSelectionModel,
+    QModelIndex,
+    Qt,
+    QTimer,
+    Signal,
+    Slot,
+)
 from PySide2.QtWidgets import QAbstractItemView, QHeaderView, QTableView
 from ziton.database import dbrecord_from_path
-from ziton.widgets.contextmenu import RightClickMenu
+from ziton.patterns import TEXT
 from ziton.widgets.icon_provider import IconProvider
-from ziton.config import minimize_on_open
+from ziton.widgets.search_worker import SearchWorker
+from ziton.config import CONFIG
 
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 
 
-class TableModel(QSqlTableModel):
-    """Standard Sql model with custom icons for the filename column."""
+def format_size(size):
+    """Display string for a file size."""
+    return "" if size == 0 else "{:,} KB".format(int(size / 1000))
+
+
+def format_modified(modified):
+    """Display string for a modification timestamp."""
+    if modified == 0:
+        return ""
+    return datetime.fromtimestamp(modified).strftime("%Y-%m-%d-%H:%M")
+
+
+class TableModel(QAbstractTableModel):
+    """Virtual model over the search results delivered by the search worker.
+
+    Rows are loaded in fixed windows when they are first painted, with
+    their display strings formatted once per window. Only a bounded number
+    of windows is kept, the ones farthest from the viewport are evicted,
+    so memory does not depend on the size of the result."""
+
+    HEADERS = ("Filename", "Filepath", "Filesize", "Last Modified")
+    # `ziton.search.SORT_COLUMNS` of the columns, None if it can't be sorted
+    SORT_COLUMNS = ("name", None, "size", "modified")
+    WINDOW_SIZE = 256
+    MAX_WINDOWS = 16
+
+    windowRequested = Signal(int, int)
+    sortRequested = Signal(int, bool)
 
     def __init__(self):
-        QSqlTableModel.__init__(self)
-        # initiate model
-        self.setTable("files")
-        self.select()
-        self.setEditStrategy(QSqlTableModel.OnManualSubmit)
-        self.setHeaderData(0, Qt.Horizontal, "Filename")
-        self.setHeaderData(1, Qt.Horizontal, "Filepath")
-        self.setHeaderData(2, Qt.Horizontal, "Filesize")
-        self.setHeaderData(3, Qt.Horizontal, "Last Modified")
-        self.icon_provider = IconProvider()
-        self.setEditStrategy(QSqlTableModel.OnFieldChange)
+        QAbstractTableModel.__init__(self)
+        self.generation = -1
+        self.total = 0
+        self.windows = {}
+        self.requested = set()
+        self.current_window = 0
+        self.icon_provider = IconProvider(self)
+        self.icon_provider.iconResolved.connect(self.icons_changed)
+
+    @staticmethod
+    def display_rows(rows):
+        """Precompute the display strings of a window."""
+        return [
+            (name, path, format_size(size), format_modified(modified), is_dir)
+            for name, path, size, modified, is_dir in rows
+        ]
+
+    @Slot(int, object)
+    def set_first_page(self, generation, rows):
+        """Replace the model contents with the first window of a new search,
+        the row count is extended once the total is known."""
+        if generation < self.generation:
+            return
+        self.beginResetModel()
+        self.generation = generation
+        self.total = len(rows)
+        self.windows = {0: self.display_rows(rows)}
+        self.requested = set()
+        self.current_window = 0
+        self.endResetModel()
+
+    @Slot(int, int)
+    def set_count(self, generation, count):
+        """Grow the model to the total number of matches."""
+        if generation != self.generation or count <= self.total:
+            return
+        self.beginInsertRows(QModelIndex(), self.total, count - 1)
+        self.total = count
+        self.endInsertRows()
+
+    @Slot(int, int, object)
+    def add_window(self, generation, window, rows):
+        """Store a window loaded by the search worker."""
+        if generation != self.generation:
+            return
+        self.requested.discard(window)
+        self.windows[window] = self.display_rows(rows)
+        # evict the windows farthest away from the viewport
+        while len(self.windows) > self.MAX_WINDOWS:
+            farthest = max(self.windows, key=lambda w: abs(w - self.current_window))
+            del self.windows[farthest]
+        first = window * self.WINDOW_SIZE
+        last = min(first + self.WINDOW_SIZE, self.total) - 1
+        if last >= first:
+            self.dataChanged.emit(
+                self.index(first, 0), self.index(last, len(self.HEADERS) - 1)
+            )
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sorting is done by the search backend, ask for a new search."""
+        self.sortRequested.emit(column, order == Qt.DescendingOrder)
+
+    @Slot()
+    def icons_changed(self):
+        """Repaint the filename column after an icon was resolved."""
+        for window, rows in self.windows.items():
+            first = window * self.WINDOW_SIZE
+            if rows:
+                self.dataChanged.emit(
+                    self.index(first, 0),
+                    self.index(first + len(rows) - 1, 0),
+                    [Qt.DecorationRole],
+                )
+
+    def row(self, row):
+        """Display tuple of `row`, requests its window if it isn't loaded."""
+        window = row // self.WINDOW_SIZE
+        self.current_window = window
+        rows = self.windows.get(window)
+        if rows is None:
+            if window not in self.requested:
+                self.requested.add(window)
+                self.windowRequested.emit(self.generation, window)
+            return None
+        offset = row % self.WINDOW_SIZE
+        return rows[offset] if offset < len(rows) else None
+
+    def rowCount(self, parent=QModelIndex()):
+        """total number of matches (as far as known)."""
+        return 0 if parent.isValid() else self.total
+
+    def columnCount(self, parent=QModelIndex()):
+        """filename, filepath, size and modification date."""
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """column titles."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
 
     def data(self, index, role=Qt.DisplayRole):
         """returns data for the given index."""
-        if index.column() == 0:
-            if role == Qt.DisplayRole:
-                return QSqlTableModel.data(self, index, role)
-            if role == Qt.DecorationRole:
-                idx = index.sibling(index.row(), 1)
-                path = super(TableModel, self).data(idx)
-                return self.icon_provider.icon(path)
-        if index.column() == 2:
-            if role == Qt.DisplayRole:
-                value = QSqlTableModel.data(self, index, role)
-                return "" if value == 0 else "{:,} KB".format(int(value / 1000))
-        if index.column() == 3:
-            if role == Qt.DisplayRole:
-                value = QSqlTableModel.data(self, index, role)
-                return (
-                    ""
-                    if value == 0
-                    else datetime.fromtimestamp(value).strftime("%Y-%m-%d-%H:%M")
-                )
-        return QSqlTableModel.data(self, index, role)
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.DecorationRole):
+            return None
+        row = self.row(index.row())
+        if row is None:
+            return None
+        if role == Qt.DecorationRole:
+            if index.column() == 0:
+                return self.icon_provider.icon(row[0], row[4])
+            return None
+        return row[index.column()]
 
 
 class Tableview(QTableView):
     """Subclass of QTableView to manage keyPressEvents."""
 
     tabPressed = Signal()
+    resultsCounted = Signal(int)
 
-    def __init__(self):
+    # typing pause in ms before a search starts
+    SEARCH_DELAY = 150
+
+    def __init__(self, backend):
         """initialises the Tableview class."""
         QTableView.__init__(self)
         # flags
         self.sensitivity = False
-        # model
+        self.mode = TEXT
+        # (column, descending), None keeps the order of the index
+        self.sort = None
+        self.pattern = ""
+        # model, filled by searches running on a worker thread
         self._model = TableModel()
+        self.search_worker = SearchWorker(backend, TableModel.WINDOW_SIZE, self)
+        self.search_worker.firstPage.connect(self._model.set_first_page)
+        self.search_worker.windowReady.connect(self._model.add_window)
+        self.search_worker.countReady.connect(self._model.set_count)
+        self.search_worker.countReady.connect(self.count_received)
+        self._model.windowRequested.connect(self.search_worker.fetch_window)
+        self._model.sortRequested.connect(self.set_sort)
+        QCoreApplication.instance().aboutToQuit.connect(self.stop_search)
+        self.search_worker.start()
+        # debounce keystrokes
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.start_search)
         # hide scrollbar
         self.horizontalScrollBar().setStyleSheet("QScrollBar {height:0px;}")
         self.verticalScrollBar().setStyleSheet("QScrollBar {width:0px;}")
@@ -79,22 +215,86 @@ class Tableview(QTableView):
         self.horizontalHeader().setStretchLastSection(True)
         self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.verticalHeader().setVisible(False)
-        self.setSortingEnabled(False)
+        # unsorted until a header is clicked, see `TableModel.sort`
+        self.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.setSortingEnabled(True)
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.setModel(self._model)
-        self.setColumnHidden(4, True)
+        # the first search is started by the owner with `start_search`,
+        # once it connected to the signals of the search worker
         self.show()
 
     @Slot(bool)
     def setCase(self, state):
-        """Keep track if case sensitivity is on or off"""
-        print(state)
+        """Turn case sensitivity on or off and search again."""
         self.sensitivity = state
+        self.start_search()
+
+    @Slot(str)
+    def setMode(self, mode):
+        """Switch between text, glob and regex search and search again."""
+        self.mode = mode
+        self.start_search()
+
+    @Slot(int, bool)
+    def set_sort(self, column, descending):
+        """Sort the results by a column and search again."""
+        key = TableModel.SORT_COLUMNS[column] if column >= 0 else None
+        if column >= 0 and key is None:
+            self.restore_sort_indicator()
+            return
+        self.sort = (key, descending) if key is not None else None
+        self.start_search()
+
+    def restore_sort_indicator(self):
+        """Show the current sort again after a click on a column that
+        can't be sorted."""
+        column, order = -1, Qt.AscendingOrder
+        if self.sort is not None:
+            column = TableModel.SORT_COLUMNS.index(self.sort[0])
+            order = Qt.DescendingOrder if self.sort[1] else Qt.AscendingOrder
+        header = self.horizontalHeader()
+        header.blockSignals(True)
+        header.setSortIndicator(column, order)
+        header.blockSignals(False)
 
     @Slot(str)
     def update_filter(self, pattern):
         """updates regex filter when searchtext changes."""
-        self.model().setFilter("filename like '%{}%'".format(pattern))
+        self.pattern = pattern
+        self.search_timer.start()
+
+    @Slot()
+    def start_search(self):
+        """hand the current pattern to the search worker."""
+        self.search_timer.stop()
+        self.search_worker.search(
+            self.pattern, self.mode, self.sensitivity, self.sort
+        )
+
+    @Slot(object)
+    def show_result(self, result):
+        """Show a result that isn't a search, until the next search."""
+        self.search_timer.stop()
+        self.search_worker.show(result)
+
+    @Slot()
+    def refresh(self):
+        """reload the search backend and run the current search again."""
+        self.search_worker.reload()
+        self.start_search()
+
+    @Slot(int, int)
+    def count_received(self, generation, count):
+        """forward the number of matches of the latest search."""
+        if generation == self.search_worker.generation:
+            self.resultsCounted.emit(count)
+
+    @Slot()
+    def stop_search(self):
+        """stop the search worker before the application quits."""
+        self.search_worker.stop()
+        self.search_worker.wait()
 
     def selected_file_path(self):
         """Get path of currently selected file."""
@@ -113,7 +313,7 @@ class Tableview(QTableView):
             else:
                 subprocess.run(["xdg-open", fpath], check=False)
             # minimize to tray if enabled
-            if minimize_on_open():
+            if CONFIG.min_on_launch:
                 self.showMinimized()
 
     def keyPressEvent(self, event):
@@ -143,9 +343,12 @@ class Tableview(QTableView):
         if btn == Qt.MouseButton.LeftButton:
             self.open_selected_file()
         elif btn == Qt.MouseButton.RightButton:
+            from ziton.widgets.contextmenu import RightClickMenu
+
             menu = RightClickMenu(self.selected_file_path(), pos)
+            menu.fileDeleted.connect(self.search_worker.backend.remove)
             menu.exec_(pos)
-            self._model.select()
+            self.start_search()
 
     def mousePressEvent(self, event):
         """Handle single click events."""
@@ -156,6 +359,9 @@ class Tableview(QTableView):
             idx = self.indexAt(rel_pos)
             self.selectRow(idx.row())
         elif btn == Qt.MouseButton.RightButton:
+            from ziton.widgets.contextmenu import RightClickMenu
+
             menu = RightClickMenu(self.selected_file_path(), pos)
+            menu.fileDeleted.connect(self.search_worker.backend.remove)
             menu.exec_(pos)
-            self._model.select()
+            self.start_search()